@@ -2,17 +2,21 @@ from lariat_agents.base.streaming_base.streaming_base_agent import StreamingBase
 from boto3_type_annotations import s3
 
 from lariat_agents.constants import (
+    EVENT_PAYLOAD_MEMORY_BUDGET_BYTES,
+    EVENT_PAYLOAD_OBJECT_CONCURRENCY,
+    EVENT_PAYLOAD_COMPUTE_PROCESSES,
     EVENT_PAYLOAD_OUTPUT_KEY_PREFIX,
     LARIAT_PAYLOAD_SOURCE,
     LARIAT_BASE_URL,
     PERSIST_UNIQUE_DIMENSION_VALUES,
+    STREAMING_WORKERS,
 )
 from lariat_agents.agent.event_payload.event_payload_query_builder import (
     EventPayloadQueryBuilder,
 )
-from datetime import datetime
 from lariat_agents.agent.event_payload.event_payload_types import (
     SupportedPayloadFormat,
+    ExecutionEngine,
 )
 from lariat_agents.agent.event_payload.event_payload_utils import (
     process_event_payload,
@@ -20,12 +24,20 @@ from lariat_agents.agent.event_payload.event_payload_utils import (
     PayloadSource,
     collect_payload_from_s3,
     collect_payload_from_gcs,
+    merge_payload_schemas,
 )
+from lariat_agents.agent.event_payload.event_payload_object import (
+    PayloadObjectFileSystem,
+)
+from lariat_agents.agent.event_payload.event_payload_routing import RoutingIndex
+from lariat_agents.base.streaming_base.streaming_result_writer import (
+    StreamingResultWriter,
+)
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import List
 import logging
-from pathlib import Path
-import time
-import hashlib
+import multiprocessing
+import os
 
 
 class EventPayloadAgent(StreamingBaseAgent):
@@ -52,196 +64,331 @@ class EventPayloadAgent(StreamingBaseAgent):
                 raw_dataset_names=None,
             ),
         )
+        # Compiled once, every object of every event is routed with a lookup
+        self.routing_index = RoutingIndex(self.yaml_config)
+        self.result_writer = StreamingResultWriter(
+            self.write_result, file_extension=self.sink.file_extension
+        )
+
+    def write_result(self, result_df, file_path):
+        self.write_data(result_df, source_file_path=file_path)
+
+    def match_record(self, record: EventPayload):
+        """
+        Match one of the event's objects to its dataset config, fetching its size and header
+        :return: dataset name (None when no config matches) and object information
+        """
+        bucket_name = record.bucket
+        object_key = record.object_key
+        if record.payload_source == PayloadSource.S3:
+            (
+                file_type,
+                fsspec_name,
+                compression,
+                config_name,
+                partition_fields_in_data,
+                content_length,
+            ) = collect_payload_from_s3(
+                self.routing_index, bucket_name, object_key, self.s3_handler
+            )
+        elif record.payload_source == PayloadSource.GCS:
+            (
+                file_type,
+                fsspec_name,
+                compression,
+                config_name,
+                partition_fields_in_data,
+                content_length,
+            ) = collect_payload_from_gcs(
+                self.routing_index, bucket_name, object_key, self.gcs_handler
+            )
+        else:
+            return None, (None, None, bucket_name, object_key, None, 0, None)
+        return config_name, (
+            fsspec_name,
+            partition_fields_in_data,
+            bucket_name,
+            object_key,
+            record.raw_event,
+            content_length,
+            compression,
+        )
 
     def schema_retrieval(self, event_info: List[EventPayload] = None):
-        output_schema_map = {}
+        """
+        Match the event's objects to the dataset configs. Objects are matched concurrently by up to
+        EVENT_PAYLOAD_OBJECT_CONCURRENCY threads. The schema of each object is inferred while its metrics are
+        computed (see execute_stream_metrics) so the object is only read once.
+        :param event_info:
+        :return: dataset name -> information of each of the dataset's objects, in event order
+        """
         name_data_map = {}
-        agent_config = self.yaml_config
-        for record in event_info:
-            if record.payload_source == PayloadSource.S3:
-                bucket_name = record.bucket
+        with ThreadPoolExecutor(
+            max_workers=max(1, EVENT_PAYLOAD_OBJECT_CONCURRENCY)
+        ) as executor:
+            for config_name, object_info in executor.map(
+                self.match_record, event_info or []
+            ):
+                if config_name:
+                    name_data_map.setdefault(config_name, []).append(object_info)
+                else:
+                    logging.info(
+                        f"Object Not Associated with Config found: {object_info[2]} {object_info[3]}"
+                    )
+        return name_data_map
 
-                object_key = record.object_key
-                (
-                    file_type,
-                    fsspec_name,
-                    compression,
-                    clean_schema,
-                    config_name,
-                    partition_fields_in_data,
-                    content_length,
-                ) = collect_payload_from_s3(
-                    agent_config, bucket_name, object_key, self.s3_handler
-                )
-            elif record.payload_source == PayloadSource.GCS:
-                bucket_name = record.bucket
+    @staticmethod
+    def get_compute_executor(object_count):
+        """
+        Pool computing the datasets of an invocation, None to compute them in the agent's process
+        (a single object, or EVENT_PAYLOAD_OBJECT_CONCURRENCY of 1). Threads by default, forked worker processes
+        when EVENT_PAYLOAD_COMPUTE_PROCESSES is set (never on lambda).
+        """
+        workers = min(EVENT_PAYLOAD_OBJECT_CONCURRENCY, object_count)
+        if workers <= 1:
+            return None
+        if EVENT_PAYLOAD_COMPUTE_PROCESSES:
+            # Forked workers inherit the payload objects registered while matching, each worker rebuilds their
+            # filesystems and locks before computing
+            return ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=PayloadObjectFileSystem.reopen,
+            )
+        return ThreadPoolExecutor(max_workers=workers)
 
-                object_key = record.object_key
-                (
-                    file_type,
-                    fsspec_name,
-                    compression,
-                    clean_schema,
-                    config_name,
-                    partition_fields_in_data,
-                    content_length,
-                ) = collect_payload_from_gcs(
-                    agent_config, bucket_name, object_key, self.gcs_handler
-                )
-            else:
-                config_name = None
-                partition_fields_in_data = None
-                bucket_name = None
-                object_key = None
-                clean_schema = None
-                fsspec_name = None
-                content_length = 0
+    def get_run_args(self, dataset_name, prefix_item, object_info, concurrency):
+        """
+        EventPayloadQueryBuilder.run arguments of a dataset's object. Objects are computed to partial results
+        that are merged per dataset (see handle_dataset_outputs)
+        Dataset config keys read here:
+            file_type: payload format (see SupportedPayloadFormat)
+            columns: string and number columns to aggregate
+            timestamp: timestamp column mappings
+            dimensions: columns the metrics are grouped by
+            engine: engine computing the metrics (see ExecutionEngine), pandas by default
+            workers: processes computing a streamed payload's chunks, STREAMING_WORKERS by default
+            filters: parquet row filters in pyarrow's disjunctive normal form, e.g. [["country", "=", "FRA"]].
+                Only the matching rows are counted in the dataset's metrics, row groups whose statistics can't
+                match are skipped. Ignored for other formats
+        :param concurrency: objects computed at the same time, they share the memory budget
+        """
+        string_columns = []
+        numeric_columns = []
+        timestamp_mappings = {}
+        dimensions = prefix_item.get("dimensions", [])
+        if "columns" in prefix_item and "string" in prefix_item["columns"]:
+            string_columns = prefix_item.get("columns", {}).get("string", [])
+            if string_columns is None:
+                string_columns = []
+        if "columns" in prefix_item and "number" in prefix_item["columns"]:
+            numeric_columns = prefix_item.get("columns", {}).get("number", [])
+            if numeric_columns is None:
+                numeric_columns = []
+        if "timestamp" in prefix_item:
+            timestamp_mappings = prefix_item.get("timestamp", {})
 
-            if clean_schema:
-                output_schema_map[config_name] = clean_schema
-                name_data_map[config_name] = (
-                    fsspec_name,
-                    partition_fields_in_data,
-                    clean_schema,
-                    bucket_name,
-                    object_key,
-                    record.raw_event,
-                    content_length,
-                )
-            else:
-                logging.info(
-                    f"Object Not Associated with Config found: {bucket_name} {object_key}"
-                )
-        return name_data_map
+        (
+            fsspec_name,
+            partition_fields_in_data,
+            bucket_name,
+            object_key,
+            raw_event,
+            content_length,
+            compression,
+        ) = object_info
+        workers = int(prefix_item.get("workers", STREAMING_WORKERS))
+        if concurrency > 1 and EVENT_PAYLOAD_COMPUTE_PROCESSES and workers > 1:
+            logging.info(
+                f"Computing {dataset_name} in a worker process, its chunks are processed by that process"
+            )
+            workers = 1
+        return (
+            fsspec_name,
+            partition_fields_in_data,
+            None,
+            SupportedPayloadFormat(prefix_item.get("file_type")),
+            string_columns,
+            numeric_columns,
+            timestamp_mappings,
+            dimensions,
+            self.yaml_config["source_id"],
+            dataset_name,
+            (bucket_name, object_key),
+            content_length,
+            ExecutionEngine(prefix_item.get("engine", ExecutionEngine.PANDAS.value)),
+            workers,
+            prefix_item.get("filters"),
+            compression,
+            EVENT_PAYLOAD_MEMORY_BUDGET_BYTES // max(concurrency, 1),
+            True,
+        )
 
     def execute_stream_metrics(self, name_data_map, parent_event):
+        """
+        Compute and write the metrics of every matched dataset. Objects are computed concurrently by up to
+        EVENT_PAYLOAD_OBJECT_CONCURRENCY workers (see get_compute_executor). All the objects of a dataset are
+        coalesced: their partial results are merged into one result and one event per dataset. Results are
+        buffered by the result writer, which writes them in micro-batches and is flushed before returning.
+        :return: events of the datasets, in name_data_map order
+        """
+        objects = []
+        for dataset_name, object_infos in name_data_map.items():
+            prefix_item = self.routing_index.get_dataset_config(dataset_name)
+            if prefix_item is not None:
+                objects.extend(
+                    (dataset_name, prefix_item, object_info)
+                    for object_info in object_infos
+                )
+        concurrency = min(EVENT_PAYLOAD_OBJECT_CONCURRENCY, len(objects))
+        run_args = [
+            self.get_run_args(dataset_name, prefix_item, object_info, concurrency)
+            for dataset_name, prefix_item, object_info in objects
+        ]
+        executor = self.get_compute_executor(len(objects))
+        if executor is None:
+            outputs = (self.query_builder.run(*args) for args in run_args)
+        else:
+            outputs = executor.map(self.query_builder.run, *zip(*run_args))
         events = []
-        for dataset_name in name_data_map:
-            for file_family in self.yaml_config["buckets"].values():
-                for prefix_item in file_family:
-                    if prefix_item.get("name") == dataset_name:
-                        string_columns = []
-                        numeric_columns = []
-                        timestamp_mappings = {}
-                        dimensions = prefix_item.get("dimensions", [])
-                        if (
-                            "columns" in prefix_item
-                            and "string" in prefix_item["columns"]
-                        ):
-                            string_columns = prefix_item.get("columns", {}).get(
-                                "string", []
-                            )
-                            if string_columns is None:
-                                string_columns = []
-                        if (
-                            "columns" in prefix_item
-                            and "number" in prefix_item["columns"]
-                        ):
-                            numeric_columns = prefix_item.get("columns", {}).get(
-                                "number", []
-                            )
-                            if numeric_columns is None:
-                                numeric_columns = []
-                        if "timestamp" in prefix_item:
-                            timestamp_mappings = prefix_item.get("timestamp", {})
 
-                        (
-                            fsspec_name,
-                            partition_fields_in_data,
-                            clean_schema,
-                            bucket_name,
-                            object_key,
-                            raw_event,
-                            content_length,
-                        ) = name_data_map[dataset_name]
-                        source_id = self.yaml_config["source_id"]
-                        (
-                            output_df,
-                            execution_time,
-                            primary_time_column,
-                            filtered_dimensions,
-                        ) = self.query_builder.run(
-                            fsspec_name,
-                            partition_fields_in_data,
-                            clean_schema,
-                            SupportedPayloadFormat(prefix_item.get("file_type")),
-                            string_columns,
-                            numeric_columns,
-                            timestamp_mappings,
-                            dimensions,
-                            source_id,
-                            dataset_name,
-                            (bucket_name, object_key),
-                            content_length,
-                        )
-                        if output_df is not None:
-                            min_primary_time = (
-                                output_df[primary_time_column].min().item()
-                                if primary_time_column
-                                else None
-                            )
-                            max_primary_time = (
-                                output_df[primary_time_column].max().item()
-                                if primary_time_column
-                                else None
-                            )
-                            event_dict = {
-                                "input_event": raw_event,
-                                "parent_event": parent_event,
-                                "schema": clean_schema,
-                                "lariat_agent_execution_time": execution_time,
-                                "min_primary_time": min_primary_time,
-                                "max_primary_time": max_primary_time,
-                                "primary_time_column": primary_time_column,
-                                "lariat_dataset_name": dataset_name,
-                            }
-
-                            if filtered_dimensions and PERSIST_UNIQUE_DIMENSION_VALUES:
-                                unique_dimension_values = {
-                                    dim: output_df[f"dim|{dim}"]
-                                    .drop_duplicates()
-                                    .tolist()
-                                    for dim in filtered_dimensions
-                                }
-                                event_dict["dimensions"] = unique_dimension_values
-                            else:
-                                event_dict["dimensions"] = {}
-                            events.append(event_dict)
-                            indicator_query_output_key = (
-                                f"{EVENT_PAYLOAD_OUTPUT_KEY_PREFIX}/"
-                                f"api_key={self._api_key}/source_id={source_id}/dataset={dataset_name}"
-                            )
-                            ingestion_time = datetime.utcnow()
-                            query_output_path = (
-                                f"{indicator_query_output_key.strip('/')}/"
-                                f"year={ingestion_time.year}/month={str(ingestion_time.month).zfill(2)}/"
-                                f"day={str(ingestion_time.day).zfill(2)}/hour={str(ingestion_time.hour).zfill(2)}/"
-                                f"minute={str(ingestion_time.minute).zfill(2)}/"
-                            )
-                            hash_object = hashlib.sha1(object_key.encode())
-                            source_file_path = Path(
-                                query_output_path,
-                                f"result_{str(hash_object.hexdigest())}_{int(time.time())}.csv",
-                            ).as_posix()
-                            self.write_data(
-                                output_df, source_file_path=source_file_path
-                            )
-                        else:
-                            event_dict = {
-                                "input_event": raw_event,
-                                "parent_event": parent_event,
-                                "schema": clean_schema,
-                                "lariat_agent_execution_time": execution_time,
-                                "primary_time_column": primary_time_column,
-                                "lariat_dataset_name": dataset_name,
-                            }
-                            events.append(event_dict)
-                            logging.warning(
-                                f"Data could not be written for {bucket_name} {object_key} "
-                            )
+        def handle_dataset_outputs(dataset_name, object_outputs):
+            event_dict = self.handle_dataset_outputs(
+                dataset_name, object_outputs, parent_event
+            )
+            if event_dict is not None:
+                events.append(event_dict)
 
+        try:
+            # Objects are ordered by dataset, a dataset is complete when the next one's first output arrives
+            current_dataset_name = None
+            object_outputs = []
+            for (dataset_name, _, object_info), output in zip(objects, outputs):
+                if dataset_name != current_dataset_name and object_outputs:
+                    handle_dataset_outputs(current_dataset_name, object_outputs)
+                    object_outputs = []
+                current_dataset_name = dataset_name
+                object_outputs.append((object_info, output))
+            if object_outputs:
+                handle_dataset_outputs(current_dataset_name, object_outputs)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            # Results are all written before the events referencing them are sent
+            self.result_writer.flush()
         return events
 
+    @staticmethod
+    def get_location_info(objects):
+        """
+        Bucket and object the results of a dataset's objects are labelled with: the object itself, or the
+        deepest directory (key prefix ending with /) holding all the objects when several were coalesced
+        :param objects: provenance of the dataset's objects (see handle_dataset_outputs)
+        """
+        bucket_name = objects[0]["bucket"]
+        object_keys = [obj["object"] for obj in objects]
+        if len(object_keys) == 1:
+            return bucket_name, object_keys[0]
+        common_prefix = os.path.commonprefix(object_keys)
+        return bucket_name, common_prefix[: common_prefix.rfind("/") + 1]
+
+    def handle_dataset_outputs(self, dataset_name, object_outputs, parent_event):
+        """
+        Merge the partial results of a dataset's objects and write them
+        :param dataset_name:
+        :param object_outputs: information (see schema_retrieval) and partial EventPayloadQueryBuilder.run output
+        of each of the dataset's objects
+        :param parent_event:
+        :return: the dataset's event, None when no data was found. The event carries the first object's input
+        event and the provenance of every coalesced object
+        """
+        objects = [
+            {
+                "bucket": object_info[2],
+                "object": object_info[3],
+                "content_length": object_info[5],
+                "record_count": output[0][1] if output[0] is not None else 0,
+                "lariat_agent_execution_time": output[1],
+            }
+            for object_info, output in object_outputs
+        ]
+        execution_time = max(output[1] for _, output in object_outputs)
+        bucket_name, object_key = self.get_location_info(objects)
+        (
+            output_df,
+            execution_time,
+            primary_time_column,
+            filtered_dimensions,
+            clean_schema,
+        ) = self.query_builder.merge_partial_outputs(
+            [output[0] for _, output in object_outputs],
+            execution_time,
+            (bucket_name, object_key),
+            merge_payload_schemas(output[2] for _, output in object_outputs),
+        )
+        raw_event = object_outputs[0][0][4]
+        source_id = self.yaml_config["source_id"]
+        if not clean_schema:
+            logging.info(
+                f"No data found for {dataset_name} in {bucket_name} {object_key}"
+            )
+            return None
+        if output_df is not None:
+            min_primary_time = (
+                output_df[primary_time_column].min().item()
+                if primary_time_column
+                else None
+            )
+            max_primary_time = (
+                output_df[primary_time_column].max().item()
+                if primary_time_column
+                else None
+            )
+            event_dict = {
+                "input_event": raw_event,
+                "parent_event": parent_event,
+                "schema": clean_schema,
+                "lariat_agent_execution_time": execution_time,
+                "min_primary_time": min_primary_time,
+                "max_primary_time": max_primary_time,
+                "primary_time_column": primary_time_column,
+                "lariat_dataset_name": dataset_name,
+                "objects": objects,
+            }
+
+            if filtered_dimensions and PERSIST_UNIQUE_DIMENSION_VALUES:
+                unique_dimension_values = {
+                    dim: output_df[f"dim|{dim}"].drop_duplicates().tolist()
+                    for dim in filtered_dimensions
+                    if f"dim|{dim}" in output_df.columns
+                }
+                event_dict["dimensions"] = unique_dimension_values
+            else:
+                event_dict["dimensions"] = {}
+            indicator_query_output_key = (
+                f"{EVENT_PAYLOAD_OUTPUT_KEY_PREFIX}/"
+                f"api_key={self._api_key}/source_id={source_id}/dataset={dataset_name}"
+            )
+            self.result_writer.add(
+                indicator_query_output_key,
+                output_df,
+                [obj["object"] for obj in objects],
+            )
+        else:
+            event_dict = {
+                "input_event": raw_event,
+                "parent_event": parent_event,
+                "schema": clean_schema,
+                "lariat_agent_execution_time": execution_time,
+                "primary_time_column": primary_time_column,
+                "lariat_dataset_name": dataset_name,
+                "objects": objects,
+            }
+            logging.warning(
+                f"Data could not be written for {bucket_name} {object_key} "
+            )
+        return event_dict
+
     def map_action_to_function(self, action, event_dict=None):
         """
         Supported actions:
@@ -252,19 +399,31 @@ class EventPayloadAgent(StreamingBaseAgent):
         """
         are_keys_valid = self.validate_api_keys()
         if are_keys_valid:
-            event_payload_list = process_event_payload(
-                event_dict, PayloadSource(LARIAT_PAYLOAD_SOURCE), self._cloud
-            )
-            name_data_map = self.schema_retrieval(event_payload_list)
-            events_list = self.execute_stream_metrics(name_data_map, event_dict)
-            if events_list:
-                payload = {"events": events_list}
-                params = {"sourceId": self.yaml_config["source_id"]}
-                self.send_payload_to_agent(
-                    endpoint=f"{LARIAT_BASE_URL.removesuffix('/')}/ingest_s3_events",
-                    payload=payload,
-                    params=params,
-                )
+            self.process_event(event_dict)
         else:
             logging.error("Failed to authenticate credentials")
             raise PermissionError("Couldn't authenticate Api & Application keypair")
+
+    def process_event(self, event_dict):
+        """
+        Compute, write and ingest the metrics of the objects of a trigger event, once the api keys are validated
+        (long-running consumers validate them once, see event_payload_daemon_executor)
+        :param event_dict: S3, SNS or GCS trigger event
+        :return:
+        """
+        event_payload_list = process_event_payload(
+            event_dict, PayloadSource(LARIAT_PAYLOAD_SOURCE), self._cloud
+        )
+        name_data_map = self.schema_retrieval(event_payload_list)
+        try:
+            events_list = self.execute_stream_metrics(name_data_map, event_dict)
+        finally:
+            PayloadObjectFileSystem.release()
+        if events_list:
+            payload = {"events": events_list}
+            params = {"sourceId": self.yaml_config["source_id"]}
+            self.send_payload_to_agent(
+                endpoint=f"{LARIAT_BASE_URL.removesuffix('/')}/ingest_s3_events",
+                payload=payload,
+                params=params,
+            )
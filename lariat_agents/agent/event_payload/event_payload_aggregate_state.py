@@ -0,0 +1,333 @@
+"""
+    Mergeable partial aggregates for the event payload agent.
+    A partial aggregate keeps count, sum, M2 (sum of squared deviations from the mean), min, max and null count,
+    which can be folded together in any order (chunks, row groups, worker processes, separate objects) and still
+    produce the exact mean and sample standard deviation at the end.
+    AggregateState is the single column form, the *_partial_states functions apply the same merge to result
+    frames (one row per group, one `<agg>|<column>|<key tail>` column per aggregate).
+    Dimension columns are categoricals (see encode_dimension), partial results are concatenated with
+    concat_partial_states so that the groups of every chunk share one category table.
+    PartialStateFold folds partial results into a running aggregate as they arrive and spills it to disk by
+    hash partition when it outgrows its memory limit.
+"""
+import logging
+import math
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from lariat_agents.constants import (
+    STREAMING_FOLD_MEMORY_BYTES,
+    STREAMING_SPILL_DIR,
+    STREAMING_SPILL_PARTITIONS,
+)
+
+TOTAL_GROUP_COUNT_COL = "total_group_count"
+M2_PREFIX = "m2|"
+SUMMED_PREFIXES = ("count|", "sum|", "null_count|", M2_PREFIX)
+EMPTY_DIMENSION_VALUE = "<empty>"
+
+
+class AggregateState:
+    """
+    Partial aggregate of a single column. String columns only use count and null_count.
+    """
+
+    __slots__ = ("count", "sum", "m2", "min", "max", "null_count")
+
+    def __init__(self, count=0, sum=0.0, m2=0.0, min=None, max=None, null_count=0):
+        self.count = count
+        self.sum = sum
+        self.m2 = m2
+        self.min = min
+        self.max = max
+        self.null_count = null_count
+
+    @classmethod
+    def from_values(cls, values, numeric=True):
+        series = pd.Series(values)
+        valid = series.dropna()
+        state = cls(count=len(valid), null_count=len(series) - len(valid))
+        if numeric and state.count:
+            numbers = valid.to_numpy(dtype=np.float64)
+            state.sum = float(numbers.sum())
+            state.m2 = float(((numbers - numbers.mean()) ** 2).sum())
+            state.min = float(numbers.min())
+            state.max = float(numbers.max())
+        return state
+
+    def merge(self, other: "AggregateState") -> "AggregateState":
+        """
+        Combine two partial aggregates (Chan et al. parallel variance update)
+        """
+        count = self.count + other.count
+        m2 = self.m2 + other.m2
+        if self.count and other.count:
+            delta = other.sum / other.count - self.sum / self.count
+            m2 += delta * delta * self.count * other.count / count
+        return AggregateState(
+            count=count,
+            sum=self.sum + other.sum,
+            m2=m2,
+            min=min_ignoring_none(self.min, other.min),
+            max=max_ignoring_none(self.max, other.max),
+            null_count=self.null_count + other.null_count,
+        )
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else math.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else math.nan
+
+
+def min_ignoring_none(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b)
+
+
+def max_ignoring_none(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+
+def add_partial_state_columns(df):
+    """
+    Add the m2| column of every std| column of a single chunk's results so that the chunk can be merged exactly
+    :param df: output of EventPayloadQueryBuilder.handle_calculation
+    :return:
+    """
+    for col in [col for col in df.columns if col.startswith("std|")]:
+        key = col.removeprefix("std|")
+        count = df[f"count|{key}"]
+        df[f"{M2_PREFIX}{key}"] = df[col].fillna(0) ** 2 * (count - 1).clip(lower=0)
+    return df
+
+
+def encode_dimension(values) -> pd.Categorical:
+    """
+    Dictionary encode a dimension column. Only the distinct values are normalized: they become stripped strings
+    and empty or missing values become EMPTY_DIMENSION_VALUE (values that are equal once normalized share a
+    code). Categories are sorted so grouping on the codes orders groups by value.
+    :param values: dimension column
+    :return: categorical of the normalized values
+    """
+    codes, uniques = pd.factorize(values)
+    labels = [str(value).strip() for value in uniques]
+    if (codes < 0).any():
+        # The trailing empty label is what missing values (code -1) map to
+        labels.append("")
+    labels = np.array(labels, dtype=object)
+    labels[labels == ""] = EMPTY_DIMENSION_VALUE
+    categories, label_codes = np.unique(labels, return_inverse=True)
+    return pd.Categorical.from_codes(label_codes[codes], categories)
+
+
+def concat_partial_states(frames, dimensions):
+    """
+    Concatenate partial results. The categories of each categorical dimension are unified first, pd.concat
+    would otherwise fall back to object columns when the chunks saw different values.
+    :param frames: partial results
+    :param dimensions:
+    :return:
+    """
+    frames = list(frames)
+    for dim in dimensions:
+        if all(
+            dim in frame.columns and isinstance(frame[dim].dtype, pd.CategoricalDtype)
+            for frame in frames
+        ):
+            categories = union_categoricals(
+                [frame[dim].array for frame in frames], sort_categories=True
+            ).categories
+            frames = [
+                frame.assign(**{dim: frame[dim].cat.set_categories(categories)})
+                for frame in frames
+            ]
+    return pd.concat(frames)
+
+
+def group_partial_states(df, dimensions):
+    if dimensions:
+        return df.groupby(dimensions, dropna=False, observed=True)
+    return df.groupby(np.zeros(len(df), dtype=np.int8))
+
+
+def merge_partial_states(df, dimensions, timestamp_cols):
+    """
+    Merge concatenated partial results into one row per group. The output is itself a partial result (it keeps
+    the m2| columns) so it can be merged again.
+    :param df: concatenated partial results
+    :param dimensions:
+    :param timestamp_cols:
+    :return:
+    """
+    agg_dict = {}
+    m2_keys = []
+    for col in df.columns:
+        if col in dimensions or col in timestamp_cols:
+            continue
+        if col.startswith(TOTAL_GROUP_COUNT_COL) or col.startswith(SUMMED_PREFIXES):
+            agg_dict[col] = "sum"
+        elif col.startswith("max|"):
+            agg_dict[col] = "max"
+        elif col.startswith("min|"):
+            agg_dict[col] = "min"
+        if col.startswith(M2_PREFIX):
+            m2_keys.append(col.removeprefix(M2_PREFIX))
+    for col in timestamp_cols:
+        agg_dict[col] = "min" if col.startswith("min") else "max"
+
+    if m2_keys:
+        df = df.copy()
+        grouped = group_partial_states(df, dimensions)
+        for key in m2_keys:
+            count = df[f"count|{key}"]
+            total_count = grouped[f"count|{key}"].transform("sum")
+            total_mean = grouped[f"sum|{key}"].transform("sum") / total_count
+            # Spread of the partial means around the merged mean
+            between = (count * (df[f"sum|{key}"] / count - total_mean) ** 2).fillna(0)
+            df[f"{M2_PREFIX}{key}"] = df[f"{M2_PREFIX}{key}"] + between
+
+    merged = group_partial_states(df, dimensions).agg(agg_dict)
+    merged = merged.reset_index(drop=not dimensions)
+    for col in df.columns:
+        if col.startswith("mean|"):
+            key = col.removeprefix("mean|")
+            merged[col] = merged[f"sum|{key}"] / merged[f"count|{key}"]
+        elif col.startswith("std|") and f"{M2_PREFIX}{col.removeprefix('std|')}" in df.columns:
+            key = col.removeprefix("std|")
+            count = merged[f"count|{key}"]
+            merged[col] = np.sqrt(merged[f"{M2_PREFIX}{key}"] / (count - 1)).where(
+                count > 1
+            )
+    return merged[[col for col in df.columns if col in merged.columns]]
+
+
+def finalize_partial_states(df):
+    """
+    Drop the merge-only columns from a partial result
+    """
+    return df.drop(columns=[col for col in df.columns if col.startswith(M2_PREFIX)])
+
+
+class PartialStateFold:
+    """
+    Running merge of partial results with bounded memory. Every partial result is merged into the running
+    aggregate when it is added. When the running aggregate grows past memory_limit bytes its groups are hash
+    partitioned on the dimensions and written to spill_dir, the result then merges one partition at a time.
+    """
+
+    def __init__(
+        self,
+        dimensions,
+        timestamp_cols,
+        memory_limit=STREAMING_FOLD_MEMORY_BYTES,
+        partitions=STREAMING_SPILL_PARTITIONS,
+        spill_dir=STREAMING_SPILL_DIR,
+    ):
+        """
+        :param dimensions:
+        :param timestamp_cols:
+        :param memory_limit: bytes the running aggregate can use before it is spilled
+        :param partitions: number of hash partitions the spilled groups are split into
+        :param spill_dir: directory the spill files are created in
+        """
+        self.dimensions = list(dimensions)
+        self.timestamp_cols = list(timestamp_cols)
+        self.memory_limit = memory_limit
+        self.partitions = partitions
+        self.spill_dir = spill_dir
+        self.running = None
+        self.spill_path = None
+        self.spill_files = [[] for _ in range(partitions)]
+
+    def merge(self, frames):
+        return merge_partial_states(
+            concat_partial_states(frames, self.dimensions),
+            self.dimensions,
+            self.timestamp_cols,
+        )
+
+    def add(self, df):
+        """
+        Fold a partial result into the running aggregate
+        """
+        frames = [df] if self.running is None else [self.running, df]
+        self.running = self.merge(frames)
+        # Without dimensions there is a single group, which never outgrows the limit
+        if (
+            self.dimensions
+            and self.running.memory_usage(deep=True, index=False).sum()
+            > self.memory_limit
+        ):
+            self.spill()
+
+    def get_partitions(self, df):
+        hashes = pd.util.hash_pandas_object(df[self.dimensions], index=False)
+        return (hashes.to_numpy() % self.partitions).astype(np.int64)
+
+    def spill(self):
+        if self.spill_path is None:
+            self.spill_path = tempfile.mkdtemp(prefix="lariat-fold-", dir=self.spill_dir)
+        partitions = self.get_partitions(self.running)
+        logging.info(
+            f"Spilling {len(self.running)} groups to {self.spill_path} in {self.partitions} partitions"
+        )
+        for partition in range(self.partitions):
+            partition_df = self.running[partitions == partition]
+            if partition_df.empty:
+                continue
+            path = os.path.join(
+                self.spill_path,
+                f"partition-{partition}-{len(self.spill_files[partition])}.pkl",
+            )
+            partition_df.to_pickle(path)
+            self.spill_files[partition].append(path)
+        self.running = None
+
+    def result(self):
+        """
+        :return: the merged partial result of everything added (see finalize_partial_states), None when nothing
+        was added
+        """
+        if self.spill_path is None:
+            return self.running
+        partitions = (
+            self.get_partitions(self.running) if self.running is not None else None
+        )
+        merged_partitions = []
+        for partition, paths in enumerate(self.spill_files):
+            merged = None
+            if partitions is not None and (partitions == partition).any():
+                merged = self.running[partitions == partition]
+            # One spill file at a time, a partition never holds more than its distinct groups
+            for path in paths:
+                spilled = pd.read_pickle(path)
+                merged = spilled if merged is None else self.merge([merged, spilled])
+                os.remove(path)
+            if merged is not None:
+                merged_partitions.append(merged)
+        self.running = None
+        self.spill_files = [[] for _ in range(self.partitions)]
+        return concat_partial_states(merged_partitions, self.dimensions)
+
+    def close(self):
+        """
+        Remove the spill files
+        """
+        if self.spill_path is not None:
+            shutil.rmtree(self.spill_path, ignore_errors=True)
+            self.spill_path = None
@@ -0,0 +1,185 @@
+"""
+    Columnar Avro reading for the event payload agent.
+    Avro payloads are read as Arrow record batches: duckdb's avro extension decodes whole blocks straight into
+    columns, only the projected fields are materialized. The extension is installed in the agent's images and
+    only loaded at runtime, it is never downloaded while processing an event.
+    When the extension can't be loaded, fastavro decodes the blocks. This is the slow path: fastavro still
+    decodes every record into a dict, pyarrow then converts each block's records to a record batch of the
+    projected fields, typed from the writer schema.
+    The writer schema is read from the header alone, no records are decoded for it.
+"""
+import logging
+from functools import lru_cache
+
+import duckdb
+import fsspec
+import pyarrow as pa
+from fastavro import block_reader, reader
+
+from lariat_agents.agent.event_payload.event_payload_duckdb_engine import (
+    get_duckdb_connection,
+    quote_identifier,
+    quote_literal,
+)
+
+AVRO_RECORD_BATCH_ROWS = 1000000
+AVRO_PRIMITIVE_TYPES = {
+    "null": pa.null(),
+    "boolean": pa.bool_(),
+    "int": pa.int32(),
+    "long": pa.int64(),
+    "float": pa.float32(),
+    "double": pa.float64(),
+    "bytes": pa.binary(),
+    "string": pa.string(),
+}
+AVRO_LOGICAL_TYPES = {
+    "date": pa.date32(),
+    "time-millis": pa.time32("ms"),
+    "time-micros": pa.time64("us"),
+    "timestamp-millis": pa.timestamp("ms", tz="UTC"),
+    "timestamp-micros": pa.timestamp("us", tz="UTC"),
+    "local-timestamp-millis": pa.timestamp("ms"),
+    "local-timestamp-micros": pa.timestamp("us"),
+    "uuid": pa.string(),
+}
+
+
+def get_avro_writer_schema(fsspec_name):
+    """
+    Writer schema from the header of an avro object
+    """
+    with fsspec.open(fsspec_name, mode="rb") as f:
+        return reader(f).writer_schema
+
+
+def avro_type_to_arrow(avro_type, named_types=None):
+    """
+    Arrow type of an avro type (as parsed by fastavro), None when it has no arrow equivalent (unions of
+    several non null types)
+    :param avro_type:
+    :param named_types: records, enums and fixed types defined so far, by name
+    :return:
+    """
+    named_types = {} if named_types is None else named_types
+    if isinstance(avro_type, list):
+        non_null_types = [item for item in avro_type if item != "null"]
+        if len(non_null_types) != 1:
+            return None
+        return avro_type_to_arrow(non_null_types[0], named_types)
+    if isinstance(avro_type, str):
+        return AVRO_PRIMITIVE_TYPES.get(avro_type, named_types.get(avro_type))
+    logical_type = avro_type.get("logicalType")
+    if logical_type == "decimal":
+        return pa.decimal128(avro_type["precision"], avro_type.get("scale", 0))
+    if logical_type in AVRO_LOGICAL_TYPES:
+        return AVRO_LOGICAL_TYPES[logical_type]
+    type_name = avro_type.get("type")
+    arrow_type = None
+    if type_name == "record":
+        fields = []
+        for field in avro_type.get("fields", []):
+            field_type = avro_type_to_arrow(field["type"], named_types)
+            if field_type is None:
+                return None
+            fields.append(pa.field(field["name"], field_type))
+        arrow_type = pa.struct(fields)
+    elif type_name == "enum":
+        arrow_type = pa.string()
+    elif type_name == "fixed":
+        arrow_type = pa.binary(avro_type["size"])
+    elif type_name == "array":
+        items = avro_type_to_arrow(avro_type["items"], named_types)
+        arrow_type = pa.list_(items) if items is not None else None
+    elif type_name == "map":
+        values = avro_type_to_arrow(avro_type["values"], named_types)
+        arrow_type = pa.map_(pa.string(), values) if values is not None else None
+    else:
+        return avro_type_to_arrow(type_name, named_types)
+    if "name" in avro_type and arrow_type is not None:
+        named_types[avro_type["name"]] = arrow_type
+    return arrow_type
+
+
+def get_projected_fields(writer_schema, columns=None):
+    """
+    Top level fields to read, all of them when none of the columns are in the schema (rows are still counted)
+    """
+    fields = [field["name"] for field in writer_schema.get("fields", [])]
+    if columns is None:
+        return fields
+    return [field for field in fields if field in columns] or fields
+
+
+@lru_cache(maxsize=None)
+def is_duckdb_avro_available():
+    """
+    Whether duckdb's avro extension can be loaded, checked once per process. The extension isn't installed
+    when it is missing (see the Dockerfiles), so checking never downloads it.
+    """
+    connection = get_duckdb_connection()
+    try:
+        connection.execute("LOAD avro")
+        return True
+    except duckdb.Error as e:
+        logging.warning(
+            f"duckdb's avro extension is unavailable, decoding avro with fastavro: {e}"
+        )
+        return False
+    finally:
+        connection.close()
+
+
+def iter_duckdb_avro_batches(fsspec_name, fields, rows_per_batch):
+    connection = get_duckdb_connection(fsspec_name)
+    try:
+        connection.execute("LOAD avro")
+        projection = ", ".join(quote_identifier(field) for field in fields)
+        batches = connection.execute(
+            f"SELECT {projection} FROM read_avro({quote_literal(fsspec_name)})"
+        ).fetch_record_batch(rows_per_batch)
+        yield from batches
+    finally:
+        connection.close()
+
+
+def iter_fastavro_batches(fsspec_name, fields, writer_schema):
+    """
+    One record batch per avro block, the slow path used without duckdb's avro extension. fastavro decodes
+    each record to a dict, the records of a block are converted at once by pyarrow, keeping only the projected
+    fields.
+    """
+    arrow_fields = {}
+    named_types = {}
+    for field in writer_schema.get("fields", []):
+        arrow_fields[field["name"]] = avro_type_to_arrow(field["type"], named_types)
+    schema = None
+    if all(arrow_fields[field] is not None for field in fields):
+        schema = pa.schema([pa.field(field, arrow_fields[field]) for field in fields])
+    with fsspec.open(fsspec_name, mode="rb") as f:
+        for block in block_reader(f):
+            records = list(block)
+            if not records:
+                continue
+            if schema is not None:
+                yield pa.RecordBatch.from_pylist(records, schema=schema)
+            else:
+                # Unions of several types have no arrow equivalent, their values are inferred
+                yield pa.RecordBatch.from_pylist(records).select(fields)
+
+
+def get_avro_record_batches(fsspec_name, columns=None, rows_per_batch=None):
+    """
+    Read an avro payload as Arrow record batches
+    :param fsspec_name:
+    :param columns: top level fields to read, None reads all fields
+    :param rows_per_batch: maximum rows per batch
+    :return: generator of record batches
+    """
+    writer_schema = get_avro_writer_schema(fsspec_name)
+    fields = get_projected_fields(writer_schema, columns)
+    if is_duckdb_avro_available():
+        return iter_duckdb_avro_batches(
+            fsspec_name, fields, rows_per_batch or AVRO_RECORD_BATCH_ROWS
+        )
+    return iter_fastavro_batches(fsspec_name, fields, writer_schema)
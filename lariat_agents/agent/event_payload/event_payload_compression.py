@@ -0,0 +1,131 @@
+"""
+    Streaming decompression of payload objects.
+    The compression sniffed when an object is matched to its dataset (see get_compression_from_magic_type) is
+    passed to the readers, so objects are decompressed whatever their key looks like. When it isn't known it is
+    inferred from the extension. Objects are decompressed incrementally as they are read and never inflated in
+    memory as a whole. Gzip is decoded with ISA-L in a background thread (GZIP_DECOMPRESSION_THREADS), so
+    decompression overlaps with fetching and parsing. A gzip stream can't be split between threads, the
+    objects of an invocation are decompressed in parallel instead.
+"""
+import bz2
+import io
+import zlib
+from contextlib import contextmanager
+
+import fsspec
+import snappy
+import zstandard
+from fsspec.utils import infer_compression
+from isal import igzip_threaded
+
+from lariat_agents.agent.event_payload.event_payload_types import CompressionType
+from lariat_agents.constants import GZIP_DECOMPRESSION_THREADS
+
+READ_BYTES = 1024 * 1024
+
+
+class DecompressingReader(io.RawIOBase):
+    """
+    Raw stream over an incremental decompressor (an object with decompress and optionally flush)
+    """
+
+    def __init__(self, source, decompressor):
+        self.source = source
+        self.decompressor = decompressor
+        self.buffer = b""
+        self.offset = 0
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.offset >= len(self.buffer) and not self.eof:
+            data = self.source.read(READ_BYTES)
+            if data:
+                self.buffer = self.decompressor.decompress(data)
+            else:
+                self.eof = True
+                flush = getattr(self.decompressor, "flush", None)
+                self.buffer = flush() if flush else b""
+            self.offset = 0
+        size = min(len(b), len(self.buffer) - self.offset)
+        b[:size] = self.buffer[self.offset : self.offset + size]
+        self.offset += size
+        return size
+
+
+def resolve_compression(fsspec_name, compression: CompressionType = None):
+    """
+    :param fsspec_name:
+    :param compression: detected compression, None when it wasn't detected
+    :return: the detected compression, or the compression inferred from the extension
+    """
+    if compression is not None:
+        return compression
+    try:
+        return CompressionType(infer_compression(fsspec_name))
+    except ValueError:
+        return CompressionType.NONE
+
+
+def get_decompressed_stream(source, compression: CompressionType):
+    """
+    Buffered binary stream of the decompressed bytes of source
+    """
+    if compression == CompressionType.GZIP:
+        # Multi-member objects are decoded as one stream, like gzip.GzipFile does
+        return igzip_threaded.open(source, "rb", threads=GZIP_DECOMPRESSION_THREADS)
+    elif compression == CompressionType.BZIP2:
+        return bz2.BZ2File(source)
+    elif compression == CompressionType.ZSTD:
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(
+                source, read_across_frames=True
+            ),
+            READ_BYTES,
+        )
+    elif compression == CompressionType.SNAPPY:
+        # Snappy framing format (python-snappy's stream format)
+        return io.BufferedReader(
+            DecompressingReader(source, snappy.StreamDecompressor()), READ_BYTES
+        )
+    return source
+
+
+@contextmanager
+def open_payload(fsspec_name, compression: CompressionType = None, text=False):
+    """
+    Open a payload object for streaming reads of its decompressed content
+    :param fsspec_name:
+    :param compression: detected compression (see resolve_compression)
+    :param text: yield a utf-8 text stream rather than a binary one (e.g. for pandas' chunked json reader)
+    :return:
+    """
+    with fsspec.open(fsspec_name, mode="rb") as source:
+        stream = get_decompressed_stream(
+            source, resolve_compression(fsspec_name, compression)
+        )
+        if text:
+            stream = io.TextIOWrapper(stream, encoding="utf-8")
+        try:
+            yield stream
+        finally:
+            if stream is not source:
+                stream.close()
+
+
+def decompress_prefix(data, compression: CompressionType):
+    """
+    Decompress the first bytes of an object
+    :return: decompressed bytes, None when the compression can't be decoded from a truncated object
+    """
+    if compression == CompressionType.NONE:
+        return data
+    elif compression == CompressionType.GZIP:
+        return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(data)
+    elif compression == CompressionType.BZIP2:
+        return bz2.BZ2Decompressor().decompress(data) or None
+    elif compression == CompressionType.ZSTD:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data) or None
+    return None
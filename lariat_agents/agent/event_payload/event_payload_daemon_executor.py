@@ -0,0 +1,389 @@
+"""
+    Long-running queue consumer for the event payload agent.
+    Instead of building an agent for every trigger event (a Lambda invocation loads the yaml config, pings the api,
+    creates clients and loads the geo indexes each time), one agent is kept warm and consumes S3 notifications
+    from an SQS compatible queue (AWS SQS, or e.g. ElasticMQ through EVENT_PAYLOAD_DAEMON_ENDPOINT_URL) or from a
+    directory spool of json messages.
+    Messages are received in batches of up to EVENT_PAYLOAD_DAEMON_BATCH_SIZE and split into groups of messages
+    that share no dataset. The S3 records of a group are processed as one trigger event, so the objects of a
+    dataset are coalesced across messages. The messages of the batch being processed are kept invisible to other
+    consumers, and the messages of a group are deleted once the group is processed. Messages of a failed group
+    become visible again when their visibility timeout expires, the other groups aren't computed again.
+"""
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from typing import List
+
+import boto3
+
+from lariat_agents.agent.event_payload.event_payload_agent import EventPayloadAgent
+from lariat_agents.agent.event_payload.event_payload_geo_index import (
+    GEO_LAYERS,
+    get_country_alpha3,
+    get_geo_index,
+)
+from lariat_agents.agent.event_payload.event_payload_types import PayloadSource
+from lariat_agents.agent.event_payload.event_payload_utils import (
+    process_s3_trigger_event,
+)
+from lariat_agents.constants import (
+    EVENT_PAYLOAD_DAEMON_BATCH_SIZE,
+    EVENT_PAYLOAD_DAEMON_ENDPOINT_URL,
+    EVENT_PAYLOAD_DAEMON_QUEUE_URL,
+    EVENT_PAYLOAD_DAEMON_SPOOL_DIR,
+    EVENT_PAYLOAD_DAEMON_VISIBILITY_TIMEOUT_SECONDS,
+    EVENT_PAYLOAD_DAEMON_WAIT_SECONDS,
+)
+
+SQS_MAX_MESSAGES = 10
+SPOOL_POLL_SECONDS = 1
+SPOOL_PROCESSING_DIR = "processing"
+
+
+class QueueMessage:
+    def __init__(self, message_id, body, receipt):
+        """
+        :param message_id:
+        :param body: message body, an S3 notification (possibly in an SNS envelope)
+        :param receipt: handle the queue deletes the message or extends its visibility with
+        """
+        self.message_id = message_id
+        self.body = body
+        self.receipt = receipt
+
+
+class SQSQueue:
+    def __init__(
+        self,
+        queue_url,
+        endpoint_url=None,
+        visibility_timeout=EVENT_PAYLOAD_DAEMON_VISIBILITY_TIMEOUT_SECONDS,
+    ):
+        self.queue_url = queue_url
+        self.visibility_timeout = visibility_timeout
+        self.client = boto3.client("sqs", endpoint_url=endpoint_url)
+
+    def receive(self, max_messages, wait_seconds) -> List[QueueMessage]:
+        response = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=min(max_messages, SQS_MAX_MESSAGES),
+            WaitTimeSeconds=wait_seconds,
+            VisibilityTimeout=self.visibility_timeout,
+        )
+        return [
+            QueueMessage(
+                message["MessageId"], message["Body"], message["ReceiptHandle"]
+            )
+            for message in response.get("Messages", [])
+        ]
+
+    @staticmethod
+    def get_batches(messages):
+        for i in range(0, len(messages), SQS_MAX_MESSAGES):
+            yield messages[i : i + SQS_MAX_MESSAGES]
+
+    def extend_visibility(self, messages: List[QueueMessage]):
+        for batch in self.get_batches(messages):
+            self.client.change_message_visibility_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {
+                        "Id": str(i),
+                        "ReceiptHandle": message.receipt,
+                        "VisibilityTimeout": self.visibility_timeout,
+                    }
+                    for i, message in enumerate(batch)
+                ],
+            )
+
+    def delete(self, messages: List[QueueMessage]):
+        for batch in self.get_batches(messages):
+            self.client.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {"Id": str(i), "ReceiptHandle": message.receipt}
+                    for i, message in enumerate(batch)
+                ],
+            )
+
+
+class DirectorySpool:
+    """
+    Local stand-in for a queue: every json file of spool_dir is a message. A message is claimed by moving it to
+    the processing directory, claims that weren't extended for longer than the visibility timeout (a failed batch
+    or a consumer that died) are returned to the spool.
+    """
+
+    def __init__(
+        self,
+        spool_dir,
+        visibility_timeout=EVENT_PAYLOAD_DAEMON_VISIBILITY_TIMEOUT_SECONDS,
+    ):
+        self.spool_dir = spool_dir
+        self.processing_dir = os.path.join(spool_dir, SPOOL_PROCESSING_DIR)
+        self.visibility_timeout = visibility_timeout
+        os.makedirs(self.processing_dir, exist_ok=True)
+
+    def requeue_expired_claims(self):
+        for name in os.listdir(self.processing_dir):
+            path = os.path.join(self.processing_dir, name)
+            try:
+                if time.time() - os.path.getmtime(path) > self.visibility_timeout:
+                    os.rename(path, os.path.join(self.spool_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def claim(self, max_messages) -> List[QueueMessage]:
+        entries = sorted(
+            (
+                entry
+                for entry in os.scandir(self.spool_dir)
+                if entry.is_file() and entry.name.endswith(".json")
+            ),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        messages = []
+        for entry in entries:
+            if len(messages) >= max_messages:
+                break
+            path = os.path.join(self.processing_dir, entry.name)
+            try:
+                # Atomic, a message is claimed by a single consumer
+                os.rename(entry.path, path)
+            except FileNotFoundError:
+                continue
+            os.utime(path)
+            with open(path) as f:
+                messages.append(QueueMessage(entry.name, f.read(), path))
+        return messages
+
+    def receive(self, max_messages, wait_seconds) -> List[QueueMessage]:
+        self.requeue_expired_claims()
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            messages = self.claim(max_messages)
+            if messages or time.monotonic() >= deadline:
+                return messages
+            time.sleep(SPOOL_POLL_SECONDS)
+
+    def extend_visibility(self, messages: List[QueueMessage]):
+        for message in messages:
+            os.utime(message.receipt)
+
+    def delete(self, messages: List[QueueMessage]):
+        for message in messages:
+            os.remove(message.receipt)
+
+
+def get_message_records(body):
+    """
+    S3 records of a message: an S3 notification delivered to the queue directly or through SNS. S3 test events
+    have no records.
+    """
+    event = json.loads(body)
+    if event.get("Type") == "Notification" and "Message" in event:
+        event = json.loads(event["Message"])
+    return [record for record in event.get("Records", []) if "s3" in record]
+
+
+@contextmanager
+def keep_invisible(queue, messages, visibility_timeout):
+    """
+    Extend the visibility timeout of the messages every half of it until the block exits
+    :param messages: list of the messages, the block removes the messages it deletes from it
+    """
+    stopped = threading.Event()
+
+    def extend():
+        while not stopped.wait(visibility_timeout / 2):
+            try:
+                queue.extend_visibility(list(messages))
+            except Exception as e:
+                logging.warning(
+                    f"Couldn't extend the visibility of {len(messages)} messages: {e}"
+                )
+
+    extender = threading.Thread(target=extend, daemon=True)
+    extender.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        extender.join()
+
+
+class EventPayloadDaemon:
+    def __init__(
+        self,
+        agent: EventPayloadAgent,
+        queue,
+        batch_size=EVENT_PAYLOAD_DAEMON_BATCH_SIZE,
+        wait_seconds=EVENT_PAYLOAD_DAEMON_WAIT_SECONDS,
+        visibility_timeout=EVENT_PAYLOAD_DAEMON_VISIBILITY_TIMEOUT_SECONDS,
+    ):
+        """
+        :param agent: agent whose api keys are validated
+        :param queue: SQSQueue or DirectorySpool
+        :param batch_size: messages processed together
+        :param wait_seconds: long poll duration when the queue is empty
+        :param visibility_timeout: seconds the messages of the batch being processed are kept invisible
+        """
+        self.agent = agent
+        self.queue = queue
+        self.batch_size = batch_size
+        self.wait_seconds = wait_seconds
+        self.visibility_timeout = visibility_timeout
+        self.stopping = False
+
+    def stop(self, *args):
+        logging.info("Stopping after the current batch")
+        self.stopping = True
+
+    def receive_batch(self) -> List[QueueMessage]:
+        """
+        Long poll for the first messages, then take what is already queued up to the batch size
+        """
+        messages = []
+        wait_seconds = self.wait_seconds
+        while len(messages) < self.batch_size and not self.stopping:
+            received = self.queue.receive(self.batch_size - len(messages), wait_seconds)
+            if not received:
+                break
+            messages.extend(received)
+            wait_seconds = 0
+        return messages
+
+    def get_dataset_names(self, records):
+        """
+        Datasets the S3 records' objects are routed to, objects that no dataset config matches are skipped
+        """
+        dataset_names = set()
+        for event_payload in process_s3_trigger_event(
+            {"Records": records}, PayloadSource.S3
+        ):
+            config, _ = self.agent.routing_index.route(
+                event_payload.bucket, event_payload.object_key
+            )
+            if config is not None:
+                dataset_names.add(config.get("name"))
+        return dataset_names
+
+    def group_by_dataset(self, message_records):
+        """
+        Split a batch into groups of messages that share no dataset: the objects of a dataset are still coalesced
+        across messages, and a failing dataset only leaves the messages of its group to be processed again
+        :param message_records: (message, S3 records) of each message of the batch
+        :return: (messages, S3 records) of each group, in batch order
+        """
+        parents = list(range(len(message_records)))
+
+        def find(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        dataset_messages = {}
+        for i, (_, records) in enumerate(message_records):
+            for dataset_name in self.get_dataset_names(records):
+                parents[find(i)] = find(dataset_messages.setdefault(dataset_name, i))
+        groups = {}
+        for i, (message, records) in enumerate(message_records):
+            group_messages, group_records = groups.setdefault(find(i), ([], []))
+            group_messages.append(message)
+            group_records.extend(records)
+        return list(groups.values())
+
+    def process_batch(self, messages: List[QueueMessage]):
+        """
+        Process the groups of a batch (see group_by_dataset), deleting the messages of each group once it is
+        processed
+        :return: whether every group was processed
+        """
+        message_records = []
+        for message in messages:
+            try:
+                records = get_message_records(message.body)
+            except (ValueError, AttributeError) as e:
+                # Dropped, it would never be processed
+                logging.error(f"Invalid message {message.message_id}: {e}")
+                records = []
+            message_records.append((message, records))
+        pending = list(messages)
+        with keep_invisible(self.queue, pending, self.visibility_timeout):
+            for group_messages, records in self.group_by_dataset(message_records):
+                try:
+                    if records:
+                        logging.info(
+                            f"Processing {len(records)} objects of {len(group_messages)} messages"
+                        )
+                        self.agent.process_event({"Records": records})
+                except Exception:
+                    # The messages become visible again once their visibility timeout expires (an SQS queue's
+                    # redrive policy moves the messages that keep failing to its dead letter queue)
+                    logging.exception(
+                        f"Failed to process a group of {len(group_messages)} messages"
+                    )
+                    continue
+                self.queue.delete(group_messages)
+                for message in group_messages:
+                    pending.remove(message)
+        return not pending
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        while not self.stopping:
+            messages = self.receive_batch()
+            if messages:
+                self.process_batch(messages)
+
+
+def warm_up(agent: EventPayloadAgent):
+    """
+    Load the geo indexes when a dataset has wkb dimensions, worker processes forked later inherit them
+    """
+    for config in agent.routing_index.configs.values():
+        dimensions = config.get("dimensions")
+        if isinstance(dimensions, dict) and "wkb" in dimensions:
+            for mode in GEO_LAYERS:
+                get_geo_index(mode)
+            get_country_alpha3()
+            return
+
+
+def get_queue():
+    if EVENT_PAYLOAD_DAEMON_SPOOL_DIR:
+        return DirectorySpool(EVENT_PAYLOAD_DAEMON_SPOOL_DIR)
+    if EVENT_PAYLOAD_DAEMON_QUEUE_URL:
+        return SQSQueue(
+            EVENT_PAYLOAD_DAEMON_QUEUE_URL, EVENT_PAYLOAD_DAEMON_ENDPOINT_URL
+        )
+    raise ValueError(
+        "Set EVENT_PAYLOAD_DAEMON_QUEUE_URL or EVENT_PAYLOAD_DAEMON_SPOOL_DIR to run the daemon"
+    )
+
+
+def run_daemon():
+    """
+    Daemon entry point: builds the agent once, validates its api keys once and consumes the queue until it is
+    sent SIGTERM or SIGINT
+    """
+    queue = get_queue()
+    agent = EventPayloadAgent(
+        agent_type="event_payload", cloud="aws", s3_handler=boto3.client("s3")
+    )
+    if not agent.validate_api_keys():
+        logging.error("Failed to authenticate credentials")
+        raise PermissionError("Couldn't authenticate Api & Application keypair")
+    warm_up(agent)
+    EventPayloadDaemon(agent, queue).run()
+
+
+if __name__ == "__main__":
+    run_daemon()
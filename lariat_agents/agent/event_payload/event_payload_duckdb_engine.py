@@ -0,0 +1,192 @@
+"""
+    DuckDB dialect helpers for the event payload agent's duckdb execution engine.
+    The EventPayloadQueryBuilder turns a dataset config into a single aggregation query built from these pieces,
+    which DuckDB then runs directly over the payload file (scan, projection and group by are all pushed down).
+"""
+from typing import Dict, List
+from urllib.parse import urlparse
+
+import duckdb
+import fsspec
+
+from lariat_agents.agent.event_payload.event_payload_types import (
+    CompressionType,
+    SupportedPayloadFormat,
+)
+from lariat_agents.constants import (
+    DUCKDB_EXTENSION_DIRECTORY,
+    EVENT_PAYLOAD_MEMORY_BUDGET_BYTES,
+    FRESHNESS_BUCKET_EDGES,
+    FRESHNESS_BUCKET_LABELS,
+    FRESHNESS_MISSING_LABEL,
+)
+
+DUCKDB_TEMPORAL_TYPES = {"DATE", "TIMESTAMP", "TIMESTAMP_NS", "TIMESTAMP_MS", "TIMESTAMP_S"}
+DUCKDB_TEMPORAL_TZ_TYPES = {"TIMESTAMP WITH TIME ZONE"}
+DUCKDB_FLOAT_TYPES = {"FLOAT", "DOUBLE", "REAL"}
+EMPTY_DIMENSION_VALUE = "<empty>"
+DUCKDB_COMPRESSIONS = {
+    CompressionType.NONE: "none",
+    CompressionType.GZIP: "gzip",
+    CompressionType.ZSTD: "zstd",
+}
+
+
+class UnsupportedDuckDBQueryError(Exception):
+    """
+    Raised when a dataset configuration can't be expressed as a duckdb query
+    (the caller falls back to the pandas engine)
+    """
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def quote_literal(value) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def get_duckdb_connection(fsspec_name: str = None):
+    """
+    In-memory duckdb connection that can read the payload location. Remote locations (s3://, gcs://) are read
+    through the same fsspec filesystem the pandas readers use. DuckDB is limited to the memory budget the
+    execution planner uses for the other engines.
+    """
+    connection = duckdb.connect()
+    connection.execute("SET TimeZone='UTC'")
+    connection.execute(
+        f"SET memory_limit='{EVENT_PAYLOAD_MEMORY_BUDGET_BYTES // 1000 ** 2}MB'"
+    )
+    if DUCKDB_EXTENSION_DIRECTORY:
+        connection.execute(
+            f"SET extension_directory={quote_literal(DUCKDB_EXTENSION_DIRECTORY)}"
+        )
+    protocol = urlparse(fsspec_name).scheme if fsspec_name else None
+    if protocol and protocol != "file":
+        connection.register_filesystem(fsspec.filesystem(protocol))
+    return connection
+
+
+def get_duckdb_source(
+    fsspec_name: str,
+    file_type: SupportedPayloadFormat,
+    varchar_columns: List = None,
+    compression: CompressionType = None,
+) -> str:
+    """
+    Table function reading the payload
+    :param fsspec_name:
+    :param file_type:
+    :param varchar_columns: csv columns that must not have their type sniffed (e.g. timestamp sources)
+    :param compression: compression of json and csv payloads, None lets duckdb infer it from the extension
+    :return:
+    """
+    path = quote_literal(fsspec_name)
+    if file_type == SupportedPayloadFormat.PARQUET:
+        return f"read_parquet({path})"
+    options = ""
+    if compression is not None and file_type != SupportedPayloadFormat.AVRO:
+        if compression not in DUCKDB_COMPRESSIONS:
+            raise UnsupportedDuckDBQueryError(
+                f"No duckdb decompression for {compression.value} files"
+            )
+        options = f", compression={quote_literal(DUCKDB_COMPRESSIONS[compression])}"
+    if file_type == SupportedPayloadFormat.JSONL:
+        return f"read_json_auto({path}, format='newline_delimited'{options})"
+    elif file_type == SupportedPayloadFormat.JSON:
+        return f"read_json_auto({path}, format='array'{options})"
+    elif file_type == SupportedPayloadFormat.CSV:
+        if varchar_columns:
+            options += ", types={" + ", ".join(
+                f"{quote_literal(col)}: 'VARCHAR'" for col in varchar_columns
+            ) + "}"
+        return f"read_csv_auto({path}, ignore_errors=true{options})"
+    raise UnsupportedDuckDBQueryError(f"No duckdb reader for {file_type.value} files")
+
+
+def describe_source(connection, source: str) -> Dict[str, str]:
+    """
+    :return: column name -> duckdb type of the payload
+    """
+    return {
+        row[0]: row[1]
+        for row in connection.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()
+    }
+
+
+def null_safe_column(expression: str, column_type: str) -> str:
+    """
+    DuckDB treats NaN as a value while pandas treats it as missing
+    """
+    if column_type in DUCKDB_FLOAT_TYPES:
+        return f"NULLIF({expression}, 'NaN'::DOUBLE)"
+    return expression
+
+
+def normalized_dimension(expression: str) -> str:
+    """
+    Same normalization as the pandas engine applies to dimension values: strip, and map empty/null to <empty>
+    """
+    return (
+        f"COALESCE(NULLIF(TRIM(CAST({expression} AS VARCHAR)), ''), "
+        f"{quote_literal(EMPTY_DIMENSION_VALUE)})"
+    )
+
+
+def get_date_precision_unit(format_str: str):
+    """
+    Finest date part present in a strptime format, mirroring EventPayloadQueryBuilder.adjust_date_precision
+    """
+    if "%S" in format_str:
+        return None
+    elif "%M" in format_str:
+        return "minute"
+    elif "%H" in format_str or "%I" in format_str:
+        return "hour"
+    elif "%d" in format_str:
+        return "day"
+    elif "%m" in format_str or "%b" in format_str or "%B" in format_str:
+        return "month"
+    elif "%Y" in format_str:
+        return "year"
+    return None
+
+
+def adjust_date_precision(local_expression: str, format_str: str, max_or_min: str):
+    """
+    Floor (min) or ceil to the last second (max) of the precision given by the format
+    :return: the adjusted wall clock timestamp expression and the precision unit
+    """
+    unit = get_date_precision_unit(format_str)
+    if unit is None:
+        return local_expression, unit
+    truncated = f"date_trunc('{unit}', {local_expression})"
+    if max_or_min == "min":
+        return truncated, unit
+    return f"({truncated} + INTERVAL 1 {unit} - INTERVAL 1 second)", unit
+
+
+def get_freshness_case(
+    minutes_expression: str,
+    edges: List = FRESHNESS_BUCKET_EDGES,
+    labels: List = FRESHNESS_BUCKET_LABELS,
+) -> str:
+    """
+    Same buckets as EventPayloadQueryBuilder.calculate_freshness: future buckets (edges <= 0) include their
+    lower edge, past buckets their upper edge
+    """
+    diff = minutes_expression
+    bounds = [None] + list(edges) + [None]
+    whens = []
+    for low, high, label in zip(bounds, bounds[1:], labels):
+        conditions = []
+        if low is not None:
+            conditions.append(f"{diff} {'>=' if low <= 0 else '>'} {low}")
+        if high is not None:
+            conditions.append(f"{diff} {'<' if high <= 0 else '<='} {high}")
+        whens.append(f"WHEN {' AND '.join(conditions)} THEN {quote_literal(label)}")
+    return (
+        f"CASE {' '.join(whens)} "
+        f"ELSE {quote_literal(FRESHNESS_MISSING_LABEL)} END"
+    )
@@ -0,0 +1,219 @@
+"""
+    Geometry handling for wkb dimensions, done a whole column at a time with the shapely array functions.
+    Point in polygon lookups for the state and country functions of wkb dimensions.
+    The Natural Earth layers are loaded once per process into a prepared STRtree, from the GeoParquet snapshots
+    shipped next to the shapefiles (or from the shapefiles when a snapshot is missing). Lookups are a single bulk
+    query of a chunk's geometries against the tree.
+"""
+import json
+import logging
+import os
+from functools import lru_cache
+from typing import Dict
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import CRS, Transformer
+from shapely.strtree import STRtree
+
+SHAPEFILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "shapefiles")
+# geo function -> (Natural Earth layer, name column)
+GEO_LAYERS = {
+    "country": ("ne_110m_admin_0_countries", "ADMIN"),
+    "state": ("ne_110m_admin_1_states_provinces", "name"),
+}
+# Alpha 3 code columns of the country layer: ISO_A3, or ADM0_A3 where it is -99 (e.g. Kosovo)
+COUNTRY_CODE_COLUMNS = ["ISO_A3", "ADM0_A3"]
+COUNTRY_ALPHA3_PATH = os.path.join(SHAPEFILES_DIR, "country_alpha3.json")
+GEO_MISSING_VALUE = "<empty>"
+# Dimension value of every geo function for values that aren't valid WKB
+GEO_INVALID_VALUE = "<invalid>"
+# Indexed by shapely.get_type_id
+GEOMETRY_TYPE_NAMES = np.array(
+    [
+        "Point",
+        "LineString",
+        "LinearRing",
+        "Polygon",
+        "MultiPoint",
+        "MultiLineString",
+        "MultiPolygon",
+        "GeometryCollection",
+    ],
+    dtype=object,
+)
+
+
+class GeoIndex:
+    def __init__(self, names, geometries, crs):
+        """
+        :param names: name of each polygon
+        :param geometries: polygons
+        :param crs: crs of the polygons
+        """
+        self.names = np.asarray(names, dtype=object)
+        self.geometries = np.asarray(geometries, dtype=object)
+        self.crs = crs
+        shapely.prepare(self.geometries)
+        self.tree = STRtree(self.geometries)
+        self.transformers = {}
+
+    def get_transformer(self, epsg):
+        """
+        Transformer from the given crs to the layer's crs, None when they are the same
+        """
+        if epsg not in self.transformers:
+            crs = CRS.from_user_input(f"EPSG:{epsg}") if epsg else self.crs
+            self.transformers[epsg] = (
+                None
+                if crs == self.crs
+                else Transformer.from_crs(crs, self.crs, always_xy=True)
+            )
+        return self.transformers[epsg]
+
+    def lookup(self, geometries, epsg=None):
+        """
+        Name of the polygon each geometry is within, GEO_MISSING_VALUE when there is none. When polygons
+        overlap the first one in the layer is used.
+        :param geometries: array of shapely geometries
+        :param epsg: crs of the geometries, reprojected to the layer's crs when they differ
+        :return: array of names
+        """
+        geometries = np.asarray(geometries, dtype=object)
+        transformer = self.get_transformer(epsg)
+        if transformer is not None:
+            geometries = shapely.transform(
+                geometries,
+                lambda coords: np.column_stack(
+                    transformer.transform(coords[:, 0], coords[:, 1])
+                ),
+            )
+        # Bounding box candidates, then the exact test with the prepared polygons as the first argument
+        # (a "within" predicate query would evaluate the unprepared input geometries instead)
+        input_index, tree_index = self.tree.query(geometries)
+        within = shapely.contains(
+            self.geometries[tree_index], geometries[input_index]
+        )
+        input_index = input_index[within]
+        tree_index = tree_index[within]
+        result = np.full(len(geometries), GEO_MISSING_VALUE, dtype=object)
+        order = np.lexsort((tree_index, input_index))
+        input_index = input_index[order]
+        tree_index = tree_index[order]
+        first = np.ones(len(input_index), dtype=bool)
+        first[1:] = input_index[1:] != input_index[:-1]
+        result[input_index[first]] = self.names[tree_index[first]]
+        return result
+
+
+def decode_wkb(values):
+    """
+    :param values: WKB (bytes or hex strings)
+    :return: geometries (None where missing or malformed) and the mask of malformed values
+    """
+    values = np.asarray(values, dtype=object)
+    geometries = shapely.from_wkb(values, on_invalid="ignore")
+    invalid = shapely.is_missing(geometries) & ~pd.isna(values)
+    return geometries, invalid
+
+
+def get_geometry_type_names(geometries):
+    """
+    :return: geometry type name of each geometry, GEO_MISSING_VALUE for missing geometries
+    """
+    type_ids = shapely.get_type_id(geometries)
+    names = np.full(len(type_ids), GEO_MISSING_VALUE, dtype=object)
+    present = type_ids >= 0
+    names[present] = GEOMETRY_TYPE_NAMES[type_ids[present]]
+    return names
+
+
+def get_snapshot_path(layer):
+    return os.path.join(SHAPEFILES_DIR, f"{layer}.parquet")
+
+
+def write_snapshot(mode):
+    """
+    Write the GeoParquet snapshot (names, country codes and geometries only) of a geo function's layer
+    """
+    layer, name_column = GEO_LAYERS[mode]
+    columns = [name_column] + (COUNTRY_CODE_COLUMNS if mode == "country" else [])
+    gdf = gpd.read_file(os.path.join(SHAPEFILES_DIR, f"{layer}.shp"))
+    gdf[columns + ["geometry"]].to_parquet(get_snapshot_path(layer), index=False)
+
+
+@lru_cache(maxsize=None)
+def get_geo_index(mode) -> GeoIndex:
+    """
+    Index of a geo function's layer, built on first use and kept for the life of the process
+    :param mode: country or state
+    """
+    layer, name_column = GEO_LAYERS[mode]
+    snapshot_path = get_snapshot_path(layer)
+    if os.path.exists(snapshot_path):
+        gdf = gpd.read_parquet(snapshot_path)
+    else:
+        logging.warning(f"No snapshot of {layer}, reading the shapefile")
+        gdf = gpd.read_file(os.path.join(SHAPEFILES_DIR, f"{layer}.shp"))
+    return GeoIndex(gdf[name_column].to_numpy(), gdf.geometry.to_numpy(), gdf.crs)
+
+
+def write_country_alpha3():
+    """
+    Write the country name -> alpha 3 table. Keys are lower cased: the ADMIN name of every country of the
+    snapshot, which the country function looks up, mapped to its code columns (see COUNTRY_CODE_COLUMNS),
+    and the name and official name of the pycountry countries Natural Earth names differently.
+    """
+    import pycountry
+
+    alpha3 = {}
+    for country in pycountry.countries:
+        alpha3[country.name.lower()] = country.alpha_3
+    for country in pycountry.countries:
+        official_name = getattr(country, "official_name", None)
+        if official_name:
+            alpha3[official_name.lower()] = country.alpha_3
+    layer, name_column = GEO_LAYERS["country"]
+    countries = pd.read_parquet(
+        get_snapshot_path(layer), columns=[name_column] + COUNTRY_CODE_COLUMNS
+    )
+    iso_a3, adm0_a3 = (countries[column] for column in COUNTRY_CODE_COLUMNS)
+    codes = iso_a3.where(iso_a3.str.fullmatch("[A-Z]{3}"), adm0_a3)
+    alpha3.update(zip(countries[name_column].str.lower(), codes))
+    with open(COUNTRY_ALPHA3_PATH, "w") as f:
+        json.dump(dict(sorted(alpha3.items())), f, indent=1, ensure_ascii=False)
+
+
+@lru_cache(maxsize=None)
+def get_country_alpha3() -> Dict[str, str]:
+    with open(COUNTRY_ALPHA3_PATH) as f:
+        return json.load(f)
+
+
+def map_country_names_to_alpha3(names):
+    """
+    Alpha 3 code of each country name (case insensitive, see write_country_alpha3), names without a code are
+    kept as they are. Each distinct name is looked up once.
+    :param names: array of country names
+    :return: array of codes
+    """
+    country_alpha3 = get_country_alpha3()
+    codes, uniques = pd.factorize(np.asarray(names, dtype=object))
+    # The trailing None is what missing names (code -1) map to
+    mapped = np.array(
+        [
+            country_alpha3.get(name.lower(), name) if isinstance(name, str) else name
+            for name in uniques
+        ]
+        + [None],
+        dtype=object,
+    )
+    return mapped[codes]
+
+
+if __name__ == "__main__":
+    for geo_function in GEO_LAYERS:
+        write_snapshot(geo_function)
+    write_country_alpha3()
@@ -0,0 +1,165 @@
+"""
+    Extraction of nested payload fields referenced by path, e.g. attrs.k (struct field) or items[0].sku
+    (list element, then struct field). The same path syntax is accepted in dimensions, columns.string and
+    columns.number. The extracted values become a flat column named after the path.
+    Paths are followed on Arrow arrays with pyarrow.compute. A dataframe column holding Python objects is
+    converted to Arrow once per chunk when several paths start from it. pa.array converts every field of the
+    objects, which costs more than following a single path (2-5x on dicts of a few fields), so a single path
+    (or values that Arrow can't represent as one type) is followed by walking the Python objects instead.
+"""
+import logging
+import re
+from typing import Dict, List, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+PATH_STEP_PATTERN = re.compile(r"\[(\d+)\]|\.?([^.\[\]]+)")
+
+
+def parse_path(path: str) -> List[Union[str, int]]:
+    """
+    :return: steps of the path, field names as str and list indices as int
+    """
+    steps = []
+    for index, field in PATH_STEP_PATTERN.findall(path):
+        steps.append(int(index) if index else field)
+    return steps
+
+
+def get_nested_path_root(path: str, columns) -> Union[str, None]:
+    """
+    :return: the payload column a path starts from, None when the name isn't a nested path of the columns
+    (including a column whose name contains dots or brackets)
+    """
+    if path in columns:
+        return None
+    steps = parse_path(path)
+    if len(steps) > 1 and isinstance(steps[0], str) and steps[0] in columns:
+        return steps[0]
+    return None
+
+
+def get_list_element(array: pa.Array, index: int) -> pa.Array:
+    """
+    Element at index of each list, null when the list is null or too short
+    """
+    offsets = array.offsets.to_numpy(zero_copy_only=False)
+    lengths = offsets[1:] - offsets[:-1]
+    missing = lengths <= index
+    if array.null_count:
+        missing |= ~array.is_valid().to_numpy(zero_copy_only=False)
+    return array.values.take(pa.array(offsets[:-1] + index, mask=missing))
+
+
+def extract_array_path(array: pa.Array, steps) -> pa.Array:
+    for step in steps:
+        if isinstance(step, int) and (
+            pa.types.is_list(array.type) or pa.types.is_large_list(array.type)
+        ):
+            array = get_list_element(array, step)
+        elif (
+            isinstance(step, str)
+            and pa.types.is_struct(array.type)
+            and array.type.get_field_index(step) >= 0
+        ):
+            array = pc.struct_field(array, [array.type.get_field_index(step)])
+        else:
+            return pa.nulls(len(array))
+    return array
+
+
+def get_value_path(value, steps):
+    """
+    Python counterpart of extract_array_path for a single value
+    """
+    for step in steps:
+        if isinstance(step, int):
+            if isinstance(value, (list, tuple, np.ndarray)) and len(value) > step:
+                value = value[step]
+            else:
+                return None
+        elif isinstance(value, dict):
+            value = value.get(step)
+        else:
+            return None
+    return value
+
+
+def get_values_path(values, steps, as_string=False):
+    """
+    Python counterpart of extract_array_path for a column of objects
+    """
+    extracted = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        value = get_value_path(value, steps)
+        if as_string and value is not None and not isinstance(value, (str, dict, list)):
+            value = str(value)
+        extracted[i] = value
+    return extracted
+
+
+def to_string_array(array: pa.Array) -> pa.Array:
+    if pa.types.is_nested(array.type) or pa.types.is_null(array.type):
+        return array
+    try:
+        return pc.cast(array, pa.string())
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return array
+
+
+def extract_nested_fields(
+    data: Union[pd.DataFrame, pa.Table], paths: Dict[str, str], string_names=()
+):
+    """
+    Add a flat column for each nested path of the data. Names that are already columns are left alone.
+    :param data: dataframe or arrow table
+    :param paths: column name -> path, e.g. {"attrs.k": "attrs.k", "first_sku": "items[0].sku"}
+    :param string_names: names whose scalar values are cast to strings (dimensions)
+    :return: the data with the extracted columns
+    """
+    columns = data.column_names if isinstance(data, pa.Table) else data.columns
+    roots = [get_nested_path_root(path, columns) for path in paths.values()]
+    arrays = {}
+    for name, path in paths.items():
+        if name in columns:
+            continue
+        if path in columns:
+            data = (
+                data.append_column(name, data.column(path))
+                if isinstance(data, pa.Table)
+                else data.assign(**{name: data[path]})
+            )
+            continue
+        root = get_nested_path_root(path, columns)
+        if root is None:
+            continue
+        steps = parse_path(path)[1:]
+        if root not in arrays:
+            if isinstance(data, pa.Table):
+                arrays[root] = data.column(root).combine_chunks()
+            elif roots.count(root) == 1:
+                arrays[root] = None
+            else:
+                try:
+                    arrays[root] = pa.array(data[root], from_pandas=True)
+                except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                    logging.info(
+                        f"Mixed types in {root}, extracting its nested fields row by row"
+                    )
+                    arrays[root] = None
+        if arrays[root] is None:
+            data[name] = get_values_path(
+                data[root].to_numpy(), steps, name in string_names
+            )
+            continue
+        array = extract_array_path(arrays[root], steps)
+        if name in string_names:
+            array = to_string_array(array)
+        if isinstance(data, pa.Table):
+            data = data.append_column(name, array)
+        else:
+            data[name] = array.to_pandas().to_numpy()
+    return data
@@ -0,0 +1,221 @@
+"""
+    Per-invocation handles on the payload objects an event points to.
+    The object size comes from the single metadata call made when the event is matched to a dataset and the
+    bytes fetched for mime sniffing are kept. Every byte range read afterwards (parquet footer, avro header,
+    chunks) goes through a shared block cache, so sniffing, schema inference and the metrics pass don't each
+    re-open and re-fetch the object.
+    Payload objects are exposed to the readers (pandas, pyarrow, duckdb, fsspec) as a registered fsspec
+    protocol: lariatpayload://<protocol>/<bucket>/<key>.
+"""
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock
+
+import fsspec
+from fsspec.spec import AbstractBufferedFile, AbstractFileSystem
+
+from lariat_agents.constants import (
+    PAYLOAD_OBJECT_BLOCK_SIZE,
+    PAYLOAD_OBJECT_CACHE_BYTES,
+)
+
+PAYLOAD_OBJECT_PROTOCOL = "lariatpayload"
+
+
+class PayloadObject:
+    def __init__(
+        self,
+        fsspec_name: str,
+        size: int,
+        header_bytes: bytes = b"",
+        block_size: int = PAYLOAD_OBJECT_BLOCK_SIZE,
+        cache_bytes: int = PAYLOAD_OBJECT_CACHE_BYTES,
+    ):
+        """
+        :param fsspec_name: location of the object (e.g. s3://bucket/key)
+        :param size: object size in bytes
+        :param header_bytes: bytes already fetched from the start of the object
+        :param block_size: granularity of the cache
+        :param cache_bytes: maximum number of cached bytes, least recently used blocks are evicted first
+        """
+        self.fsspec_name = fsspec_name
+        self.size = size
+        self.header_bytes = header_bytes[:size]
+        self.block_size = block_size
+        self.max_blocks = max(1, cache_bytes // block_size)
+        self.filesystem, self.path = fsspec.core.url_to_fs(fsspec_name)
+        self.blocks = OrderedDict()
+        # Blocks being fetched by a reader: block -> (future of the fetched run, first block of the run)
+        self.in_flight = {}
+        self.fetched_bytes = 0
+        self.lock = Lock()
+
+    def reopen(self):
+        """
+        Rebuild the filesystem and lock of an object inherited by a forked worker process. fsspec's async
+        filesystems (s3fs, gcsfs) can't be used across a fork, and the lock may have been held by a thread of
+        the parent when it forked.
+        """
+        self.filesystem, self.path = fsspec.core.url_to_fs(
+            self.fsspec_name, skip_instance_cache=True
+        )
+        self.lock = Lock()
+        self.in_flight = {}
+
+    @property
+    def url(self):
+        return f"{PAYLOAD_OBJECT_PROTOCOL}://{self.fsspec_name.replace('://', '/', 1)}"
+
+    def fetch(self, start, end):
+        return self.filesystem.cat_file(self.path, start=start, end=end)
+
+    def read_range(self, start, end):
+        """
+        Bytes [start, end) of the object, fetching the missing blocks with one request per contiguous run.
+        Runs are fetched outside the lock so concurrent readers fetch in parallel, a block already being
+        fetched by another reader is waited for rather than fetched again.
+        """
+        start = max(0, start)
+        end = min(end, self.size)
+        if start >= end:
+            return b""
+        if end <= len(self.header_bytes):
+            return self.header_bytes[start:end]
+        first_block = start // self.block_size
+        last_block = (end - 1) // self.block_size
+        parts = {}
+        pending = {}
+        missing_runs = []
+        with self.lock:
+            for block in range(first_block, last_block + 1):
+                if block in self.blocks:
+                    self.blocks.move_to_end(block)
+                    parts[block] = self.blocks[block]
+                elif block in self.in_flight:
+                    pending[block] = self.in_flight[block]
+                elif missing_runs and missing_runs[-1][1] == block:
+                    missing_runs[-1][1] = block + 1
+                else:
+                    missing_runs.append([block, block + 1])
+            runs = [
+                (run_start, run_end, Future()) for run_start, run_end in missing_runs
+            ]
+            for run_start, run_end, future in runs:
+                for block in range(run_start, run_end):
+                    self.in_flight[block] = (future, run_start)
+        try:
+            for run_start, run_end, future in runs:
+                future.set_result(
+                    self.fetch(
+                        run_start * self.block_size,
+                        min(run_end * self.block_size, self.size),
+                    )
+                )
+        except BaseException as e:
+            for _, _, future in runs:
+                if not future.done():
+                    future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                for run_start, run_end, future in runs:
+                    data = None if future.exception() else future.result()
+                    if data is not None:
+                        self.fetched_bytes += len(data)
+                    for block in range(run_start, run_end):
+                        self.in_flight.pop(block, None)
+                        if data is not None:
+                            offset = (block - run_start) * self.block_size
+                            self.blocks[block] = parts[block] = data[
+                                offset : offset + self.block_size
+                            ]
+                # Evict after the blocks are gathered so a read larger than the cache is still served
+                while len(self.blocks) > self.max_blocks:
+                    self.blocks.popitem(last=False)
+        for block, (future, run_start) in pending.items():
+            offset = (block - run_start) * self.block_size
+            parts[block] = future.result()[offset : offset + self.block_size]
+        data = b"".join(parts[block] for block in range(first_block, last_block + 1))
+        offset = first_block * self.block_size
+        return data[start - offset : end - offset]
+
+
+class PayloadObjectFile(AbstractBufferedFile):
+    def __init__(self, fs, path, payload_object: PayloadObject, **kwargs):
+        self.payload_object = payload_object
+        super().__init__(
+            fs, path, mode="rb", size=payload_object.size, cache_type="none", **kwargs
+        )
+
+    def _fetch_range(self, start, end):
+        return self.payload_object.read_range(start, end)
+
+
+class PayloadObjectFileSystem(AbstractFileSystem):
+    """
+    Read-only filesystem over the registered payload objects
+    """
+
+    protocol = PAYLOAD_OBJECT_PROTOCOL
+    payload_objects = {}
+
+    @classmethod
+    def register(cls, payload_object: PayloadObject) -> str:
+        """
+        :return: the fsspec name the readers should use for the object
+        """
+        cls.payload_objects[cls._strip_protocol(payload_object.url)] = payload_object
+        return payload_object.url
+
+    @classmethod
+    def release(cls):
+        """
+        Drop all payload objects (and their cached bytes), called at the end of an invocation
+        """
+        cls.payload_objects.clear()
+
+    @classmethod
+    def reopen(cls):
+        """
+        Reopen every payload object, the initializer of forked worker processes
+        """
+        for payload_object in cls.payload_objects.values():
+            payload_object.reopen()
+
+    def get_payload_object(self, path) -> PayloadObject:
+        path = self._strip_protocol(path)
+        if path not in self.payload_objects:
+            raise FileNotFoundError(path)
+        return self.payload_objects[path]
+
+    def info(self, path, **kwargs):
+        payload_object = self.get_payload_object(path)
+        return {
+            "name": self._strip_protocol(path),
+            "size": payload_object.size,
+            "type": "file",
+        }
+
+    def ls(self, path, detail=True, **kwargs):
+        info = self.info(path)
+        return [info] if detail else [info["name"]]
+
+    def cat_file(self, path, start=None, end=None, **kwargs):
+        payload_object = self.get_payload_object(path)
+        start = 0 if start is None else start
+        end = payload_object.size if end is None else end
+        if start < 0:
+            start += payload_object.size
+        if end < 0:
+            end += payload_object.size
+        return payload_object.read_range(start, end)
+
+    def _open(self, path, mode="rb", **kwargs):
+        if mode != "rb":
+            raise NotImplementedError("Payload objects are read only")
+        kwargs.pop("cache_type", None)
+        kwargs.pop("size", None)
+        return PayloadObjectFile(self, path, self.get_payload_object(path), **kwargs)
+
+
+fsspec.register_implementation(PAYLOAD_OBJECT_PROTOCOL, PayloadObjectFileSystem)
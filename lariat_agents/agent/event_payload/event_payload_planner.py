@@ -0,0 +1,337 @@
+"""
+    Execution planning for the event payload agent.
+    The planner estimates the size of a payload once decoded into a dataframe and its bytes per row, from the
+    format, the detected compression, the columns that are read and a parsed sample of the first rows (or the
+    parquet footer). Payloads that fit the memory budget are processed in a single batch, larger ones are streamed
+    in chunks sized so that every chunk held at once (read ahead, in workers) fits the budget.
+    The bytes per row estimate is corrected with the first chunk that is read (see rechunk). The parsed sample
+    also gives the schema of jsonl and csv payloads before they are read, so csv columns can be projected.
+"""
+import logging
+import zlib
+from io import BytesIO
+
+import fsspec
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import zstandard
+
+from lariat_agents.agent.event_payload.event_payload_avro import (
+    get_avro_writer_schema,
+    get_projected_fields,
+)
+from lariat_agents.agent.event_payload.event_payload_compression import (
+    decompress_prefix,
+    resolve_compression,
+)
+from lariat_agents.agent.event_payload.event_payload_types import (
+    CompressionType,
+    ExecutionEngine,
+    SupportedPayloadFormat,
+)
+from lariat_agents.constants import (
+    EVENT_PAYLOAD_MEMORY_BUDGET_BYTES,
+    STREAMING_CHUNKSIZE,
+    STREAMING_MIN_CHUNKSIZE,
+    STREAMING_MAX_CHUNKSIZE,
+)
+
+# Bytes of the object parsed to estimate the bytes per row of jsonl and csv payloads
+SAMPLE_BYTES = 256 * 1024
+# Uncompressed bytes per compressed byte, used when the sample can't be decompressed
+COMPRESSION_RATIOS = {
+    CompressionType.GZIP: 5.0,
+    CompressionType.BZIP2: 7.0,
+    CompressionType.SNAPPY: 3.0,
+    CompressionType.ZSTD: 6.0,
+    CompressionType.NONE: 1.0,
+}
+# Dataframe bytes per uncompressed payload byte, used when there is no sample to measure
+FORMAT_EXPANSIONS = {
+    SupportedPayloadFormat.JSONL: 2.0,
+    SupportedPayloadFormat.JSON: 2.0,
+    SupportedPayloadFormat.CSV: 3.0,
+    SupportedPayloadFormat.AVRO: 4.0,
+}
+# Dataframe bytes per arrow byte (strings become python objects in to_pandas)
+ARROW_TO_PANDAS_EXPANSION = 2.0
+# Dataframe bytes per value when only the column count is known
+BYTES_PER_VALUE = 64
+DEFAULT_ROW_BYTES = 1024
+# Peak memory of handle_calculation relative to the dataframe it aggregates
+# (timestamp, freshness and dimension columns, group by)
+PROCESSING_OVERHEAD = 3.0
+
+
+class ExecutionPlan:
+    """
+    Batch or streaming execution of a payload and the streaming chunk size
+    """
+
+    def __init__(
+        self,
+        streaming: bool = True,
+        engine: ExecutionEngine = ExecutionEngine.PANDAS,
+        chunksize: int = STREAMING_CHUNKSIZE or STREAMING_MAX_CHUNKSIZE,
+        row_bytes: float = None,
+        decoded_bytes: float = None,
+        chunks_in_memory: int = 1,
+        memory_budget: int = EVENT_PAYLOAD_MEMORY_BUDGET_BYTES,
+        sample_df: pd.DataFrame = None,
+    ):
+        """
+        :param streaming: stream the payload in chunks rather than reading it as a single dataframe
+        :param engine: engine used to read and aggregate the payload
+        :param chunksize: rows per streamed chunk
+        :param row_bytes: estimated dataframe bytes per row, None when unknown
+        :param decoded_bytes: estimated dataframe bytes of the whole payload, None when unknown
+        :param chunks_in_memory: chunks held at the same time while streaming
+        :param memory_budget: bytes the decoded chunks have to fit in
+        :param sample_df: parsed first rows of a jsonl or csv payload with all of its columns, None when the
+        payload wasn't sampled
+        """
+        self.streaming = streaming
+        self.engine = engine
+        self.chunksize = chunksize
+        self.row_bytes = row_bytes
+        self.decoded_bytes = decoded_bytes
+        self.chunks_in_memory = chunks_in_memory
+        self.memory_budget = memory_budget
+        self.sample_df = sample_df
+
+    @property
+    def chunk_budget(self):
+        return self.memory_budget / (self.chunks_in_memory * PROCESSING_OVERHEAD)
+
+    def size_chunks(self, row_bytes):
+        """
+        Set the chunk size from the bytes per row, unless it is fixed by STREAMING_CHUNKSIZE
+        """
+        self.row_bytes = row_bytes
+        if STREAMING_CHUNKSIZE:
+            self.chunksize = STREAMING_CHUNKSIZE
+        else:
+            self.chunksize = int(
+                min(
+                    max(self.chunk_budget // max(row_bytes, 1), STREAMING_MIN_CHUNKSIZE),
+                    STREAMING_MAX_CHUNKSIZE,
+                )
+            )
+
+    def describe(self):
+        mode = f"streaming ({self.chunksize} rows per chunk)" if self.streaming else "batch"
+        decoded = (
+            f"~{self.decoded_bytes / 2 ** 20:.1f} MB"
+            if self.decoded_bytes is not None
+            else "unknown size"
+        )
+        return (
+            f"{mode} with the {self.engine.value} engine, {decoded} decoded, ~{self.row_bytes:.0f} bytes/row, "
+            f"{self.memory_budget / 2 ** 20:.0f} MB budget"
+        )
+
+
+def get_chunk_bytes(chunk):
+    """
+    Dataframe bytes of a chunk (arrow tables are measured as the dataframe they are converted to)
+    """
+    if isinstance(chunk, pa.Table):
+        return chunk.nbytes * ARROW_TO_PANDAS_EXPANSION
+    return chunk.memory_usage(deep=True, index=False).sum()
+
+
+def get_chunk_rows(chunk):
+    return chunk.num_rows if isinstance(chunk, pa.Table) else len(chunk)
+
+
+def decompress_sample(sample, compression):
+    """
+    Decompress the start of an object
+    :return: decompressed bytes, or None when the compression can't be decoded from a partial object
+    """
+    try:
+        return decompress_prefix(sample, compression)
+    except (zlib.error, OSError, EOFError, zstandard.ZstdError) as e:
+        logging.warning(f"Couldn't decompress the payload sample: {e}")
+    return None
+
+
+def parse_text_sample(text, file_type):
+    """
+    Parse the complete rows of the start of a jsonl or csv payload
+    :return: dataframe of the sample rows and their payload bytes, the dataframe is None when the sample has no
+    complete row
+    """
+    end = text.rfind(b"\n")
+    if end < 0:
+        return None, 0
+    text = text[: end + 1]
+    try:
+        if file_type == SupportedPayloadFormat.JSONL:
+            df = pd.read_json(BytesIO(text), lines=True)
+            text_bytes = len(text)
+        else:
+            df = pd.read_csv(BytesIO(text), on_bad_lines="skip")
+            text_bytes = len(text) - (text.find(b"\n") + 1)
+    except ValueError as e:
+        logging.warning(f"Couldn't parse the payload sample: {e}")
+        return None, 0
+    if df.empty:
+        return None, 0
+    return df, text_bytes
+
+
+def read_text_sample(fsspec_name, file_type, compression):
+    """
+    Read and parse the first SAMPLE_BYTES of a jsonl or csv payload
+    :return: dataframe of the sample rows (None when the sample can't be used), their payload bytes, and the
+    ratio of decompressed to sampled bytes
+    """
+    with fsspec.open(fsspec_name, mode="rb") as f:
+        sample = f.read(SAMPLE_BYTES)
+    text = decompress_sample(sample, compression)
+    if text is None:
+        return None, 0, None
+    df, text_bytes = parse_text_sample(text, file_type)
+    return df, text_bytes, len(text) / max(len(sample), 1)
+
+
+def estimate_text_payload(fsspec_name, file_type, content_length, compression):
+    """
+    :return: estimated dataframe bytes per row and of the whole payload and the parsed sample rows, None when
+    the sample can't be used
+    """
+    df, text_bytes, expansion = read_text_sample(fsspec_name, file_type, compression)
+    if df is None:
+        return None, None, None
+    row_bytes = df.memory_usage(deep=True, index=False).sum() / len(df)
+    uncompressed_length = content_length * expansion
+    rows = uncompressed_length * len(df) / max(text_bytes, 1)
+    return row_bytes, rows * row_bytes, df
+
+
+def estimate_parquet_payload(fsspec_name, source_columns):
+    """
+    Estimate from the uncompressed column chunk sizes in the parquet footer, counting only the columns read
+    """
+    with fsspec.open(fsspec_name, mode="rb") as f:
+        metadata = pq.read_metadata(f)
+    if not metadata.num_rows:
+        return None, 0
+    arrow_bytes = 0
+    for row_group_index in range(metadata.num_row_groups):
+        row_group = metadata.row_group(row_group_index)
+        for column_index in range(row_group.num_columns):
+            column = row_group.column(column_index)
+            root = column.path_in_schema.split(".")[0]
+            if source_columns is None or root in source_columns:
+                arrow_bytes += column.total_uncompressed_size
+    decoded_bytes = arrow_bytes * ARROW_TO_PANDAS_EXPANSION
+    return decoded_bytes / metadata.num_rows, decoded_bytes
+
+
+def estimate_payload(fsspec_name, file_type, content_length, compression, source_columns):
+    """
+    :return: estimated dataframe bytes per row (None when unknown) and of the whole payload, and the parsed
+    sample rows of jsonl and csv payloads
+    """
+    row_bytes = None
+    decoded_bytes = None
+    sample_df = None
+    try:
+        if file_type == SupportedPayloadFormat.PARQUET:
+            row_bytes, decoded_bytes = estimate_parquet_payload(
+                fsspec_name, source_columns
+            )
+        elif file_type in (SupportedPayloadFormat.JSONL, SupportedPayloadFormat.CSV):
+            row_bytes, decoded_bytes, sample_df = estimate_text_payload(
+                fsspec_name, file_type, content_length, compression
+            )
+        elif file_type == SupportedPayloadFormat.AVRO:
+            row_bytes = BYTES_PER_VALUE * len(
+                get_projected_fields(get_avro_writer_schema(fsspec_name), source_columns)
+            )
+    except (OSError, ValueError) as e:
+        logging.warning(f"Couldn't sample {fsspec_name} to plan its execution: {e}")
+    if decoded_bytes is None:
+        decoded_bytes = (
+            content_length
+            * COMPRESSION_RATIOS.get(compression, 1.0)
+            * FORMAT_EXPANSIONS.get(file_type, 1.0)
+        )
+    return row_bytes, decoded_bytes, sample_df
+
+
+def plan_execution(
+    fsspec_name,
+    file_type: SupportedPayloadFormat,
+    content_length,
+    compression: CompressionType = None,
+    engine: ExecutionEngine = ExecutionEngine.PANDAS,
+    source_columns=None,
+    workers=1,
+    max_in_flight_chunks=1,
+    range_readers=1,
+    memory_budget=EVENT_PAYLOAD_MEMORY_BUDGET_BYTES,
+) -> ExecutionPlan:
+    """
+    Choose batch or streaming execution and the chunk size of a payload (see ExecutionPlan)
+    :param fsspec_name:
+    :param file_type:
+    :param content_length: object size in bytes
+    :param compression: compression detected when the object was matched to its dataset, None to infer it
+    from the extension
+    :param engine: configured engine
+    :param source_columns: columns read from the payload (see get_source_columns) or None for all columns
+    :param workers: streaming worker processes
+    :param max_in_flight_chunks: chunks read ahead of the workers
+    :param range_readers: threads reading byte ranges of jsonl/csv payloads
+    :param memory_budget: bytes the decoded payload has to fit in
+    :return:
+    """
+    compression = resolve_compression(fsspec_name, compression)
+    row_bytes, decoded_bytes, sample_df = estimate_payload(
+        fsspec_name, file_type, content_length, compression, source_columns
+    )
+    chunks_in_memory = max(max_in_flight_chunks, workers) if workers > 1 else 1
+    chunks_in_memory += max(range_readers - 1, 0)
+    plan = ExecutionPlan(
+        streaming=decoded_bytes * PROCESSING_OVERHEAD > memory_budget,
+        engine=engine,
+        decoded_bytes=decoded_bytes,
+        chunks_in_memory=chunks_in_memory,
+        memory_budget=memory_budget,
+        sample_df=sample_df,
+    )
+    plan.size_chunks(row_bytes or DEFAULT_ROW_BYTES)
+    if plan.streaming and file_type == SupportedPayloadFormat.JSON:
+        logging.warning(
+            f"{fsspec_name} is estimated over the memory budget but json documents can't be streamed, "
+            "reading it in a single batch"
+        )
+        plan.streaming = False
+    logging.info(f"Planned {fsspec_name}: {plan.describe()}")
+    return plan
+
+
+def rechunk(chunks, plan: ExecutionPlan):
+    """
+    Size the chunks from the first chunk's measured bytes per row and split the chunks larger than the chunk
+    size (parquet row groups, byte ranges and chunks read before the first one was measured)
+    """
+    for index, chunk in enumerate(chunks):
+        rows = get_chunk_rows(chunk)
+        if index == 0 and rows:
+            plan.size_chunks(get_chunk_bytes(chunk) / rows)
+            logging.info(
+                f"Measured ~{plan.row_bytes:.0f} bytes/row, streaming {plan.chunksize} rows per chunk"
+            )
+        if rows <= plan.chunksize:
+            yield chunk
+            continue
+        for offset in range(0, rows, plan.chunksize):
+            if isinstance(chunk, pa.Table):
+                yield chunk.slice(offset, plan.chunksize)
+            else:
+                yield chunk.iloc[offset : offset + plan.chunksize]
@@ -1,35 +1,109 @@
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    FIRST_COMPLETED,
+    as_completed,
+    wait,
+)
+from io import BytesIO
 from typing import List, Dict
 
 import pandas as pd
-import geopandas as gpd
 
 import fsspec
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.json as pa_json
 import pyarrow.parquet as pq
 import pytz
 
-from lariat_agents.agent.event_payload.event_payload_types import SupportedPayloadFormat
-from lariat_agents.agent.event_payload.event_payload_utils import is_content_too_large
+from lariat_agents.agent.event_payload.event_payload_types import (
+    SupportedPayloadFormat,
+    ExecutionEngine,
+    CompressionType,
+)
+from lariat_agents.agent.event_payload.event_payload_utils import (
+    get_payload_schema,
+    get_payload_schema_from_header,
+)
+from lariat_agents.agent.event_payload.event_payload_aggregate_state import (
+    TOTAL_GROUP_COUNT_COL,
+    PartialStateFold,
+    add_partial_state_columns,
+    encode_dimension,
+    finalize_partial_states,
+)
+from lariat_agents.agent.event_payload.event_payload_geo_index import (
+    GEO_INVALID_VALUE,
+    decode_wkb,
+    get_geo_index,
+    get_geometry_type_names,
+    map_country_names_to_alpha3,
+)
+from lariat_agents.agent.event_payload.event_payload_nested_fields import (
+    extract_nested_fields,
+    get_nested_path_root,
+    parse_path,
+)
+from lariat_agents.agent.event_payload.event_payload_avro import (
+    get_avro_record_batches,
+)
+from lariat_agents.agent.event_payload.event_payload_compression import (
+    open_payload,
+    resolve_compression,
+)
+from lariat_agents.agent.event_payload.event_payload_planner import (
+    ExecutionPlan,
+    plan_execution,
+    read_text_sample,
+    rechunk,
+)
+from lariat_agents.agent.event_payload.event_payload_duckdb_engine import (
+    UnsupportedDuckDBQueryError,
+    DUCKDB_TEMPORAL_TYPES,
+    DUCKDB_TEMPORAL_TZ_TYPES,
+    quote_identifier,
+    quote_literal,
+    get_duckdb_connection,
+    get_duckdb_source,
+    describe_source,
+    null_safe_column,
+    normalized_dimension,
+    adjust_date_precision as adjust_sql_date_precision,
+    get_freshness_case,
+)
 
 from datetime import datetime, timezone
 
 from lariat_agents.base.streaming_base.streaming_base_query_builder import (
     StreamingBaseQueryBuilder,
 )
+import itertools
 import logging
 import re
 from lariat_python_common.sql.fields_uniquifier import DelimiterSeparatedListUniquifier
-from shapely import wkb
-from lariat_agents.constants import STREAMING_CHUNKSIZE
-import pycountry
-from lariat_python_common.pandas.utils import get_df_iterator_from_avro
+from lariat_agents.constants import (
+    EVENT_PAYLOAD_MEMORY_BUDGET_BYTES,
+    STREAMING_WORKERS,
+    STREAMING_MAX_IN_FLIGHT_CHUNKS,
+    STREAMING_RANGE_READERS,
+    STREAMING_RANGE_BYTES,
+    STREAMING_JSON_BLOCK_BYTES,
+    STREAMING_JSON_PARSE_BLOCK_BYTES,
+    FRESHNESS_BUCKET_EDGES,
+    FRESHNESS_BUCKET_LABELS,
+    FRESHNESS_MISSING_LABEL,
+)
+from lariat_python_common.io.utils import get_df_iterator_from_byte_ranges
 import numpy as np
+import duckdb
 
 CATEGORICAL_TYPE = "categorical"
 NUMERICAL_TYPE = "numeric"
 TIME_MAX_PREFIX = "max_"
 TIME_MIN_PREFIX = "min_"
 PREFIX_FOR_PRIMARY = TIME_MAX_PREFIX
-TOTAL_GROUP_COUNT_COL = "total_group_count"
 LARIAT_EXECUTION_TIME_COL = "lariat_agent_execution_time"
 
 META_PREFIX = "partition."
@@ -41,6 +115,19 @@ RESERVED_GEO_FUNCTION_TYPES = {"type", "country", "state"}
 DEFAULT_GEO_FUNCTION_TYPES = {"type", "country", "state"}
 DEFAULT_EPSG = "4326"
 
+# Arrow engine equivalents of the pandas aggregations (function name, options)
+ARROW_AGGREGATIONS = {
+    "count": ("count", pc.CountOptions(mode="only_valid")),
+    "null_count": ("count", pc.CountOptions(mode="only_null")),
+    "sum": ("sum", pc.ScalarAggregateOptions(min_count=0)),
+    "max": ("max", None),
+    "min": ("min", None),
+    "mean": ("mean", None),
+    "std": ("stddev", pc.VarianceOptions(ddof=1)),
+}
+ARROW_VALIDITY_ONLY_AGGREGATIONS = {"count", "null_count"}
+NUMERIC_AGGREGATION_NAMES = ["count", "sum", "max", "min", "mean", "std", "null_count"]
+
 
 class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
     def __init__(
@@ -56,33 +143,20 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
 
     @staticmethod
     def map_country_name_to_alpha3(country_name):
-        country = pycountry.countries.get(official_name=country_name)
-        if country:
-            return country.alpha_3
-        else:
-            country = pycountry.countries.get(name=country_name)
-            if country:
-                return country.alpha_3
-            else:
-                return country_name
+        return map_country_names_to_alpha3([country_name])[0]
 
     @staticmethod
-    def get_geolocation(gdf, mode):
+    def get_geolocation(geometries, mode, epsg=DEFAULT_EPSG):
+        """
+        :param geometries: array of shapely geometries
+        :param mode: country (alpha 3 code) or state (name)
+        :param epsg: crs of the geometries
+        :return: array with the country or state each geometry is within, <empty> when there is none
+        """
+        names = get_geo_index(mode).lookup(geometries, epsg)
         if mode == "country":
-            countries = gpd.read_file("shapefiles/ne_110m_admin_0_countries.shp")
-            gdf.to_crs(crs=countries.crs, inplace=True)
-            gdf = gdf.sjoin(
-                countries[["ADMIN", "geometry"]], how="left", predicate="within"
-            ).fillna("<empty>")
-            gdf["ADMIN"] = gdf["ADMIN"].map(EventPayloadQueryBuilder.map_country_name_to_alpha3)
-            return gdf["ADMIN"]
-        elif mode == "state":
-            states = gpd.read_file("shapefiles/ne_110m_admin_1_states_provinces.shp")
-            gdf.to_crs(crs=states.crs, inplace=True)
-            gdf = gdf.sjoin(
-                states[["name", "geometry"]], how="left", predicate="within"
-            ).fillna("<empty>")
-            return gdf["name"]
+            names = map_country_names_to_alpha3(names)
+        return names
 
     @staticmethod
     def format_row(row, columns_and_separators):
@@ -204,6 +278,29 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
                 logging.warning(f"Selected Configure column {item} is not in dataset")
         return filtered_list
 
+    @staticmethod
+    def factorize_template(components):
+        """
+        Distinct values of a templated timestamp (e.g. "{dt} {hr}") without building a string per row.
+        The component columns are factorized one at a time and only the distinct combinations are concatenated.
+        :param components: list of (column values, separator following the column)
+        :return: codes (-1 where a component is missing) and the templated string of each code
+        """
+        codes = np.zeros(len(components[0][0]), dtype=np.int64)
+        uniques = pd.Series([""], dtype="string")
+        for values, sep in components:
+            component_codes, component_uniques = pd.factorize(values)
+            component_uniques = pd.Series(component_uniques).astype("string") + sep
+            radix = max(len(component_uniques), 1)
+            pairs = pd.array(codes * radix + component_codes, dtype="Int64")
+            pairs[(codes == -1) | (component_codes == -1)] = pd.NA
+            codes, pair_uniques = pd.factorize(pairs)
+            pair_uniques = np.asarray(pair_uniques, dtype=np.int64)
+            uniques = uniques.take(pair_uniques // radix).reset_index(
+                drop=True
+            ) + component_uniques.take(pair_uniques % radix).reset_index(drop=True)
+        return codes, uniques
+
     @staticmethod
     def set_df_timestamp_vars(df, timestamp_mappings, execution_time):
         timestamp_cols = []
@@ -228,12 +325,14 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
                 )
 
                 if filter_list == col_list:
-                    for col, sep in columns_and_separators:
-                        col_name = col.strip("{}")
-                        if key in df.columns:
-                            df[key] = df[key] + df[col_name] + sep
-                        else:
-                            df[key] = df[col_name] + sep
+                    components = [(df[key], "")] if key in df.columns else []
+                    components.extend(
+                        (df[col.strip("{}")], sep)
+                        for col, sep in columns_and_separators
+                    )
+                    codes, uniques = EventPayloadQueryBuilder.factorize_template(
+                        components
+                    )
                     if first_timestamp_column is None:
                         first_timestamp_column = f"{PREFIX_FOR_PRIMARY}{key}"
                     if is_primary:
@@ -254,7 +353,8 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
                     df, [column]
                 )
                 if filter_list:
-                    df[key] = df[column]
+                    codes, uniques = pd.factorize(df[column])
+                    uniques = pd.Series(uniques)
                     if first_timestamp_column is None:
                         first_timestamp_column = f"{PREFIX_FOR_PRIMARY}{key}"
                     if is_primary:
@@ -270,43 +370,50 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
                         f"One of the chosen timestamp fields isn't in the data. Couldn't create {key}"
                     )
                     continue
+            # Parse and adjust each distinct value once, rows without a value map to an extra missing slot
+            if (codes == -1).any():
+                codes = np.where(codes == -1, len(uniques), codes)
+                uniques = pd.concat(
+                    [uniques, pd.Series([None], dtype=uniques.dtype)], ignore_index=True
+                )
+            values = pd.DataFrame(index=uniques.index)
             if format_str != "unixtime":
-                df[key] = df[key].astype("string")
-                df[key] = df[key].str.strip()
-                df[key] = pd.to_datetime(df[key], format=format_str)
+                values[key] = uniques.astype("string")
+                values[key] = values[key].str.strip()
+                values[key] = pd.to_datetime(values[key], format=format_str)
                 if timezone:
                     try:
-                        if df[key].dt.tz is None:
-                            df[key] = df[key].dt.tz_localize(timezone)
+                        if values[key].dt.tz is None:
+                            values[key] = values[key].dt.tz_localize(timezone)
                         else:
-                            df[key] = df[key].dt.tz_convert(timezone)
+                            values[key] = values[key].dt.tz_convert(timezone)
                     except Exception as e:
                         logging.warning("Couldn't find timezone, keeping UTC")
-                        if df[key].dt.tz is None:
-                            df[key] = df[key].dt.tz_localize("UTC")
+                        if values[key].dt.tz is None:
+                            values[key] = values[key].dt.tz_localize("UTC")
                 else:
-                    if df[key].dt.tz is None:
-                        df[key] = df[key].dt.tz_localize("UTC")
+                    if values[key].dt.tz is None:
+                        values[key] = values[key].dt.tz_localize("UTC")
                     else:
-                        if df[key].dt.tz != pytz.UTC:
-                            df[key] = df[key].dt.tz_convert("UTC")
+                        if values[key].dt.tz != pytz.UTC:
+                            values[key] = values[key].dt.tz_convert("UTC")
 
-                df[
+                values[
                     f"{TIME_MAX_PREFIX}{key}"
                 ] = EventPayloadQueryBuilder.adjust_date_precision(
-                    df, format_str, key, "max"
+                    values, format_str, key, "max"
                 )
-                df[
+                values[
                     f"{TIME_MIN_PREFIX}{key}"
                 ] = EventPayloadQueryBuilder.adjust_date_precision(
-                    df, format_str, key, "min"
+                    values, format_str, key, "min"
                 )
 
-                df[f"{TIME_MAX_PREFIX}{key}"] = (
-                    df[f"{TIME_MAX_PREFIX}{key}"].astype("int64") // 10**9
+                values[f"{TIME_MAX_PREFIX}{key}"] = (
+                    values[f"{TIME_MAX_PREFIX}{key}"].astype("int64") // 10**9
                 )
-                df[f"{TIME_MIN_PREFIX}{key}"] = (
-                    df[f"{TIME_MIN_PREFIX}{key}"].astype("int64") // 10**9
+                values[f"{TIME_MIN_PREFIX}{key}"] = (
+                    values[f"{TIME_MIN_PREFIX}{key}"].astype("int64") // 10**9
                 )
 
             else:
@@ -314,10 +421,13 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
                     logging.warning(
                         f"Time is already in unix time. The timezone configuration {timezone} is ignored."
                     )
-                df[key] = df[key].astype(int)
+                values[key] = uniques.astype(int)
                 # These columns are only added in for code reuse
-                df[f"{TIME_MAX_PREFIX}{key}"] = df[key]
-                df[f"{TIME_MIN_PREFIX}{key}"] = df[key]
+                values[f"{TIME_MAX_PREFIX}{key}"] = values[key]
+                values[f"{TIME_MIN_PREFIX}{key}"] = values[key]
+
+            for col in [key, f"{TIME_MAX_PREFIX}{key}", f"{TIME_MIN_PREFIX}{key}"]:
+                df[col] = values[col].array.take(codes)
 
             timestamp_cols.extend(
                 [f"{TIME_MAX_PREFIX}{key}", f"{TIME_MIN_PREFIX}{key}"]
@@ -337,49 +447,94 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
         freshness_dimension = []
         for col in freshness_cols:
             if col != primary_timestamp_column:
-                df, freshness_col_name = EventPayloadQueryBuilder.calculate_freshness(df, col, primary_timestamp_column)
+                edges, _ = EventPayloadQueryBuilder.get_freshness_buckets(
+                    timestamp_mappings[col]
+                )
+                df, freshness_col_name = EventPayloadQueryBuilder.calculate_freshness(
+                    df, col, primary_timestamp_column, edges
+                )
                 freshness_dimension.append(freshness_col_name)
         return timestamp_cols, primary_timestamp_column, freshness_dimension
 
     @staticmethod
-    def calculate_freshness(df, col, primary_timestamp_column):
+    def get_freshness_buckets(timestamp_mapping):
+        """
+        Bucket edges (minutes) and labels of a freshness timestamp. Edges can be set per timestamp with
+        `freshness_buckets` in the dataset's timestamp mapping, e.g. freshness_buckets: [0, 15, 60, 1440]
+        :return: edges and one label per bucket (one more than edges)
+        """
+        edges = timestamp_mapping.get("freshness_buckets")
+        if edges is None or list(edges) == FRESHNESS_BUCKET_EDGES:
+            return FRESHNESS_BUCKET_EDGES, FRESHNESS_BUCKET_LABELS
+        if not edges or any(
+            not isinstance(edge, (int, float)) for edge in edges
+        ) or any(low >= high for low, high in zip(edges, edges[1:])):
+            logging.warning(
+                f"Freshness buckets must be increasing numbers of minutes, got {edges}. Using the defaults"
+            )
+            return FRESHNESS_BUCKET_EDGES, FRESHNESS_BUCKET_LABELS
+        edges = list(edges)
+        labels = (
+            [f"<{edges[0]}min"]
+            + [f"{low}-{high}min" for low, high in zip(edges, edges[1:])]
+            + [f">{edges[-1]}min"]
+        )
+        return edges, labels
+
+    @staticmethod
+    def get_freshness_codes(time_diff, edges):
+        """
+        Bucket index of every time difference, len(edges) + 1 for missing differences
+        """
+        time_diff = np.asarray(time_diff, dtype=np.float64)
+        codes = np.where(
+            time_diff <= 0,
+            np.searchsorted(edges, time_diff, side="right"),
+            np.searchsorted(edges, time_diff, side="left"),
+        )
+        codes[np.isnan(time_diff)] = len(edges) + 1
+        return codes.astype(np.int8 if len(edges) < 126 else np.int32)
+
+    @staticmethod
+    def calculate_freshness(
+        df, col, primary_timestamp_column, edges=FRESHNESS_BUCKET_EDGES
+    ):
+        """
+        Freshness bucket codes of a timestamp column, the codes are only replaced by their labels in the
+        aggregated results (label_freshness)
+        """
         if col != LARIAT_EXECUTION_TIME_COL:
             time_diff = (df[primary_timestamp_column] - df[col].astype("int64") // 10**9) / 60
         else:
             time_diff = (df[primary_timestamp_column] - df[col]) / 60
-        conditions_labels = [
-            (time_diff < -60, "future: >1 hour"),
-            ((time_diff >= -60) & (time_diff < 0), "future: 0-1 hour"),
-            ((time_diff >= 0) & (time_diff <= 5), "0-5min"),
-            ((time_diff > 5) & (time_diff <= 10), "5-10min"),
-            ((time_diff > 10) & (time_diff <= 20), "10-20min"),
-            ((time_diff > 20) & (time_diff <= 30), "20-30min"),
-            ((time_diff > 30) & (time_diff <= 60), "30-60min"),
-            ((time_diff > 60) & (time_diff <= 120), "1-2h"),
-            ((time_diff > 120) & (time_diff <= 180), "2-3h"),
-            ((time_diff > 180) & (time_diff <= 1440), "3-24h"),
-            (time_diff > 1440, ">24h")
-        ]
-        conditions, labels = zip(*conditions_labels)
         freshness_col_name = f"{col}_freshness"
-        df[freshness_col_name] = np.select(conditions, labels)
+        df[freshness_col_name] = EventPayloadQueryBuilder.get_freshness_codes(
+            time_diff, edges
+        )
         return df, freshness_col_name
 
     @staticmethod
-    def calculate_aggregations(
-        df,
-        columns,
-        dimensions,
-        timestamp_cols,
-        source_id,
-        dataset_name,
-        unfiltered_dimensions,
-        aggregations=None,
-    ):
+    def label_freshness(df, timestamp_mappings, freshness_dimensions):
+        for freshness_col_name in freshness_dimensions:
+            key = freshness_col_name.removesuffix("_freshness")
+            _, labels = EventPayloadQueryBuilder.get_freshness_buckets(
+                timestamp_mappings[key]
+            )
+            labels = np.array(labels + [FRESHNESS_MISSING_LABEL], dtype=object)
+            df[freshness_col_name] = labels[df[freshness_col_name].to_numpy()]
+        return df
+
+    @staticmethod
+    def get_aggregation_dict(columns, timestamp_cols, aggregations):
+        """
+        Build the column -> list of aggregations mapping shared by the pandas and arrow engines.
+        Timestamp columns are reduced with max (or min for the min_ prefixed columns).
+        :param columns:
+        :param timestamp_cols:
+        :param aggregations: list of aggregation names or (name, function) tuples
+        :return:
+        """
         agg_dict = {}
-        group_counts = None
-        if not columns or not timestamp_cols:
-            return None
         for agg in aggregations:
             for col in columns:
                 if col in agg_dict:
@@ -402,9 +557,119 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
                     agg_dict[col].append("max")
                 else:
                     agg_dict[col] = ["max"]
+        return agg_dict
+
+    @staticmethod
+    def get_hashed_key_tail(unfiltered_dimensions, source_id, dataset_name):
+        derived_metric_key_tail = (
+            f"{'|'.join(unfiltered_dimensions)}|{source_id}|{dataset_name}"
+        )
+        list_uniquifier = DelimiterSeparatedListUniquifier("|")
+        return list_uniquifier.uniquify_string(derived_metric_key_tail)
+
+    @staticmethod
+    def get_arrow_array(series, validity_only=False):
+        """
+        Convert a dataframe column to an arrow array for the arrow engine.
+        When only the validity of the column is needed (count, null_count) the values aren't converted at all.
+        :param series:
+        :param validity_only:
+        :return:
+        """
+        if validity_only:
+            return pa.array(
+                np.zeros(len(series), dtype=np.int8), mask=series.isna().to_numpy()
+            )
+        try:
+            return pa.Array.from_pandas(series)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Mixed type object columns can't be converted directly
+            return pa.Array.from_pandas(series.astype("string"))
+
+    @staticmethod
+    def calculate_aggregations_arrow(
+        df,
+        columns,
+        dimensions,
+        timestamp_cols,
+        source_id,
+        dataset_name,
+        unfiltered_dimensions,
+        aggregations=None,
+    ):
+        """
+        Arrow engine counterpart of calculate_aggregations. The aggregations are computed with pyarrow's
+        hash aggregate kernels instead of pandas groupby (and python lambdas for null_count).
+        The output has the same column names and order as calculate_aggregations.
+        """
+        if not columns or not timestamp_cols:
+            return None
+        agg_dict = EventPayloadQueryBuilder.get_aggregation_dict(
+            columns, timestamp_cols, aggregations
+        )
+        hashed_key_tail = EventPayloadQueryBuilder.get_hashed_key_tail(
+            unfiltered_dimensions, source_id, dataset_name
+        )
+        table_arrays = [
+            EventPayloadQueryBuilder.get_arrow_array(df[dim]) for dim in dimensions
+        ]
+        table_names = list(dimensions)
+        arrow_aggregations = []
+        output_names = []
+        for col, funcs in agg_dict.items():
+            func_names = [func[0] if isinstance(func, tuple) else func for func in funcs]
+            table_arrays.append(
+                EventPayloadQueryBuilder.get_arrow_array(
+                    df[col],
+                    validity_only=set(func_names) <= ARROW_VALIDITY_ONLY_AGGREGATIONS,
+                )
+            )
+            # Positional names as an aggregated column can also be a dimension
+            aggregate_input_name = f"_aggregate_input_{len(table_names)}"
+            table_names.append(aggregate_input_name)
+            for func_name in func_names:
+                arrow_func, options = ARROW_AGGREGATIONS[func_name]
+                arrow_aggregations.append((aggregate_input_name, arrow_func, options))
+                output_names.append(
+                    f"{func_name}|{col}|{hashed_key_tail}" if col in columns else col
+                )
+        if dimensions:
+            arrow_aggregations.append(([], "count_all"))
+            output_names.append(TOTAL_GROUP_COUNT_COL)
+
+        table = pa.Table.from_arrays(table_arrays, names=table_names)
+        grouped = table.group_by(dimensions).aggregate(arrow_aggregations)
+        # Depending on the pyarrow version the group keys are either the leading or the trailing columns
+        if grouped.column_names[: len(dimensions)] == list(dimensions):
+            key_arrays = grouped.columns[: len(dimensions)]
+            aggregate_arrays = grouped.columns[len(dimensions) :]
+        else:
+            key_arrays = grouped.columns[len(output_names) :]
+            aggregate_arrays = grouped.columns[: len(output_names)]
+        return pa.Table.from_arrays(
+            key_arrays + aggregate_arrays, names=list(dimensions) + output_names
+        ).to_pandas()
+
+    @staticmethod
+    def calculate_aggregations(
+        df,
+        columns,
+        dimensions,
+        timestamp_cols,
+        source_id,
+        dataset_name,
+        unfiltered_dimensions,
+        aggregations=None,
+    ):
+        group_counts = None
+        if not columns or not timestamp_cols:
+            return None
+        agg_dict = EventPayloadQueryBuilder.get_aggregation_dict(
+            columns, timestamp_cols, aggregations
+        )
 
         if dimensions:
-            grouped = df.groupby(dimensions, dropna=False)
+            grouped = df.groupby(dimensions, dropna=False, observed=True)
             group_counts = grouped.size().reset_index(name=TOTAL_GROUP_COUNT_COL)
             grouped = grouped.agg(agg_dict).reset_index()
         else:
@@ -431,11 +696,9 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
             results_df.columns = pd.MultiIndex.from_tuples(results_df.columns)
             grouped = results_df
 
-        derived_metric_key_tail = (
-            f"{'|'.join(unfiltered_dimensions)}|{source_id}|{dataset_name}"
+        hashed_key_tail = EventPayloadQueryBuilder.get_hashed_key_tail(
+            unfiltered_dimensions, source_id, dataset_name
         )
-        list_uniquifier = DelimiterSeparatedListUniquifier("|")
-        hashed_key_tail = list_uniquifier.uniquify_string(derived_metric_key_tail)
         grouped.columns = [
             f"{col[1]}|{col[0]}|{hashed_key_tail}"
             if col[0] in columns and col[1]
@@ -549,6 +812,48 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
                     df[key] = value
         return df, dimensions, string_columns, numeric_columns
 
+    @staticmethod
+    def get_nested_paths(dimensions, string_columns, numeric_columns):
+        """
+        Nested field paths referenced by a dataset config: object dimensions (parent.child), list dimensions
+        ({name: {index: i, col: {parent: child}}} is parent[i].child) and any dimension or column named with a
+        dot/index path (e.g. attrs.k, items[0].sku)
+        :return: column name -> path, and the names used as dimensions
+        """
+        paths = {}
+        dimension_names = set()
+        names = [
+            col.removeprefix(OBJECT_PREFIX)
+            for col in list(string_columns) + list(numeric_columns)
+        ]
+        for dim in dimensions:
+            if dim not in RESERVED_DIMENSIONS:
+                dimension_names.add(dim.removeprefix(OBJECT_PREFIX))
+        if isinstance(dimensions, dict):
+            for dim in dimensions.get("scalar", []) + dimensions.get("object", []):
+                dimension_names.add(dim.removeprefix(OBJECT_PREFIX))
+            for dim in dimensions.get("list", []):
+                for name in dim:
+                    for key_name, child in dim[name]["col"].items():
+                        paths[name] = f"{key_name}[{dim[name]['index']}].{child}"
+                    dimension_names.add(name)
+        for name in names + list(dimension_names):
+            if name not in paths and len(parse_path(name)) > 1:
+                paths[name] = name
+        return paths, dimension_names
+
+    def to_pandas_with_nested_fields(
+        self, table, dimensions, string_columns, numeric_columns
+    ):
+        """
+        Convert an arrow table to a dataframe, extracting the nested fields the config references from the
+        arrow struct/list columns first
+        """
+        nested_paths, dimension_names = self.get_nested_paths(
+            dimensions, string_columns, numeric_columns
+        )
+        return extract_nested_fields(table, nested_paths, dimension_names).to_pandas()
+
     @staticmethod
     def setup_dimensions(df, dimensions):
         new_dimensions = []
@@ -561,24 +866,17 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
         if "scalar" in dimensions:
             for dim in dimensions["scalar"]:
                 new_dimensions.append(dim)
+        if "object" in dimensions or "list" in dimensions:
+            nested_paths, dimension_names = EventPayloadQueryBuilder.get_nested_paths(
+                dimensions, [], []
+            )
+            df = extract_nested_fields(df, nested_paths, dimension_names)
         if "object" in dimensions:
             for dim in dimensions["object"]:
-                parent, child = dim.split(".")
-                df[dim] = df[parent].apply(
-                    lambda x: x.get(child, "") if isinstance(x, dict) else ""
-                )
                 new_dimensions.append(dim)
         if "list" in dimensions:
             for dim in dimensions["list"]:
                 for name in dim:
-                    idx = dim[name]["index"]
-                    col = dim[name]["col"]
-                    for key_name in col:
-                        df[name] = df[key_name].apply(
-                            lambda x: x[idx].get(col.get(key_name), "")
-                            if isinstance(x[idx], dict)
-                            else ""
-                        )
                     new_dimensions.append(name)
 
         if "wkb" in dimensions:
@@ -610,33 +908,31 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
                 geom_state_name = f"{geom_column_name}_geo_state"
                 geom_country_name = f"{geom_column_name}_geo_country"
 
-                df[parsed_geom_name] = df[geom_column_name].apply(
-                    lambda x: wkb.loads(x)
-                )
+                geometries, invalid = decode_wkb(df[geom_column_name])
+                if invalid.any():
+                    logging.warning(
+                        f"{invalid.sum()} values of {geom_column_name} aren't valid WKB"
+                    )
+                df[parsed_geom_name] = geometries
 
-                if any(x in ["state", "country"] for x in geo_function_types):
-                    gdf = gpd.GeoDataFrame(df, geometry=parsed_geom_name)
-                    gdf["centroid"] = gdf.geometry.centroid
-                    gdf.set_crs(epsg=epsg_value, inplace=True)
-                else:
-                    gdf = None
                 if "type" in geo_function_types:
                     new_dimensions.append(geom_type_name)
-                    if gdf is not None:
-                        df[geom_type_name] = gdf.geom_type
-                    else:
-                        df[geom_type_name] = df[parsed_geom_name].apply(
-                            lambda x: x.geom_type
-                        )
+                    geom_types = get_geometry_type_names(geometries)
+                    geom_types[invalid] = GEO_INVALID_VALUE
+                    df[geom_type_name] = geom_types
                 if "state" in geo_function_types:
-                    df[geom_state_name] = EventPayloadQueryBuilder.get_geolocation(
-                        gdf, "state"
+                    geom_states = EventPayloadQueryBuilder.get_geolocation(
+                        geometries, "state", epsg_value
                     )
+                    geom_states[invalid] = GEO_INVALID_VALUE
+                    df[geom_state_name] = geom_states
                     new_dimensions.append(geom_state_name)
                 if "country" in geo_function_types:
-                    df[geom_country_name] = EventPayloadQueryBuilder.get_geolocation(
-                        gdf, "country"
+                    geom_countries = EventPayloadQueryBuilder.get_geolocation(
+                        geometries, "country", epsg_value
                     )
+                    geom_countries[invalid] = GEO_INVALID_VALUE
+                    df[geom_country_name] = geom_countries
                     new_dimensions.append(geom_country_name)
         return df, new_dimensions
 
@@ -650,8 +946,13 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
         timestamp_mappings,
         source_id,
         dataset_name,
-        execution_time
+        execution_time,
+        engine=ExecutionEngine.PANDAS,
     ):
+        nested_paths, dimension_names = self.get_nested_paths(
+            dimensions, string_columns, numeric_columns
+        )
+        df = extract_nested_fields(df, nested_paths, dimension_names)
         object_keys = df.columns
         partition_keys = list()
         df, dimensions = self.setup_dimensions(df, dimensions)
@@ -678,13 +979,26 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
         string_columns = self.get_filtered_columns(columns_set, string_columns)
         numeric_columns = self.get_filtered_columns(columns_set, numeric_columns)
         filtered_dimensions = self.get_filtered_columns(columns_set, dimensions)
+        # Group on dictionary codes. Dimensions that are also aggregated keep their raw values (the counts
+        # need the nulls) and are normalized after grouping instead
+        aggregated_columns = set(string_columns) | set(numeric_columns)
+        raw_dimensions = []
+        for dim in filtered_dimensions:
+            if dim in aggregated_columns:
+                raw_dimensions.append(dim)
+            else:
+                df[dim] = encode_dimension(df[dim])
         if freshness_dimensions:
             filtered_dimensions.extend(freshness_dimensions)
             dimensions.extend(freshness_dimensions)
         total_record_count = df.shape[0]
+        if engine == ExecutionEngine.ARROW:
+            calculate_aggregations = self.calculate_aggregations_arrow
+        else:
+            calculate_aggregations = self.calculate_aggregations
 
         if timestamp_cols and not (not filtered_dimensions and len(dimensions) >= 1):
-            output_data_string_agg = self.calculate_aggregations(
+            output_data_string_agg = calculate_aggregations(
                 df,
                 string_columns,
                 filtered_dimensions,
@@ -706,7 +1020,7 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
             df[filtered_numeric_columns] = df[filtered_numeric_columns].apply(
                 pd.to_numeric, errors="coerce"
             )
-            output_data_numeric_agg = self.calculate_aggregations(
+            output_data_numeric_agg = calculate_aggregations(
                 df,
                 filtered_numeric_columns,
                 filtered_dimensions,
@@ -743,8 +1057,12 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
                 merged_df = None
         else:
             merged_df = None
-        if merged_df is not None and filtered_dimensions:
-            merged_df[dimensions] = merged_df[dimensions].apply(
+        if merged_df is not None and freshness_dimensions:
+            merged_df = self.label_freshness(
+                merged_df, timestamp_mappings, freshness_dimensions
+            )
+        if merged_df is not None and raw_dimensions:
+            merged_df[raw_dimensions] = merged_df[raw_dimensions].apply(
                 lambda x: x.str.strip().replace("", "<empty>").fillna("<empty>")
             )
 
@@ -768,6 +1086,12 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
         location_info,
     ):
         merged_df["total_record_count"] = total_record_count
+        # Dimensions are grouped as categoricals, results carry plain strings (like the duckdb engine's)
+        for col in dimensions:
+            if col in merged_df.columns and isinstance(
+                merged_df[col].dtype, pd.CategoricalDtype
+            ):
+                merged_df[col] = merged_df[col].astype(object)
         if isinstance(location_info, tuple) and len(location_info) == 2:
             merged_df["bucket"] = location_info[0]
             merged_df["object"] = location_info[1]
@@ -793,143 +1117,574 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
         return merged_df
 
     @staticmethod
-    def combine_streaming_results(merged_df, dimensions, timestamp_cols):
-        agg_dict = {}
-        columns_to_add_in = []
-        for col in merged_df.columns:
-            if col not in dimensions and col not in timestamp_cols:
-                if col.startswith(TOTAL_GROUP_COUNT_COL):
-                    agg_dict[col] = "sum"
-                elif (
-                    col.startswith("count|")
-                    or col.startswith("sum|")
-                    or col.startswith("null_count|")
-                ):
-                    agg_dict[col] = "sum"
-                elif col.startswith("mean|"):
-                    columns_to_add_in.append(col)
-                elif col.startswith("max|"):
-                    agg_dict[col] = "max"
-                elif col.startswith("min|"):
-                    agg_dict[col] = "min"
+    def get_timestamp_source_columns(timestamp_mappings):
+        """
+        Columns of the payload that timestamps are read from, including the columns referenced
+        in {col} templates
+        :param timestamp_mappings:
+        :return:
+        """
+        source_columns = []
+        for key in timestamp_mappings:
+            column = timestamp_mappings[key]["column"]
+            columns_and_separators = re.findall(r"(\{[^}]+\})([^{]*)", column)
+            if columns_and_separators:
+                source_columns.extend(
+                    [col.strip("{}") for col, _ in columns_and_separators]
+                )
+            else:
+                source_columns.append(column)
+        return source_columns
 
-        for col in timestamp_cols:
-            if col.startswith("max"):
-                agg_dict[col] = ["max"]
-            elif col.startswith("min"):
-                agg_dict[col] = ["min"]
+    @staticmethod
+    def get_source_columns(
+        dimensions, string_columns, numeric_columns, timestamp_mappings, filters=None
+    ):
+        """
+        Payload columns a dataset config can reference: columns, dimensions (the geometry columns of wkb
+        dimensions), the columns nested paths start from (e.g. object/list dimensions), timestamp sources including {col} templates,
+        filter columns and the timestamp names themselves (a payload column named after a timestamp is used
+        by its template). Columns are read from the payload only when they are in this set.
+        :return: set of column names, without object./partition. prefixes
+        """
+        source_columns = set()
+        for col in list(string_columns) + list(numeric_columns):
+            source_columns.add(col.removeprefix(OBJECT_PREFIX).removeprefix(META_PREFIX))
+        for dim in dimensions:
+            if dim not in RESERVED_DIMENSIONS:
+                source_columns.add(dim.removeprefix(OBJECT_PREFIX).removeprefix(META_PREFIX))
+        if isinstance(dimensions, dict):
+            for dim in dimensions.get("scalar", []):
+                source_columns.add(dim.removeprefix(OBJECT_PREFIX).removeprefix(META_PREFIX))
+            for dim in dimensions.get("wkb", []):
+                source_columns.update(dim.keys() if isinstance(dim, dict) else [dim])
+        # Nested paths (including object and list dimensions) are read through the column they start from,
+        # columns already extracted from an arrow table are kept
+        for name, path in EventPayloadQueryBuilder.get_nested_paths(
+            dimensions, string_columns, numeric_columns
+        )[0].items():
+            source_columns.update([name, parse_path(path)[0]])
+        source_columns.update(
+            EventPayloadQueryBuilder.get_timestamp_source_columns(timestamp_mappings)
+        )
+        source_columns.update(timestamp_mappings.keys())
+        for predicate in EventPayloadQueryBuilder.iter_filter_predicates(filters):
+            source_columns.add(predicate[0])
+        return source_columns
+
+    @staticmethod
+    def iter_filter_predicates(filters):
+        """
+        (column, op, value) predicates of filters in pyarrow's disjunctive normal form
+        (a list of predicates, or a list of lists of predicates)
+        """
+        for item in filters or []:
+            if item and isinstance(item[0], (list, tuple)):
+                yield from item
             else:
-                agg_dict[col] = ["max"]
-
-        grouped = merged_df.groupby(dimensions, dropna=False)
-        grouped = grouped.agg(agg_dict).reset_index()
-        grouped.columns = [col[0] for col in grouped.columns]
-        for col in columns_to_add_in:
-            if col.startswith("mean|"):
-                grouped[col] = (
-                    grouped[f"sum|{col.removeprefix('mean|')}"]
-                    / grouped[f"count|{col.removeprefix('mean|')}"]
-                )
-        return grouped
+                yield item
 
-    def run_streaming(
-        self,
+    @staticmethod
+    def select_source_columns(chunk, source_columns):
+        """
+        Drop the columns the dataset config doesn't reference from a dataframe or arrow table
+        (for the readers that can't skip them while reading)
+        """
+        if isinstance(chunk, pa.Table):
+            return chunk.select(
+                [col for col in chunk.column_names if col in source_columns]
+            )
+        return chunk[[col for col in chunk.columns if col in source_columns]]
+
+    @staticmethod
+    def get_csv_columns(sample_df, source_columns):
+        """
+        Columns of a csv payload to read: the columns of its sampled header that the dataset config references
+        :param sample_df: parsed first rows of the payload (see ExecutionPlan.sample_df)
+        :param source_columns: see get_source_columns
+        :return: column names, None to read every column (the payload wasn't sampled, or none of its columns
+        are referenced and only its rows are counted)
+        """
+        if sample_df is None:
+            return None
+        return [col for col in sample_df.columns if col in source_columns] or None
+
+    @staticmethod
+    def get_schema_and_chunks(chunks, partition_fields_in_data):
+        """
+        Infer the payload schema from the first chunk, which is handed back with the rest of the chunks so
+        that it is aggregated rather than read a second time
+        :return: schema (None when there are no chunks) and the chunks
+        """
+        chunks = iter(chunks)
+        first_chunk = next(chunks, None)
+        if first_chunk is None:
+            return None, chunks
+        if isinstance(first_chunk, pa.Table):
+            first_chunk = first_chunk.to_pandas()
+        clean_schema = get_payload_schema(first_chunk, partition_fields_in_data)
+        return clean_schema, itertools.chain([first_chunk], chunks)
+
+    @staticmethod
+    def warn_unsupported_filters(file_type, filters):
+        if filters and file_type != SupportedPayloadFormat.PARQUET:
+            logging.warning(
+                f"Row filters are only applied to parquet payloads, ignoring them for {file_type.value}"
+            )
+
+    @staticmethod
+    def get_parquet_tables(fsspec_name, source_columns=None, filters=None, chunked=True):
+        """
+        Read a parquet payload, one table per row group when chunked. Only the source columns are read and
+        row groups whose column statistics can't match the filters are skipped without being read.
+        :param fsspec_name:
+        :param source_columns: columns to read (see get_source_columns) or None to read all columns
+        :param filters: row filters in pyarrow's disjunctive normal form
+        :param chunked:
+        :return:
+        """
+        filesystem, path = fsspec.core.url_to_fs(fsspec_name)
+        fragment = next(
+            ds.dataset(path, format="parquet", filesystem=filesystem).get_fragments()
+        )
+        columns = None
+        if source_columns is not None:
+            columns = [
+                col for col in fragment.physical_schema.names if col in source_columns
+            ]
+        expression = pq.filters_to_expression(filters) if filters else None
+        if not chunked:
+            yield fragment.to_table(columns=columns, filter=expression)
+            return
+        row_groups = fragment.split_by_row_group(expression)
+        skipped_row_groups = fragment.metadata.num_row_groups - len(row_groups)
+        if skipped_row_groups:
+            logging.info(
+                f"Skipping {skipped_row_groups} of {fragment.metadata.num_row_groups} row groups using statistics"
+            )
+        for row_group in row_groups:
+            yield row_group.to_table(columns=columns, filter=expression)
+
+    @staticmethod
+    def iter_arrow_tables(batches, chunksize=None):
+        """
+        Group record batches into tables of at least chunksize rows (or a single table without chunksize)
+        """
+        buffered_batches = []
+        buffered_rows = 0
+        for batch in batches:
+            buffered_batches.append(batch)
+            buffered_rows += batch.num_rows
+            if chunksize and buffered_rows >= chunksize:
+                yield pa.Table.from_batches(buffered_batches)
+                buffered_batches = []
+                buffered_rows = 0
+        if buffered_batches:
+            yield pa.Table.from_batches(buffered_batches)
+
+    @staticmethod
+    def iter_line_blocks(f, block_bytes):
+        """
+        Read a binary stream in blocks of about block_bytes that end at a line boundary
+        """
+        remainder = b""
+        while True:
+            data = f.read(block_bytes)
+            if not data:
+                break
+            data = remainder + data
+            end = data.rfind(b"\n") + 1
+            if not end:
+                remainder = data
+                continue
+            remainder = data[end:]
+            yield data[:end]
+        if remainder.strip():
+            yield remainder
+
+    @staticmethod
+    def get_arrow_chunks(
         fsspec_name,
-        partition_fields_in_data,
         file_type,
-        string_columns,
-        numeric_columns,
-        timestamp_mappings,
-        dimensions,
-        source_id,
-        dataset_name,
-        location_info,
-        execution_time,
+        chunksize=None,
+        string_columns=None,
+        source_columns=None,
+        filters=None,
+        compression=None,
+        csv_columns=None,
     ):
-        chunksize = STREAMING_CHUNKSIZE
-        pq_file_handler = None
-        chunks = None
-        if file_type == SupportedPayloadFormat.JSONL:
-            chunks = pd.read_json(fsspec_name, lines=True, chunksize=chunksize)
-            logging.info(f"Chunked Data into {chunksize} chunks")
-        elif file_type == SupportedPayloadFormat.JSON:
-            chunks = pd.read_json(fsspec_name, chunksize=chunksize)
-            logging.info(f"Chunked Data into {chunksize} chunks")
-        elif file_type == SupportedPayloadFormat.PARQUET:
-            pq_file_handler = fsspec.open(fsspec_name).open()
-            parquet_file = pq.ParquetFile(pq_file_handler)
-            chunks = (
-                parquet_file.read_row_group(i)
-                for i in range(parquet_file.num_row_groups)
+        """
+        Arrow engine reader. Returns a generator of pyarrow Tables or None when the format has no
+        native arrow reader (in which case the pandas readers are used).
+        :param fsspec_name:
+        :param file_type:
+        :param chunksize: rows per table, or None to read the payload as a single table
+        :param string_columns: columns to keep as strings rather than letting arrow infer dates/timestamps
+        (timestamp sources are parsed with their configured format later on)
+        :param source_columns: parquet columns to read, None reads all columns
+        :param filters: parquet row filters
+        :param compression: compression of csv and jsonl payloads (see open_payload)
+        :param csv_columns: csv columns to read (see get_csv_columns), None reads all columns
+        :return:
+        """
+        string_columns = string_columns or []
+        if file_type == SupportedPayloadFormat.PARQUET:
+            return EventPayloadQueryBuilder.get_parquet_tables(
+                fsspec_name, source_columns, filters, chunked=bool(chunksize)
             )
-            logging.info(f"Chunked Data into {parquet_file.num_row_groups} chunks")
         elif file_type == SupportedPayloadFormat.CSV:
-            chunks = pd.read_csv(fsspec_name, on_bad_lines="skip", chunksize=chunksize)
-            logging.info(f"Chunked Data into {chunksize} chunks")
-        elif file_type == SupportedPayloadFormat.AVRO:
-            chunks = get_df_iterator_from_avro(fsspec_name, chunksize)
-            logging.info(f"Chunked Data into {chunksize} chunks")
-        merged_df = None
-        primary_timestamp_column = None
-        timestamp_cols = None
-        total_record_count = 0
-        filtered_dimensions = None
-        chunk_results = []
 
-        if chunks is not None:
-            for chunk in chunks:
-                if file_type == SupportedPayloadFormat.PARQUET:
-                    chunk = chunk.to_pandas()
-                (
-                    chunked_df,
-                    chunk_record_count,
-                    primary_timestamp_column,
-                    timestamp_cols,
-                    filtered_dimensions,
-                    final_dimensions,
-                ) = self.handle_calculation(
-                    chunk,
-                    partition_fields_in_data,
-                    dimensions,
-                    string_columns,
-                    numeric_columns,
-                    timestamp_mappings,
-                    source_id,
-                    dataset_name,
-                    execution_time
+            def csv_tables():
+                parse_options = pa_csv.ParseOptions(
+                    invalid_row_handler=lambda row: "skip"
+                )
+                # Empty strings are read as nulls, matching pd.read_csv
+                convert_options = pa_csv.ConvertOptions(
+                    column_types={col: pa.string() for col in string_columns},
+                    strings_can_be_null=True,
+                    include_columns=csv_columns,
                 )
-                total_record_count += chunk_record_count
+                with open_payload(fsspec_name, compression) as f:
+                    if chunksize:
+                        reader = pa_csv.open_csv(
+                            f,
+                            parse_options=parse_options,
+                            convert_options=convert_options,
+                        )
+                        yield from EventPayloadQueryBuilder.iter_arrow_tables(
+                            reader, chunksize
+                        )
+                    else:
+                        yield pa_csv.read_csv(
+                            f,
+                            parse_options=parse_options,
+                            convert_options=convert_options,
+                        )
 
-                if chunked_df is not None:
-                    # chunked_df = chunked_df.where(pd.notnull(chunked_df), None)
-                    chunk_results.append(chunked_df)
+            return csv_tables()
+        elif file_type == SupportedPayloadFormat.JSONL:
 
-            if pq_file_handler is not None:
-                pq_file_handler.close()
-            if chunk_results:
-                merged_df = pd.concat(chunk_results)
-            if merged_df is not None:
-                merged_df = self.combine_streaming_results(
-                    merged_df, final_dimensions, timestamp_cols
+            def jsonl_tables():
+                parse_options = pa_json.ParseOptions(
+                    explicit_schema=pa.schema(
+                        [(col, pa.string()) for col in set(string_columns)]
+                    ),
+                    unexpected_field_behavior="infer",
                 )
-                merged_df = self.add_metadata_to_results(
-                    merged_df,
-                    final_dimensions,
+                with open_payload(fsspec_name, compression) as f:
+                    if chunksize:
+                        # Blocks of complete lines are parsed one at a time. Column types are inferred per
+                        # block, so the tables of different blocks aren't concatenated
+                        blocks = EventPayloadQueryBuilder.iter_line_blocks(
+                            f, STREAMING_JSON_BLOCK_BYTES
+                        )
+                    else:
+                        blocks = [f]
+                    for block in blocks:
+                        table = pa_json.read_json(
+                            BytesIO(block) if isinstance(block, bytes) else block,
+                            read_options=pa_json.ReadOptions(
+                                block_size=STREAMING_JSON_PARSE_BLOCK_BYTES
+                            ),
+                            parse_options=parse_options,
+                        )
+                        # The explicit schema adds timestamp sources missing from the payload as null columns
+                        for col in set(string_columns):
+                            if table.column(col).null_count == table.num_rows:
+                                table = table.drop_columns([col])
+                        if chunksize:
+                            yield from EventPayloadQueryBuilder.iter_arrow_tables(
+                                table.to_batches(max_chunksize=chunksize), chunksize
+                            )
+                        else:
+                            yield table
+
+            return jsonl_tables()
+        elif file_type == SupportedPayloadFormat.AVRO:
+            return EventPayloadQueryBuilder.iter_arrow_tables(
+                get_avro_record_batches(fsspec_name, source_columns, chunksize),
+                chunksize,
+            )
+        return None
+
+    def calculate_chunk(self, chunk, *calculation_args):
+        """
+        handle_calculation of a single streamed chunk, with the partial aggregate columns needed to merge it
+        :param chunk: dataframe or arrow table
+        :param calculation_args: handle_calculation arguments following the dataframe
+        :return:
+        """
+        if isinstance(chunk, pa.Table):
+            chunk = self.to_pandas_with_nested_fields(chunk, *calculation_args[1:4])
+        output = self.handle_calculation(chunk, *calculation_args)
+        if output[0] is not None:
+            output = (add_partial_state_columns(output[0]),) + output[1:]
+        return output
+
+    def calculate_chunks_in_parallel(
+        self, chunks, calculation_args, workers, max_in_flight_chunks
+    ):
+        """
+        Run calculate_chunk over a pool of worker processes. At most max_in_flight_chunks chunks are read ahead
+        of the workers so memory stays bounded by the in flight chunks, not the size of the object.
+        Outputs are yielded as they complete.
+        """
+        max_in_flight_chunks = max(max_in_flight_chunks, workers)
+        logging.info(
+            f"Processing chunks with {workers} workers, {max_in_flight_chunks} chunks in flight"
+        )
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            in_flight = set()
+            for chunk in chunks:
+                if len(in_flight) >= max_in_flight_chunks:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                in_flight.add(
+                    executor.submit(self.calculate_chunk, chunk, *calculation_args)
+                )
+            for future in as_completed(in_flight):
+                yield future.result()
+
+    @staticmethod
+    def iter_text_chunks(fsspec_name, compression, read_chunks):
+        """
+        Chunks of a json or csv payload parsed from its decompressed stream
+        :param fsspec_name:
+        :param compression: see open_payload
+        :param read_chunks: callable turning the text stream into a chunked pandas reader
+        :return:
+        """
+        with open_payload(fsspec_name, compression, text=True) as f:
+            with read_chunks(f) as reader:
+                yield from reader
+
+    @staticmethod
+    def get_pandas_chunks(
+        fsspec_name,
+        file_type,
+        chunksize,
+        source_columns,
+        filters=None,
+        compression=None,
+        csv_columns=None,
+    ):
+        """
+        Sequential chunked readers used by run_streaming
+        :param source_columns: parquet and avro columns to read
+        :param csv_columns: csv columns to read (see get_csv_columns), None reads all columns
+        """
+        chunks = None
+        if file_type == SupportedPayloadFormat.JSONL:
+            chunks = EventPayloadQueryBuilder.iter_text_chunks(
+                fsspec_name,
+                compression,
+                lambda f: pd.read_json(f, lines=True, chunksize=chunksize),
+            )
+            logging.info(f"Chunked Data into {chunksize} chunks")
+        elif file_type == SupportedPayloadFormat.JSON:
+            chunks = EventPayloadQueryBuilder.iter_text_chunks(
+                fsspec_name, compression, lambda f: pd.read_json(f, chunksize=chunksize)
+            )
+            logging.info(f"Chunked Data into {chunksize} chunks")
+        elif file_type == SupportedPayloadFormat.PARQUET:
+            chunks = EventPayloadQueryBuilder.get_parquet_tables(
+                fsspec_name, source_columns, filters
+            )
+            logging.info("Chunked Data into row groups")
+        elif file_type == SupportedPayloadFormat.CSV:
+            chunks = EventPayloadQueryBuilder.iter_text_chunks(
+                fsspec_name,
+                compression,
+                lambda f: pd.read_csv(
+                    f, on_bad_lines="skip", chunksize=chunksize, usecols=csv_columns
+                ),
+            )
+            logging.info(f"Chunked Data into {chunksize} chunks")
+        elif file_type == SupportedPayloadFormat.AVRO:
+            chunks = EventPayloadQueryBuilder.iter_arrow_tables(
+                get_avro_record_batches(fsspec_name, source_columns, chunksize),
+                chunksize,
+            )
+            logging.info(f"Chunked Data into arrow tables of {chunksize} rows")
+        return chunks
+
+    @staticmethod
+    def get_byte_range_chunks(
+        fsspec_name, file_type, range_readers, compression=None, csv_columns=None
+    ):
+        """
+        Parallel reader for newline delimited payloads: the object is split into newline aligned byte ranges
+        that are fetched and parsed by range_readers threads, each range becomes a chunk.
+        Returns None for other formats and for compressed objects (which can't be split).
+        """
+        if resolve_compression(fsspec_name, compression) != CompressionType.NONE:
+            return None
+        if file_type == SupportedPayloadFormat.JSONL:
+            chunks = get_df_iterator_from_byte_ranges(
+                fsspec_name,
+                lambda f: pd.read_json(f, lines=True),
+                STREAMING_RANGE_BYTES,
+                range_readers,
+            )
+        elif file_type == SupportedPayloadFormat.CSV:
+            chunks = get_df_iterator_from_byte_ranges(
+                fsspec_name,
+                lambda f: pd.read_csv(f, on_bad_lines="skip", usecols=csv_columns),
+                STREAMING_RANGE_BYTES,
+                range_readers,
+                repeat_header=True,
+            )
+        else:
+            return None
+        if chunks is not None:
+            logging.info(
+                f"Reading Data in {STREAMING_RANGE_BYTES} byte ranges with {range_readers} readers"
+            )
+        return chunks
+
+    def run_streaming(
+        self,
+        fsspec_name,
+        partition_fields_in_data,
+        file_type,
+        string_columns,
+        numeric_columns,
+        timestamp_mappings,
+        dimensions,
+        source_id,
+        dataset_name,
+        location_info,
+        execution_time,
+        engine=ExecutionEngine.PANDAS,
+        workers=STREAMING_WORKERS,
+        max_in_flight_chunks=STREAMING_MAX_IN_FLIGHT_CHUNKS,
+        filters=None,
+        range_readers=STREAMING_RANGE_READERS,
+        clean_schema=None,
+        plan: ExecutionPlan = None,
+        compression=None,
+        partial=False,
+        csv_columns=None,
+    ):
+        """
+        :param plan: execution plan sizing the chunks, by default chunks of STREAMING_CHUNKSIZE rows
+        (or STREAMING_MAX_CHUNKSIZE when it isn't set)
+        :param compression: detected compression of the payload, None to infer it from the extension
+        :param partial: see get_run_output
+        :param csv_columns: csv columns to read (see get_csv_columns), None reads all columns
+        """
+        plan = plan or ExecutionPlan(engine=engine)
+        chunksize = plan.chunksize
+        chunks = None
+        source_columns = self.get_source_columns(
+            dimensions, string_columns, numeric_columns, timestamp_mappings, filters
+        )
+        self.warn_unsupported_filters(file_type, filters)
+        if engine == ExecutionEngine.ARROW:
+            chunks = self.get_arrow_chunks(
+                fsspec_name,
+                file_type,
+                chunksize,
+                self.get_timestamp_source_columns(timestamp_mappings),
+                source_columns,
+                filters,
+                compression,
+                csv_columns,
+            )
+            if chunks is not None:
+                logging.info(f"Reading Data into arrow tables of {chunksize} rows")
+        if chunks is None and range_readers > 1:
+            chunks = self.get_byte_range_chunks(
+                fsspec_name, file_type, range_readers, compression, csv_columns
+            )
+        if chunks is None:
+            chunks = self.get_pandas_chunks(
+                fsspec_name,
+                file_type,
+                chunksize,
+                source_columns,
+                filters,
+                compression,
+                csv_columns,
+            )
+        if chunks is not None:
+            if clean_schema is None:
+                clean_schema, chunks = self.get_schema_and_chunks(
+                    chunks, partition_fields_in_data
+                )
+            chunks = rechunk(
+                (self.select_source_columns(chunk, source_columns) for chunk in chunks),
+                plan,
+            )
+        merged_df = None
+        primary_timestamp_column = None
+        timestamp_cols = None
+        total_record_count = 0
+        filtered_dimensions = None
+        fold = None
+
+        if chunks is not None:
+            calculation_args = (
+                partition_fields_in_data,
+                dimensions,
+                string_columns,
+                numeric_columns,
+                timestamp_mappings,
+                source_id,
+                dataset_name,
+                execution_time,
+                engine,
+            )
+            if workers > 1:
+                chunk_outputs = self.calculate_chunks_in_parallel(
+                    chunks, calculation_args, workers, max_in_flight_chunks
+                )
+            else:
+                chunk_outputs = (
+                    self.calculate_chunk(chunk, *calculation_args) for chunk in chunks
+                )
+            # Chunk results are folded into a running aggregate as they complete (std is recombined exactly
+            # from the chunks' m2| columns), groups beyond the fold's memory limit are spilled to disk
+            try:
+                for (
+                    chunked_df,
+                    chunk_record_count,
                     primary_timestamp_column,
                     timestamp_cols,
-                    total_record_count,
+                    filtered_dimensions,
+                    final_dimensions,
+                ) in chunk_outputs:
+                    total_record_count += chunk_record_count
+
+                    if chunked_df is not None:
+                        if fold is None:
+                            fold = PartialStateFold(final_dimensions, timestamp_cols)
+                        fold.add(chunked_df)
+
+                if fold is not None:
+                    merged_df = fold.result()
+            finally:
+                if fold is not None:
+                    fold.close()
+            if merged_df is not None:
+                return self.get_run_output(
+                    (
+                        merged_df,
+                        total_record_count,
+                        primary_timestamp_column,
+                        timestamp_cols,
+                        filtered_dimensions,
+                        final_dimensions,
+                    ),
                     execution_time,
                     location_info,
+                    clean_schema,
+                    partial,
                 )
-                return (
-                    merged_df,
-                    execution_time,
-                    f"primary_time|{primary_timestamp_column}",
-                    filtered_dimensions,
-                )
-        if pq_file_handler is not None:
-            pq_file_handler.close()
-        return None, execution_time, None, None
+        return self.get_run_output(
+            None, execution_time, location_info, clean_schema, partial
+        )
 
     def run_batch(
         self,
@@ -944,27 +1699,78 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
         dataset_name,
         location_info,
         execution_time,
+        engine=ExecutionEngine.PANDAS,
+        filters=None,
+        clean_schema=None,
+        compression=None,
+        partial=False,
+        csv_columns=None,
     ):
+        """
+        :param partial: see get_run_output
+        :param csv_columns: csv columns to read (see get_csv_columns), None reads all columns
+        """
         df = None
-        if file_type == SupportedPayloadFormat.JSONL:
-            df = pd.read_json(fsspec_name, lines=True)
+        tables = None
+        source_columns = self.get_source_columns(
+            dimensions, string_columns, numeric_columns, timestamp_mappings, filters
+        )
+        self.warn_unsupported_filters(file_type, filters)
+        if engine == ExecutionEngine.ARROW:
+            tables = self.get_arrow_chunks(
+                fsspec_name,
+                file_type,
+                string_columns=self.get_timestamp_source_columns(timestamp_mappings),
+                source_columns=source_columns,
+                filters=filters,
+                compression=compression,
+                csv_columns=csv_columns,
+            )
+        if tables is not None:
+            table = next(tables, None)
+            df = (
+                self.to_pandas_with_nested_fields(
+                    table, dimensions, string_columns, numeric_columns
+                )
+                if table is not None
+                else None
+            )
+        elif file_type == SupportedPayloadFormat.JSONL:
+            with open_payload(fsspec_name, compression, text=True) as f:
+                df = pd.read_json(f, lines=True)
         elif file_type == SupportedPayloadFormat.JSON:
-            df = pd.read_json(fsspec_name)
+            with open_payload(fsspec_name, compression, text=True) as f:
+                df = pd.read_json(f)
         elif file_type == SupportedPayloadFormat.PARQUET:
-            df = pd.read_parquet(fsspec_name)
+            df = self.to_pandas_with_nested_fields(
+                next(
+                    self.get_parquet_tables(
+                        fsspec_name, source_columns, filters, chunked=False
+                    )
+                ),
+                dimensions,
+                string_columns,
+                numeric_columns,
+            )
         elif file_type == SupportedPayloadFormat.CSV:
-            df = pd.read_csv(fsspec_name, on_bad_lines="skip")
+            with open_payload(fsspec_name, compression, text=True) as f:
+                df = pd.read_csv(f, on_bad_lines="skip", usecols=csv_columns)
         elif file_type == SupportedPayloadFormat.AVRO:
-            df = next(get_df_iterator_from_avro(fsspec_name), None)
+            table = next(
+                self.iter_arrow_tables(
+                    get_avro_record_batches(fsspec_name, source_columns)
+                ),
+                None,
+            )
+            if table is not None:
+                df = self.to_pandas_with_nested_fields(
+                    table, dimensions, string_columns, numeric_columns
+                )
         if df is not None:
-            (
-                merged_df,
-                total_record_count,
-                primary_timestamp_column,
-                timestamp_cols,
-                filtered_dimensions,
-                final_dimensions,
-            ) = self.handle_calculation(
+            if clean_schema is None:
+                clean_schema = get_payload_schema(df, partition_fields_in_data)
+            df = self.select_source_columns(df, source_columns)
+            output = self.handle_calculation(
                 df,
                 partition_fields_in_data,
                 dimensions,
@@ -973,26 +1779,471 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
                 timestamp_mappings,
                 source_id,
                 dataset_name,
-                execution_time
+                execution_time,
+                engine,
             )
-            if merged_df is not None:
-                merged_df = self.add_metadata_to_results(
-                    merged_df,
-                    final_dimensions,
-                    primary_timestamp_column,
-                    timestamp_cols,
-                    total_record_count,
-                    execution_time,
-                    location_info,
+            if output[0] is not None:
+                output = (add_partial_state_columns(output[0]),) + output[1:]
+            return self.get_run_output(
+                output, execution_time, location_info, clean_schema, partial
+            )
+        else:
+            return self.get_run_output(
+                None, execution_time, location_info, clean_schema, partial
+            )
+
+    @staticmethod
+    def build_duckdb_timestamp_expressions(
+        payload_columns, column_types, timestamp_mappings, execution_time
+    ):
+        """
+        SQL counterpart of set_df_timestamp_vars.
+        :param payload_columns: column name -> sql expression of the (renamed, partition-enriched) payload
+        :param column_types: duckdb types of the raw payload columns
+        :param timestamp_mappings:
+        :param execution_time:
+        :return: (timestamp column -> expression, primary timestamp column, freshness dimension -> expression)
+        """
+        timestamp_expressions = {LARIAT_EXECUTION_TIME_COL: str(int(execution_time))}
+        primary_timestamp_column = None
+        parsed_timestamps = {}
+        freshness_cols = []
+        for key in timestamp_mappings:
+            column = timestamp_mappings[key]["column"]
+            format_str = timestamp_mappings[key]["format"]
+            tz_name = timestamp_mappings[key].get("timezone", "")
+            is_primary = timestamp_mappings[key].get("primary", False)
+            columns_and_separators = re.findall(r"(\{[^}]+\})([^{]*)", column)
+            if columns_and_separators:
+                col_list = [col[0].strip("{}") for col in columns_and_separators]
+                if EventPayloadQueryBuilder.get_filtered_columns(
+                    payload_columns, col_list
+                ) != col_list:
+                    logging.warning(
+                        f"One of the chosen timestamp fields isn't in the data. Couldn't create {key}"
+                    )
+                    continue
+                parts = [f"CAST({payload_columns[key]} AS VARCHAR)"] if key in payload_columns else []
+                for col, sep in columns_and_separators:
+                    parts.append(f"CAST({payload_columns[col.strip('{}')]} AS VARCHAR)")
+                    parts.append(quote_literal(sep))
+                raw_expression = f"({' || '.join(parts)})"
+                raw_type = "VARCHAR"
+            else:
+                if not EventPayloadQueryBuilder.get_filtered_columns(
+                    payload_columns, [column]
+                ):
+                    logging.warning(
+                        f"One of the chosen timestamp fields isn't in the data. Couldn't create {key}"
+                    )
+                    continue
+                raw_expression = payload_columns[column]
+                raw_type = column_types.get(column, "VARCHAR")
+            if is_primary:
+                if primary_timestamp_column is None:
+                    primary_timestamp_column = f"{PREFIX_FOR_PRIMARY}{key}"
+                else:
+                    logging.warning(
+                        f"Multiple primary timestamps defined. Staying with the first option: "
+                        f"{primary_timestamp_column.removeprefix(PREFIX_FOR_PRIMARY)}"
+                    )
+            if timestamp_mappings[key].get("freshness", False):
+                freshness_cols.append(key)
+
+            if format_str != "unixtime":
+                if raw_type in DUCKDB_TEMPORAL_TYPES:
+                    parsed, is_tz_aware = f"CAST({raw_expression} AS TIMESTAMP)", False
+                elif raw_type in DUCKDB_TEMPORAL_TZ_TYPES:
+                    parsed, is_tz_aware = raw_expression, True
+                else:
+                    parsed = f"strptime(TRIM(CAST({raw_expression} AS VARCHAR)), {quote_literal(format_str)})"
+                    is_tz_aware = "%z" in format_str or "%Z" in format_str
+                zone = "UTC"
+                if tz_name:
+                    try:
+                        pytz.timezone(tz_name)
+                        zone = tz_name
+                    except pytz.UnknownTimeZoneError:
+                        logging.warning("Couldn't find timezone, keeping UTC")
+                # Wall clock time in the configured zone, precision is adjusted on wall clock time like in pandas
+                local = f"timezone({quote_literal(zone)}, {parsed})" if is_tz_aware else parsed
+                for prefix, max_or_min in [
+                    (TIME_MAX_PREFIX, "max"),
+                    (TIME_MIN_PREFIX, "min"),
+                ]:
+                    adjusted, unit = adjust_sql_date_precision(
+                        local, format_str, max_or_min
+                    )
+                    if unit in ("month", "year"):
+                        # The pandas engine drops the timezone when truncating to months/years
+                        epoch = f"epoch({adjusted})"
+                    else:
+                        epoch = f"epoch(timezone({quote_literal(zone)}, {adjusted}))"
+                    timestamp_expressions[f"{prefix}{key}"] = f"CAST(floor({epoch}) AS BIGINT)"
+                parsed_timestamps[key] = (
+                    f"CAST(floor(epoch(timezone({quote_literal(zone)}, {local}))) AS BIGINT)"
+                )
+            else:
+                if tz_name:
+                    logging.warning(
+                        f"Time is already in unix time. The timezone configuration {tz_name} is ignored."
+                    )
+                unixtime = f"CAST(trunc(CAST({raw_expression} AS DOUBLE)) AS BIGINT)"
+                timestamp_expressions[f"{TIME_MAX_PREFIX}{key}"] = unixtime
+                timestamp_expressions[f"{TIME_MIN_PREFIX}{key}"] = unixtime
+                # calculate_freshness scales every non execution time column from nanoseconds
+                parsed_timestamps[key] = f"CAST(floor({unixtime} * 1e9) AS BIGINT)"
+
+        if primary_timestamp_column is None:
+            primary_timestamp_column = LARIAT_EXECUTION_TIME_COL
+        freshness_expressions = {}
+        for col in freshness_cols:
+            minutes = (
+                f"(({timestamp_expressions[primary_timestamp_column]}) - ({parsed_timestamps[col]})) / 60"
+            )
+            edges, labels = EventPayloadQueryBuilder.get_freshness_buckets(
+                timestamp_mappings[col]
+            )
+            freshness_expressions[f"{col}_freshness"] = get_freshness_case(
+                minutes, edges, labels
+            )
+        return timestamp_expressions, primary_timestamp_column, freshness_expressions
+
+    @staticmethod
+    def build_duckdb_aggregation_query(
+        source,
+        column_types,
+        partition_fields_in_data,
+        dimensions,
+        string_columns,
+        numeric_columns,
+        timestamp_mappings,
+        source_id,
+        dataset_name,
+        execution_time,
+    ):
+        """
+        Express handle_calculation for a whole payload as a single duckdb aggregation query.
+        Raises UnsupportedDuckDBQueryError for configurations that need the pandas engine (list and wkb dimensions)
+        :return: (query or None, string_columns, numeric_columns, timestamp_cols, primary_timestamp_column,
+        filtered_dimensions, dimensions)
+        """
+        payload_columns = {col: quote_identifier(col) for col in column_types}
+        new_dimensions = [dim for dim in dimensions if dim not in RESERVED_DIMENSIONS]
+        if isinstance(dimensions, dict):
+            if "list" in dimensions or "wkb" in dimensions:
+                raise UnsupportedDuckDBQueryError(
+                    "list and wkb dimensions aren't supported by the duckdb engine"
+                )
+            for dim in dimensions.get("scalar", []):
+                new_dimensions.append(dim)
+            for dim in dimensions.get("object", []):
+                parent, child = dim.split(".")
+                if not column_types.get(parent, "").startswith("STRUCT"):
+                    raise UnsupportedDuckDBQueryError(
+                        f"object dimension {dim} requires {parent} to be a struct"
+                    )
+                payload_columns[dim] = f"{quote_identifier(parent)}.{quote_identifier(child)}"
+                new_dimensions.append(dim)
+
+        for name in list(string_columns) + list(numeric_columns) + new_dimensions:
+            name = name.removeprefix(OBJECT_PREFIX)
+            if name not in payload_columns and get_nested_path_root(name, column_types):
+                raise UnsupportedDuckDBQueryError(
+                    f"nested path {name} isn't supported by the duckdb engine"
+                )
+        object_keys = list(column_types)
+        partition_keys = (
+            list(partition_fields_in_data.keys()) if partition_fields_in_data else []
+        )
+        (
+            dimensions,
+            keys_to_keep_in_objects,
+            dim_column_transforms,
+        ) = EventPayloadQueryBuilder.resolve_duplicate_columns_from_columns_list(
+            object_keys, partition_keys, new_dimensions
+        )
+        (
+            string_columns,
+            string_keys_to_keep,
+            str_column_transforms,
+        ) = EventPayloadQueryBuilder.resolve_duplicate_columns_from_columns_list(
+            object_keys, partition_keys, string_columns
+        )
+        (
+            numeric_columns,
+            numeric_keys_to_keep,
+            num_column_transforms,
+        ) = EventPayloadQueryBuilder.resolve_duplicate_columns_from_columns_list(
+            object_keys, partition_keys, numeric_columns
+        )
+        payload_types = dict(column_types)
+        for col in keys_to_keep_in_objects | numeric_keys_to_keep | string_keys_to_keep:
+            original = col.removeprefix(META_PREFIX).removeprefix(OBJECT_PREFIX)
+            if original in payload_columns:
+                payload_columns[col] = payload_columns.pop(original)
+                payload_types[col] = payload_types.pop(original)
+        partition_field_mappings = {
+            **dim_column_transforms,
+            **str_column_transforms,
+            **num_column_transforms,
+        }
+        if partition_fields_in_data:
+            for key, value in partition_fields_in_data.items():
+                payload_columns[partition_field_mappings.get(key, key)] = quote_literal(
+                    value
                 )
+                payload_types[partition_field_mappings.get(key, key)] = "VARCHAR"
+        # Everything past the payload CTE refers to the payload columns by name
+        payload_references = {col: quote_identifier(col) for col in payload_columns}
+
+        (
+            timestamp_expressions,
+            primary_timestamp_column,
+            freshness_expressions,
+        ) = EventPayloadQueryBuilder.build_duckdb_timestamp_expressions(
+            payload_references, payload_types, timestamp_mappings, execution_time
+        )
+        timestamp_cols = list(timestamp_expressions)
+        string_columns = EventPayloadQueryBuilder.get_filtered_columns(
+            payload_columns, string_columns
+        )
+        numeric_columns = EventPayloadQueryBuilder.get_filtered_columns(
+            payload_columns, numeric_columns
+        )
+        filtered_dimensions = EventPayloadQueryBuilder.get_filtered_columns(
+            payload_columns, dimensions
+        )
+        filtered_dimensions.extend(freshness_expressions)
+        dimensions.extend(freshness_expressions)
+        if (not filtered_dimensions and len(dimensions) >= 1) or not (
+            string_columns or numeric_columns
+        ):
             return (
-                merged_df,
-                execution_time,
-                f"primary_time|{primary_timestamp_column}",
+                None,
+                string_columns,
+                numeric_columns,
+                timestamp_cols,
+                primary_timestamp_column,
+                filtered_dimensions,
+                dimensions,
+            )
+
+        def column_expression(col):
+            return null_safe_column(
+                quote_identifier(col), payload_types.get(col, "VARCHAR")
+            )
+
+        hashed_key_tail = EventPayloadQueryBuilder.get_hashed_key_tail(
+            dimensions, source_id, dataset_name
+        )
+        string_aggregations = []
+        for col in string_columns:
+            value = column_expression(col)
+            string_aggregations.append(
+                f"COUNT({value}) AS {quote_identifier(f'count|{col}|{hashed_key_tail}')}"
+            )
+            string_aggregations.append(
+                f"COUNT(*) - COUNT({value}) AS {quote_identifier(f'null_count|{col}|{hashed_key_tail}')}"
+            )
+        numeric_aggregations = []
+        for col in numeric_columns:
+            value = f"TRY_CAST({column_expression(col)} AS DOUBLE)"
+            sql_aggregations = {
+                "count": f"COUNT({value})",
+                "sum": f"COALESCE(SUM({value}), 0)",
+                "max": f"MAX({value})",
+                "min": f"MIN({value})",
+                "mean": f"AVG({value})",
+                "std": f"STDDEV_SAMP({value})",
+                "null_count": f"COUNT(*) - COUNT({value})",
+            }
+            for func_name in NUMERIC_AGGREGATION_NAMES:
+                numeric_aggregations.append(
+                    f"{sql_aggregations[func_name]} AS "
+                    f"{quote_identifier(f'{func_name}|{col}|{hashed_key_tail}')}"
+                )
+        timestamp_aggregations = [
+            f"{'MIN' if col.startswith('min') else 'MAX'}({quote_identifier(col)}) AS {quote_identifier(col)}"
+            for col in timestamp_expressions
+        ]
+        group_count = f"COUNT(*) AS {quote_identifier(TOTAL_GROUP_COUNT_COL)}"
+        # Same column order as merging the string and numeric aggregations of handle_calculation
+        if string_columns:
+            aggregations = (
+                string_aggregations
+                + timestamp_aggregations
+                + [group_count]
+                + numeric_aggregations
+            )
+        else:
+            aggregations = numeric_aggregations + timestamp_aggregations + [group_count]
+        select_list = [
+            quote_identifier(dim) for dim in filtered_dimensions
+        ] + aggregations
+
+        derived_columns = {**timestamp_expressions, **freshness_expressions}
+        payload_select = [
+            f"{expression} AS {quote_identifier(col)}"
+            for col, expression in payload_columns.items()
+        ]
+        # Dimensions are normalized before grouping, as the pandas engine does, so values that are equal once
+        # normalized (e.g. null and '') share a group
+        prepared_select = [
+            f"{normalized_dimension(reference)} AS {quote_identifier(col)}"
+            if col in filtered_dimensions
+            else reference
+            for col, reference in payload_references.items()
+            if col not in derived_columns
+        ] + [
+            f"{expression} AS {quote_identifier(col)}"
+            for col, expression in derived_columns.items()
+        ]
+        query = (
+            f"WITH payload AS (SELECT {', '.join(payload_select)} FROM {source}), "
+            f"prepared AS (SELECT {', '.join(prepared_select)} FROM payload) "
+            f"SELECT {', '.join(select_list)} FROM prepared"
+        )
+        if filtered_dimensions:
+            query += f" GROUP BY {', '.join(quote_identifier(dim) for dim in filtered_dimensions)}"
+        return (
+            query,
+            string_columns,
+            numeric_columns,
+            timestamp_cols,
+            primary_timestamp_column,
+            filtered_dimensions,
+            dimensions,
+        )
+
+    def run_duckdb(
+        self,
+        fsspec_name,
+        partition_fields_in_data,
+        file_type,
+        string_columns,
+        numeric_columns,
+        timestamp_mappings,
+        dimensions,
+        source_id,
+        dataset_name,
+        location_info,
+        execution_time,
+        clean_schema=None,
+        compression=None,
+        partial=False,
+    ):
+        """
+        Run the whole payload aggregation as one duckdb query over the fsspec path. Scan, projection and
+        group by all happen inside duckdb, the payload is never materialized as a dataframe.
+        Returns the same output as run_batch and run_streaming.
+        :param partial: see get_run_output
+        """
+        connection = get_duckdb_connection(fsspec_name)
+        try:
+            source = get_duckdb_source(
+                fsspec_name, file_type, compression=compression
+            )
+            column_types = describe_source(connection, source)
+            if clean_schema is None and file_type in (
+                SupportedPayloadFormat.JSONL,
+                SupportedPayloadFormat.CSV,
+            ):
+                # The reported schema comes from the same parsed sample as with the other engines: duckdb's own
+                # type inference differs (e.g. json integers with nulls stay integers instead of numbers)
+                sample_df = read_text_sample(
+                    fsspec_name,
+                    file_type,
+                    resolve_compression(fsspec_name, compression),
+                )[0]
+                if sample_df is not None:
+                    clean_schema = get_payload_schema(
+                        sample_df, partition_fields_in_data
+                    )
+            if clean_schema is None:
+                # Parquet types are the same for every engine. JSON arrays and unusable samples fall back to
+                # duckdb's inference, which may report a few types differently than pandas would
+                clean_schema = get_payload_schema(
+                    connection.execute(f"SELECT * FROM {source} LIMIT 0").df(),
+                    partition_fields_in_data,
+                )
+            if file_type == SupportedPayloadFormat.CSV:
+                # Keep timestamp sources as text so that they are parsed with the configured format
+                varchar_columns = [
+                    col
+                    for col in self.get_timestamp_source_columns(timestamp_mappings)
+                    if col in column_types
+                ]
+                if varchar_columns:
+                    source = get_duckdb_source(
+                        fsspec_name, file_type, varchar_columns, compression
+                    )
+                    column_types = describe_source(connection, source)
+            (
+                query,
+                string_columns,
+                numeric_columns,
+                timestamp_cols,
+                primary_timestamp_column,
                 filtered_dimensions,
+                final_dimensions,
+            ) = self.build_duckdb_aggregation_query(
+                source,
+                column_types,
+                partition_fields_in_data,
+                dimensions,
+                string_columns,
+                numeric_columns,
+                timestamp_mappings,
+                source_id,
+                dataset_name,
+                execution_time,
+            )
+            merged_df = None
+            if query is not None:
+                logging.info(f"Running duckdb aggregation: {query}")
+                merged_df = connection.execute(query).df()
+        finally:
+            connection.close()
+
+        if merged_df is not None:
+            total_record_count = int(merged_df[TOTAL_GROUP_COUNT_COL].sum())
+            if not filtered_dimensions:
+                merged_df = merged_df.drop(columns=[TOTAL_GROUP_COUNT_COL])
+            # Like the pandas engine, drop numeric columns that have no numeric values at all
+            hashed_key_tail = self.get_hashed_key_tail(
+                final_dimensions, source_id, dataset_name
             )
+            for col in list(numeric_columns):
+                if merged_df[f"count|{col}|{hashed_key_tail}"].sum() == 0:
+                    logging.warning(f"Column '{col}' cannot be converted to numeric type.")
+                    merged_df = merged_df.drop(
+                        columns=[
+                            f"{func_name}|{col}|{hashed_key_tail}"
+                            for func_name in NUMERIC_AGGREGATION_NAMES
+                        ]
+                    )
+                    numeric_columns.remove(col)
+            if not string_columns and not numeric_columns:
+                merged_df = None
         else:
-            return None, execution_time, None, None
+            total_record_count = 0
+        if merged_df is not None:
+            merged_df = add_partial_state_columns(merged_df)
+        return self.get_run_output(
+            (
+                merged_df,
+                total_record_count,
+                primary_timestamp_column,
+                timestamp_cols,
+                filtered_dimensions,
+                final_dimensions,
+            ),
+            execution_time,
+            location_info,
+            clean_schema,
+            partial,
+        )
 
     def run(
         self,
@@ -1008,10 +2259,87 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
         dataset_name,
         location_info,
         content_length,
+        engine=ExecutionEngine.PANDAS,
+        workers=STREAMING_WORKERS,
+        filters=None,
+        compression=None,
+        memory_budget=EVENT_PAYLOAD_MEMORY_BUDGET_BYTES,
+        partial=False,
     ):
+        """
+        Compute the dataset's metrics over the payload. When clean_schema isn't passed it is inferred while
+        reading the payload (parquet footer, avro header or the first chunk read) so that the object is only
+        read once.
+        Batch or streaming execution and the chunk size are chosen by the execution planner from the estimated
+        decoded size of the payload (see plan_execution).
+        :param compression: compression detected when the object was matched to its dataset, None to infer it
+        from the extension
+        :param memory_budget: memory the payload is planned against (see plan_execution)
+        :param partial: return the payload's partial results so they can be merged with other payloads' (see
+        get_run_output and merge_partial_outputs)
+        :return: results, execution time, primary time column, dimensions and the payload schema
+        """
         execution_time = int(datetime.now(timezone.utc).timestamp())
-        should_stream = is_content_too_large(content_length)
-        if not should_stream:
+        if clean_schema is None:
+            clean_schema = get_payload_schema_from_header(
+                fsspec_name, file_type, partition_fields_in_data
+            )
+        if engine == ExecutionEngine.DUCKDB and filters:
+            logging.warning(
+                f"Row filters aren't supported by the duckdb engine, running {dataset_name} with pandas"
+            )
+            engine = ExecutionEngine.PANDAS
+        if engine == ExecutionEngine.DUCKDB:
+            try:
+                return self.run_duckdb(
+                    fsspec_name,
+                    partition_fields_in_data,
+                    file_type,
+                    string_columns,
+                    numeric_columns,
+                    timestamp_mappings,
+                    dimensions,
+                    source_id,
+                    dataset_name,
+                    location_info,
+                    execution_time,
+                    clean_schema,
+                    compression,
+                    partial,
+                )
+            except (UnsupportedDuckDBQueryError, duckdb.Error) as e:
+                logging.warning(
+                    f"Couldn't run {dataset_name} with the duckdb engine, falling back to pandas: {e}"
+                )
+                engine = ExecutionEngine.PANDAS
+        source_columns = self.get_source_columns(
+            dimensions, string_columns, numeric_columns, timestamp_mappings, filters
+        )
+        plan = plan_execution(
+            fsspec_name,
+            file_type,
+            content_length,
+            compression,
+            engine,
+            source_columns,
+            workers,
+            STREAMING_MAX_IN_FLIGHT_CHUNKS,
+            STREAMING_RANGE_READERS,
+            memory_budget,
+        )
+        engine = plan.engine
+        # The planner's sample (read through the payload object's cache) gives the schema of jsonl and csv
+        # payloads, their columns can then be projected while reading. Unsampled payloads are read with all
+        # their columns and their schema comes from the first chunk.
+        csv_columns = None
+        if plan.sample_df is not None:
+            if clean_schema is None:
+                clean_schema = get_payload_schema(
+                    plan.sample_df, partition_fields_in_data
+                )
+            if file_type == SupportedPayloadFormat.CSV:
+                csv_columns = self.get_csv_columns(plan.sample_df, source_columns)
+        if not plan.streaming:
             return self.run_batch(
                 fsspec_name,
                 partition_fields_in_data,
@@ -1024,6 +2352,12 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
                 dataset_name,
                 location_info,
                 execution_time,
+                engine,
+                filters=filters,
+                clean_schema=clean_schema,
+                compression=compression,
+                partial=partial,
+                csv_columns=csv_columns,
             )
         else:
             return self.run_streaming(
@@ -1038,4 +2372,128 @@ class EventPayloadQueryBuilder(StreamingBaseQueryBuilder):
                 dataset_name,
                 location_info,
                 execution_time,
+                engine,
+                workers,
+                filters=filters,
+                clean_schema=clean_schema,
+                plan=plan,
+                compression=compression,
+                partial=partial,
+                csv_columns=csv_columns,
+            )
+
+    def get_run_output(
+        self,
+        calculation_output,
+        execution_time,
+        location_info,
+        clean_schema,
+        partial=False,
+    ):
+        """
+        Output of run from the payload's handle_calculation output
+        :param calculation_output: handle_calculation output with the partial state columns (see
+        add_partial_state_columns), None when no results were computed
+        :param execution_time:
+        :param location_info: bucket and object the results are labelled with
+        :param clean_schema:
+        :param partial: return the calculation output, execution time and schema as they are so that the results
+        can be merged with other payloads' (see merge_partial_outputs)
+        :return:
+        """
+        if partial:
+            return calculation_output, execution_time, clean_schema
+        if calculation_output is None:
+            return None, execution_time, None, None, clean_schema
+        (
+            merged_df,
+            total_record_count,
+            primary_timestamp_column,
+            timestamp_cols,
+            filtered_dimensions,
+            final_dimensions,
+        ) = calculation_output
+        if merged_df is not None:
+            merged_df = self.add_metadata_to_results(
+                finalize_partial_states(merged_df),
+                final_dimensions,
+                primary_timestamp_column,
+                timestamp_cols,
+                total_record_count,
+                execution_time,
+                location_info,
             )
+        return (
+            merged_df,
+            execution_time,
+            f"primary_time|{primary_timestamp_column}",
+            filtered_dimensions,
+            clean_schema,
+        )
+
+    def merge_partial_outputs(
+        self, calculation_outputs, execution_time, location_info, clean_schema
+    ):
+        """
+        Merge the partial outputs of several payloads of a dataset (see run's partial) into one output of run.
+        Groups shared by payloads are merged exactly like streamed chunks are (see PartialStateFold), the total
+        record count is the payloads' total.
+        Payloads whose dimensions or timestamps differ (e.g. a column missing from some files) are merged
+        separately and their results concatenated.
+        :param calculation_outputs: handle_calculation outputs of the payloads, None for payloads without results
+        :param execution_time:
+        :param location_info: bucket and object the results are labelled with
+        :param clean_schema: schema of the payloads
+        :return: results, execution time, primary time column, dimensions and the payload schema
+        """
+        calculation_outputs = [
+            output for output in calculation_outputs if output is not None
+        ]
+        if not calculation_outputs:
+            return None, execution_time, None, None, clean_schema
+        total_record_count = sum(output[1] for output in calculation_outputs)
+        primary_timestamp_column = calculation_outputs[0][2]
+        filtered_dimensions = []
+        shapes = {}
+        for (
+            merged_df,
+            _,
+            _,
+            timestamp_cols,
+            output_filtered_dimensions,
+            final_dimensions,
+        ) in calculation_outputs:
+            for dim in output_filtered_dimensions or []:
+                if dim not in filtered_dimensions:
+                    filtered_dimensions.append(dim)
+            if merged_df is not None:
+                shapes.setdefault(
+                    (tuple(final_dimensions), tuple(timestamp_cols)), []
+                ).append(merged_df)
+        results = []
+        for (final_dimensions, timestamp_cols), frames in shapes.items():
+            fold = PartialStateFold(final_dimensions, timestamp_cols)
+            try:
+                for frame in frames:
+                    fold.add(frame)
+                merged_df = fold.result()
+            finally:
+                fold.close()
+            results.append(
+                self.add_metadata_to_results(
+                    finalize_partial_states(merged_df),
+                    list(final_dimensions),
+                    primary_timestamp_column,
+                    list(timestamp_cols),
+                    total_record_count,
+                    execution_time,
+                    location_info,
+                )
+            )
+        return (
+            pd.concat(results, ignore_index=True) if results else None,
+            execution_time,
+            f"primary_time|{primary_timestamp_column}",
+            filtered_dimensions,
+            clean_schema,
+        )
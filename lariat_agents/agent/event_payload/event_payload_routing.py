@@ -0,0 +1,109 @@
+"""
+    Routing of payload objects to their dataset configs.
+    The agent's yaml config is compiled once into a RoutingIndex: a prefix trie per bucket, a precompiled
+    partition matcher per dataset config and a name -> config map. An object key is routed by walking its
+    bucket's trie once, which yields the configs whose prefix it starts with, and trying their partition
+    matchers in config order. The first config whose prefix and suffix template match wins, as when the
+    configs were scanned in order.
+"""
+from typing import Dict
+
+from lariat_python_common.string.utils import (
+    compile_lariat_file_partition_pattern,
+    match_compiled_lariat_file_partition_pattern,
+)
+
+from lariat_agents.agent.event_payload.event_payload_utils import (
+    DEFAULT_PARTITION_SEPARATOR,
+)
+
+
+class DatasetRoute:
+    """
+    A dataset config with its precompiled partition matcher
+    """
+
+    def __init__(self, config: Dict, position: int):
+        self.config = config
+        self.position = position
+        self.name = config.get("name")
+        self.prefix = config.get("prefix") or ""
+        self.partition_separator = config.get(
+            "key_val_partition_separator", DEFAULT_PARTITION_SEPARATOR
+        )
+        self.partition_pattern = compile_lariat_file_partition_pattern(
+            config.get("suffix_template"), self.partition_separator
+        )
+
+    def match(self, object_key):
+        """
+        :param object_key: object key starting with the route's prefix
+        :return: partition fields of the key, empty when its suffix doesn't match the suffix template
+        """
+        suffix_key = object_key[len(self.prefix) :].removeprefix("/").removesuffix("/")
+        return match_compiled_lariat_file_partition_pattern(
+            suffix_key, self.partition_pattern, self.partition_separator
+        )
+
+
+class PrefixTrie:
+    """
+    Character trie of route prefixes
+    """
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, route: DatasetRoute):
+        node = self.root
+        for character in route.prefix:
+            node = node.setdefault(character, {})
+        node.setdefault(None, []).append(route)
+
+    def get_routes(self, object_key):
+        """
+        :return: routes whose prefix the object key starts with, in config order
+        """
+        node = self.root
+        routes = list(node.get(None, []))
+        for character in object_key:
+            node = node.get(character)
+            if node is None:
+                break
+            routes.extend(node.get(None, []))
+        return sorted(routes, key=lambda route: route.position)
+
+
+class RoutingIndex:
+    def __init__(self, agent_config: Dict):
+        """
+        :param agent_config: the agent's yaml config
+        """
+        self.tries = {}
+        self.configs = {}
+        for bucket_name, bucket_configs in agent_config.get("buckets", {}).items():
+            trie = PrefixTrie()
+            for position, config in enumerate(bucket_configs or []):
+                trie.add(DatasetRoute(config, position))
+                # The first config with a given name wins, as when the configs were scanned in order
+                self.configs.setdefault(config.get("name"), config)
+            self.tries[bucket_name] = trie
+
+    def route(self, bucket_name, object_key):
+        """
+        :param bucket_name:
+        :param object_key:
+        :return: the config of the object's dataset and the partition fields of its key, (None, None) when no
+        config matches
+        """
+        trie = self.tries.get(bucket_name)
+        if trie is None:
+            return None, None
+        for route in trie.get_routes(object_key):
+            partition_fields_in_data = route.match(object_key)
+            if partition_fields_in_data:
+                return route.config, partition_fields_in_data
+        return None, None
+
+    def get_dataset_config(self, dataset_name):
+        return self.configs.get(dataset_name)
@@ -24,6 +24,12 @@ class SupportedPayloadFormat(Enum):
     AVRO = "avro"
 
 
+class ExecutionEngine(Enum):
+    PANDAS = "pandas"
+    ARROW = "arrow"
+    DUCKDB = "duckdb"
+
+
 class EventPayload(BaseModel):
     event_source: EventType
     bucket: Optional[str] = None
@@ -36,4 +42,5 @@ class CompressionType(Enum):
     GZIP = "gzip"
     BZIP2 = "bz2"
     SNAPPY = "snappy"
+    ZSTD = "zstd"
     NONE = None
@@ -1,5 +1,4 @@
 import pandas as pd
-from typing import Optional
 from lariat_agents.agent.event_payload.event_payload_types import (
     EventPayload,
     EventType,
@@ -9,15 +8,17 @@ from lariat_agents.agent.event_payload.event_payload_types import (
 )
 from typing import Dict, List
 from urllib.parse import unquote_plus
+import copy
 import json
-from lariat_python_common.string.utils import match_lariat_file_partition_pattern
 import magic
-from lariat_agents.constants import EVENT_PAYLOAD_MAX_CONTENT_LENGTH_BYTES
-from lariat_python_common.schema.utils import (
-    get_schema_from_json,
-    get_schema_from_df,
+from lariat_python_common.schema.utils import get_schema_from_df
+from lariat_agents.agent.event_payload.event_payload_avro import (
+    get_avro_writer_schema,
+)
+from lariat_agents.agent.event_payload.event_payload_object import (
+    PayloadObject,
+    PayloadObjectFileSystem,
 )
-from lariat_python_common.pandas.utils import get_df_iterator_from_avro
 
 import pyarrow.parquet as pq
 import fsspec
@@ -27,104 +28,78 @@ from lariat_agents.constants import (
     CLOUD_TYPE_GCP,
 )
 import logging
-
+from functools import lru_cache
 
 DEFAULT_PARTITION_SEPARATOR = "="
 META_PREFIX = "partition."
 OBJECT_PREFIX = "object."
 
 
-def is_content_too_large(content_length) -> bool:
-    return content_length >= EVENT_PAYLOAD_MAX_CONTENT_LENGTH_BYTES
+def get_payload_schema(df, partition_fields_in_data):
+    """
+    Schema of a payload from a dataframe of its rows (the first chunk read by the query builder)
+    """
+    return get_schema_from_df(
+        df,
+        partition_fields_in_data,
+        OBJECT_PREFIX,
+        META_PREFIX,
+    )
 
 
-def get_schema_for_data(
-    file_location, file_type, partition_fields_in_data, chunksize: Optional[int] = 10000
-):
-    clean_schema = None
-    file_type = SupportedPayloadFormat(file_type)
-    if file_type == SupportedPayloadFormat.JSONL:
-        chunks = pd.read_json(file_location, lines=True, chunksize=chunksize)
-        if chunksize:
-            df = next(chunks, None)
-        else:
-            df = chunks
-        if df is not None:
-            clean_schema = get_schema_from_df(
-                df,
-                partition_fields_in_data,
-                OBJECT_PREFIX,
-                META_PREFIX,
-            )
-            """
-            final_merged_data = json.loads(df.to_json(orient="records"))
-            clean_schema = get_schema_from_json(
-                final_merged_data,
-                partition_fields_in_data,
-                OBJECT_PREFIX,
-                META_PREFIX,
-            )
-            """
+def merge_payload_schemas(schemas):
+    """
+    Union of the schemas of several payloads of a dataset. A field in several schemas keeps the type of the
+    first payload it appears in.
+    :return: merged schema, None when no payload had a schema
+    """
+    merged_schema = None
+    for schema in schemas:
+        if not schema:
+            continue
+        if merged_schema is None:
+            merged_schema = copy.deepcopy(schema)
+            continue
+        for field, field_schema in schema.get("properties", {}).items():
+            merged_schema["properties"].setdefault(field, field_schema)
+    return merged_schema
 
-    elif file_type == SupportedPayloadFormat.JSON:
-        chunks = pd.read_json(file_location, lines=False, chunksize=chunksize)
-        if chunksize:
-            df = next(chunks, None)
-        else:
-            df = chunks
-        if df is not None:
-            clean_schema = get_schema_from_df(
-                df,
-                partition_fields_in_data,
-                OBJECT_PREFIX,
-                META_PREFIX,
-            )
-            """
-            final_merged_data = df.to_json(orient="records")
-            clean_schema = get_schema_from_json(
-                final_merged_data,
-                partition_fields_in_data,
-                OBJECT_PREFIX,
-                META_PREFIX,
-            )
-            """
-    elif file_type == SupportedPayloadFormat.CSV:
-        chunks = pd.read_csv(file_location, chunksize=chunksize, on_bad_lines="warn")
-        if chunksize:
-            df = next(chunks, None)
-        else:
-            df = chunks
-        if df is not None:
-            clean_schema = get_schema_from_df(
-                df,
-                partition_fields_in_data,
-                OBJECT_PREFIX,
-                META_PREFIX,
-            )
-    elif file_type == SupportedPayloadFormat.PARQUET:
-        if chunksize is None:
-            df = pd.read_parquet(file_location)
-        else:
-            with fsspec.open(file_location) as f:
-                parquet_file = pq.ParquetFile(f)
-                df = next(
-                    parquet_file.iter_batches(batch_size=chunksize), None
-                ).to_pandas()
-        clean_schema = get_schema_from_df(
-            df,
-            partition_fields_in_data,
-            OBJECT_PREFIX,
-            META_PREFIX,
-        )
+
+def get_avro_field_dtype(avro_type):
+    if isinstance(avro_type, list):
+        non_null_types = [item for item in avro_type if item != "null"]
+        avro_type = non_null_types[0] if len(non_null_types) == 1 else None
+    if isinstance(avro_type, dict) and "logicalType" not in avro_type:
+        avro_type = avro_type.get("type")
+    if avro_type in ("int", "long"):
+        return "int64"
+    elif avro_type in ("float", "double"):
+        return "float64"
+    elif avro_type == "boolean":
+        return "bool"
+    return "object"
+
+
+def get_payload_schema_from_header(file_location, file_type, partition_fields_in_data):
+    """
+    Schema of a parquet (footer) or avro (header) payload without reading any rows.
+    Returns None for formats that don't carry a schema, their schema comes from the first chunk that is read.
+    """
+    file_type = SupportedPayloadFormat(file_type)
+    if file_type == SupportedPayloadFormat.PARQUET:
+        with fsspec.open(file_location) as f:
+            df = pq.read_schema(f).empty_table().to_pandas()
     elif file_type == SupportedPayloadFormat.AVRO:
-        df = next(get_df_iterator_from_avro(file_location, chunksize), None)
-        clean_schema = get_schema_from_df(
-            df,
-            partition_fields_in_data,
-            OBJECT_PREFIX,
-            META_PREFIX,
+        writer_schema = get_avro_writer_schema(file_location)
+        df = pd.DataFrame(
+            {
+                field["name"]: pd.Series(dtype=get_avro_field_dtype(field["type"]))
+                for field in writer_schema.get("fields", [])
+            }
         )
-    return clean_schema
+    else:
+        return None
+    return get_payload_schema(df, partition_fields_in_data)
 
 
 def process_sns_s3_event(
@@ -214,11 +189,21 @@ def process_event_payload(
         return process_gcs_object_event(event_obj, payload_source)
 
 
+@lru_cache(maxsize=None)
+def get_mime_magic():
+    """
+    Shared libmagic handle, loading the magic database is much slower than sniffing a header
+    """
+    return magic.Magic(mime=True)
+
+
 def get_compression_from_magic_type(compression_magic_type):
     if "gzip" in compression_magic_type:
         return CompressionType.GZIP
-    elif "gzip2" in compression_magic_type:
+    elif "bzip2" in compression_magic_type:
         return CompressionType.BZIP2
+    elif "zstd" in compression_magic_type:
+        return CompressionType.ZSTD
     elif "snappy" in compression_magic_type:
         # TODO: This will likely not work - need to handle snappy & zlib separately
         return CompressionType.SNAPPY
@@ -227,127 +212,85 @@ def get_compression_from_magic_type(compression_magic_type):
 
 
 def collect_payload_from_s3(
-    agent_config, bucket_name, object_key, s3_handler, header_byte_length=4096
+    routing_index, bucket_name, object_key, s3_handler, header_byte_length=4096
 ):
-    if bucket_name in agent_config["buckets"]:
-        bucket_configs = agent_config["buckets"][bucket_name]
-        for bucket_config in bucket_configs:
-            if object_key.startswith(bucket_config.get("prefix")):  # Matches prefix
-                suffix_key = (
-                    object_key[len(bucket_config.get("prefix")) :]
-                    .removeprefix("/")
-                    .removesuffix("/")
-                )
-                partition_separator = bucket_config.get(
-                    "key_val_partition_separator", DEFAULT_PARTITION_SEPARATOR
-                )
-                partition_fields_in_data = match_lariat_file_partition_pattern(
-                    suffix_key,
-                    bucket_config.get("suffix_template"),
-                    partition_separator,
-                )
-                if partition_fields_in_data:
-                    # Retrieve data
-                    overall_response = s3_handler.get_object(
-                        Bucket=bucket_name, Key=object_key
-                    )
-                    content_length = overall_response["ContentLength"]
-                    overall_response = None
-                    header_response = s3_handler.get_object(
-                        Bucket=bucket_name,
-                        Key=object_key,
-                        Range=f"bytes=0-{header_byte_length-1}",
-                    )
-                    header_bytes = header_response["Body"].read(header_byte_length)
-                    file_type = bucket_config.get("file_type")
-                    config_name = bucket_config.get("name")
-                    mime = magic.Magic(mime=True)
-                    compression_magic_type = mime.from_buffer(header_bytes)
-                    compression = get_compression_from_magic_type(
-                        compression_magic_type
-                    )
-                    fsspec_name = f"s3://{bucket_name}/{object_key}"
-                    if is_content_too_large(content_length):
-                        clean_schema = get_schema_for_data(
-                            fsspec_name,
-                            file_type,
-                            partition_fields_in_data,
-                        )
-                    else:
-                        clean_schema = get_schema_for_data(
-                            fsspec_name,
-                            file_type,
-                            partition_fields_in_data,
-                            chunksize=None,
-                        )
-                    return (
-                        file_type,
-                        fsspec_name,
-                        compression,
-                        clean_schema,
-                        config_name,
-                        partition_fields_in_data,
-                        content_length,
-                    )
-    return None, None, None, None, None, None, None
+    """
+    Route an object to its dataset config and register it as a payload object
+    :param routing_index: RoutingIndex of the agent's yaml config
+    :return: file type, fsspec name, compression, dataset name, partition fields and content length
+    """
+    bucket_config, partition_fields_in_data = routing_index.route(
+        bucket_name, object_key
+    )
+    if partition_fields_in_data:
+        # Retrieve data
+        content_length = s3_handler.head_object(Bucket=bucket_name, Key=object_key)[
+            "ContentLength"
+        ]
+        header_response = s3_handler.get_object(
+            Bucket=bucket_name,
+            Key=object_key,
+            Range=f"bytes=0-{header_byte_length-1}",
+        )
+        header_bytes = header_response["Body"].read(header_byte_length)
+        file_type = bucket_config.get("file_type")
+        config_name = bucket_config.get("name")
+        compression_magic_type = get_mime_magic().from_buffer(header_bytes)
+        compression = get_compression_from_magic_type(compression_magic_type)
+        fsspec_name = PayloadObjectFileSystem.register(
+            PayloadObject(
+                f"s3://{bucket_name}/{object_key}",
+                content_length,
+                header_bytes,
+            )
+        )
+        # The schema is inferred by the query builder while computing the metrics
+        return (
+            file_type,
+            fsspec_name,
+            compression,
+            config_name,
+            partition_fields_in_data,
+            content_length,
+        )
+    return None, None, None, None, None, None
 
 
 def collect_payload_from_gcs(
-    agent_config, bucket_name, object_key, gcs_handler, header_byte_length=4096
+    routing_index, bucket_name, object_key, gcs_handler, header_byte_length=4096
 ):
-    if bucket_name in agent_config["buckets"]:
-        bucket_configs = agent_config["buckets"][bucket_name]
-        for bucket_config in bucket_configs:
-            if object_key.startswith(bucket_config.get("prefix")):  # Matches prefix
-                suffix_key = (
-                    object_key[len(bucket_config.get("prefix")) :]
-                    .removeprefix("/")
-                    .removesuffix("/")
-                )
-                partition_separator = bucket_config.get(
-                    "key_val_partition_separator", DEFAULT_PARTITION_SEPARATOR
-                )
-                partition_fields_in_data = match_lariat_file_partition_pattern(
-                    suffix_key,
-                    bucket_config.get("suffix_template"),
-                    partition_separator,
-                )
-                if partition_fields_in_data:
-                    # Retrieve data
-                    gcs_bucket = gcs_handler.get_bucket(bucket_name)
-                    blob = gcs_bucket.get_blob(object_key)
-                    content_length = blob.size
-                    header_bytes = blob.download_as_bytes(
-                        start=0, end=header_byte_length - 1
-                    )
-                    file_type = bucket_config.get("file_type")
-                    config_name = bucket_config.get("name")
-                    mime = magic.Magic(mime=True)
-                    compression_magic_type = mime.from_buffer(header_bytes)
-                    compression = get_compression_from_magic_type(
-                        compression_magic_type
-                    )
-                    fsspec_name = f"gcs://{bucket_name}/{object_key}"
-                    if is_content_too_large(content_length):
-                        clean_schema = get_schema_for_data(
-                            fsspec_name,
-                            file_type,
-                            partition_fields_in_data,
-                        )
-                    else:
-                        clean_schema = get_schema_for_data(
-                            fsspec_name,
-                            file_type,
-                            partition_fields_in_data,
-                            chunksize=None,
-                        )
-                    return (
-                        file_type,
-                        fsspec_name,
-                        compression,
-                        clean_schema,
-                        config_name,
-                        partition_fields_in_data,
-                        content_length,
-                    )
-    return None, None, None, None, None, None, None
+    """
+    Route an object to its dataset config and register it as a payload object
+    :param routing_index: RoutingIndex of the agent's yaml config
+    :return: file type, fsspec name, compression, dataset name, partition fields and content length
+    """
+    bucket_config, partition_fields_in_data = routing_index.route(
+        bucket_name, object_key
+    )
+    if partition_fields_in_data:
+        # Retrieve data
+        gcs_bucket = gcs_handler.get_bucket(bucket_name)
+        blob = gcs_bucket.get_blob(object_key)
+        content_length = blob.size
+        header_bytes = blob.download_as_bytes(start=0, end=header_byte_length - 1)
+        file_type = bucket_config.get("file_type")
+        config_name = bucket_config.get("name")
+        compression_magic_type = get_mime_magic().from_buffer(header_bytes)
+        compression = get_compression_from_magic_type(compression_magic_type)
+        fsspec_name = PayloadObjectFileSystem.register(
+            PayloadObject(
+                f"gcs://{bucket_name}/{object_key}",
+                content_length,
+                header_bytes,
+            )
+        )
+        # The schema is inferred by the query builder while computing the metrics
+        return (
+            file_type,
+            fsspec_name,
+            compression,
+            config_name,
+            partition_fields_in_data,
+            content_length,
+        )
+    return None, None, None, None, None, None
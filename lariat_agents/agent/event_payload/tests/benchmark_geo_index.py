@@ -0,0 +1,85 @@
+"""
+    Per chunk state and country lookup of random EPSG:4326 points: the spatial join of a chunk against the
+    shapefiles it used to do, against the cached index. Run with
+    python -m lariat_agents.agent.event_payload.tests.benchmark_geo_index
+"""
+import os
+import timeit
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from lariat_agents.agent.event_payload.event_payload_geo_index import (
+    GEO_LAYERS,
+    GEO_MISSING_VALUE,
+    SHAPEFILES_DIR,
+    get_geo_index,
+    map_country_names_to_alpha3,
+)
+from lariat_agents.agent.event_payload.event_payload_query_builder import (
+    EventPayloadQueryBuilder,
+)
+
+REPEAT = 3
+
+
+def sjoin_geolocation(geometries, mode):
+    """
+    The lookup before the index: read the layer, reproject the chunk and join it with the within predicate
+    """
+    layer, name_column = GEO_LAYERS[mode]
+    polygons = gpd.read_file(os.path.join(SHAPEFILES_DIR, f"{layer}.shp"))
+    gdf = gpd.GeoDataFrame(geometry=geometries, crs="EPSG:4326")
+    gdf.to_crs(crs=polygons.crs, inplace=True)
+    gdf = gdf.sjoin(polygons[[name_column, "geometry"]], how="left", predicate="within")
+    # Points in overlapping polygons get the first one in the layer, as the index does
+    gdf = gdf.sort_values("index_right", kind="stable")
+    names = (
+        gdf[~gdf.index.duplicated()]
+        .sort_index()[name_column]
+        .fillna(GEO_MISSING_VALUE)
+        .to_numpy()
+    )
+    if mode == "country":
+        names = map_country_names_to_alpha3(names)
+    return names
+
+
+def index_geolocation(geometries, mode):
+    return EventPayloadQueryBuilder.get_geolocation(geometries, mode)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    for mode in GEO_LAYERS:
+        get_geo_index(mode)
+    for size in [10000, 100000]:
+        geometries = shapely.points(
+            np.column_stack([rng.uniform(-180, 180, size), rng.uniform(-90, 90, size)])
+        )
+        timings = {}
+        for lookup in [sjoin_geolocation, index_geolocation]:
+            results = [lookup(geometries, mode) for mode in GEO_LAYERS]
+            timings[lookup.__name__] = (
+                min(
+                    timeit.repeat(
+                        lambda: [lookup(geometries, mode) for mode in GEO_LAYERS],
+                        number=1,
+                        repeat=REPEAT,
+                    )
+                ),
+                results,
+            )
+        (sjoin_time, sjoin_results), (index_time, index_results) = timings.values()
+        identical = all(
+            (old == new).all() for old, new in zip(sjoin_results, index_results)
+        )
+        print(
+            f"{size} points: sjoin {sjoin_time * 1000:.0f} ms, index {index_time * 1000:.0f} ms, "
+            f"identical results: {identical}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import json
+
+import pandas as pd
+import pytest
+
+from lariat_agents.agent.event_payload import event_payload_agent
+from lariat_agents.agent.event_payload.event_payload_agent import EventPayloadAgent
+from lariat_agents.agent.event_payload.event_payload_object import (
+    PayloadObject,
+    PayloadObjectFileSystem,
+)
+from lariat_agents.agent.event_payload.event_payload_query_builder import (
+    EventPayloadQueryBuilder,
+)
+from lariat_agents.agent.event_payload.event_payload_routing import RoutingIndex
+from lariat_agents.base.streaming_base.streaming_result_writer import (
+    StreamingResultWriter,
+)
+
+AGENT_CONFIG = {
+    "source_id": "test",
+    "buckets": {
+        "events": [
+            {
+                "name": "clicks",
+                "prefix": "clicks",
+                "suffix_template": "<day>",
+                "file_type": "jsonl",
+                "dimensions": ["country"],
+                "columns": {"number": ["value"]},
+                "timestamp": {
+                    "ts": {"column": "ts", "format": "unixtime", "primary": True}
+                },
+            }
+        ]
+    },
+}
+ROWS = [
+    {"country": country, "value": i * 0.5, "ts": 1700000000 + i}
+    for i, country in enumerate(["US", "FR", "US", "DE", "US", "FR"] * 50)
+]
+
+
+@pytest.fixture(autouse=True)
+def release_payload_objects():
+    yield
+    PayloadObjectFileSystem.release()
+
+
+def get_agent(written):
+    agent = EventPayloadAgent.__new__(EventPayloadAgent)
+    agent.yaml_config = AGENT_CONFIG
+    agent._api_key = "api_key"
+    agent.routing_index = RoutingIndex(AGENT_CONFIG)
+    agent.query_builder = EventPayloadQueryBuilder(query_builder_type="event_payload")
+    agent.result_writer = StreamingResultWriter(
+        lambda result_df, file_path: written.append(result_df)
+    )
+    return agent
+
+
+def get_object_info(tmp_path, name, rows):
+    path = tmp_path / name
+    data = b"".join(json.dumps(row).encode() + b"\n" for row in rows)
+    path.write_bytes(data)
+    fsspec_name = PayloadObjectFileSystem.register(
+        PayloadObject(f"file://{path}", len(data), data[:64])
+    )
+    return (
+        fsspec_name,
+        {"day": "1"},
+        "events",
+        f"clicks/day=1/{name}",
+        {},
+        len(data),
+        None,
+    )
+
+
+@pytest.mark.parametrize("compute_processes", [False, True])
+def test_execute_stream_metrics(tmp_path, monkeypatch, compute_processes):
+    """
+    Two objects computed by the thread or process pool coalesce into the results of all their rows
+    """
+    monkeypatch.setattr(
+        event_payload_agent, "EVENT_PAYLOAD_COMPUTE_PROCESSES", compute_processes
+    )
+    monkeypatch.setattr(event_payload_agent, "EVENT_PAYLOAD_OBJECT_CONCURRENCY", 2)
+    executor = EventPayloadAgent.get_compute_executor(2)
+    assert type(executor).__name__ == (
+        "ProcessPoolExecutor" if compute_processes else "ThreadPoolExecutor"
+    )
+    executor.shutdown()
+
+    written = []
+    agent = get_agent(written)
+    name_data_map = {
+        "clicks": [
+            get_object_info(tmp_path, "part-0.json", ROWS[:100]),
+            get_object_info(tmp_path, "part-1.json", ROWS[100:]),
+        ]
+    }
+    events = agent.execute_stream_metrics(name_data_map, {})
+    assert len(events) == 1
+    assert [obj["object"] for obj in events[0]["objects"]] == [
+        "clicks/day=1/part-0.json",
+        "clicks/day=1/part-1.json",
+    ]
+    groups = pd.DataFrame(ROWS).groupby("country")
+    # The primary time of a group is its latest timestamp
+    assert events[0]["min_primary_time"] == groups["ts"].max().min()
+    assert events[0]["max_primary_time"] == groups["ts"].max().max()
+    result_df = pd.concat(written).set_index("dim|country").sort_index()
+    expected = groups["value"]
+    count_col = next(col for col in result_df.columns if col.startswith("count|value|"))
+    sum_col = next(col for col in result_df.columns if col.startswith("sum|value|"))
+    assert result_df[count_col].tolist() == expected.count().tolist()
+    assert result_df[sum_col].tolist() == pytest.approx(expected.sum().tolist())
+    assert result_df["total_record_count"].unique().tolist() == [len(ROWS)]
+
+
+def test_get_location_info():
+    objects = [
+        {"bucket": "events", "object": "clicks/day=1/part-0.json"},
+        {"bucket": "events", "object": "clicks/day=1/part-1.json"},
+    ]
+    # Coalesced objects are labelled with their directory, not the common characters of their names
+    assert EventPayloadAgent.get_location_info(objects) == ("events", "clicks/day=1/")
+    assert EventPayloadAgent.get_location_info(objects[:1]) == (
+        "events",
+        "clicks/day=1/part-0.json",
+    )
+    objects.append({"bucket": "events", "object": "clicks/day=10/part-0.json"})
+    assert EventPayloadAgent.get_location_info(objects) == ("events", "clicks/")
+    assert EventPayloadAgent.get_location_info(
+        [
+            {"bucket": "events", "object": "a.json"},
+            {"bucket": "events", "object": "b.json"},
+        ]
+    ) == ("events", "")
@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from lariat_agents.agent.event_payload.event_payload_aggregate_state import (
+    AggregateState,
+    PartialStateFold,
+    TOTAL_GROUP_COUNT_COL,
+    add_partial_state_columns,
+    concat_partial_states,
+    encode_dimension,
+    finalize_partial_states,
+    merge_partial_states,
+)
+
+VALUES = [3.5, None, -1.0, 7.25, 2.0, None, 11.0, 0.5, 4.0]
+
+
+def aggregate_chunk(df):
+    groups = df.groupby("dim", dropna=False, observed=True)
+    grouped = groups["value"]
+    result = pd.DataFrame(
+        {
+            "count|value|k": grouped.count(),
+            "sum|value|k": grouped.sum(),
+            "max|value|k": grouped.max(),
+            "min|value|k": grouped.min(),
+            "mean|value|k": grouped.mean(),
+            "std|value|k": grouped.std(),
+            "null_count|value|k": grouped.apply(lambda x: x.isnull().sum()),
+            TOTAL_GROUP_COUNT_COL: grouped.size(),
+            "max_ts": groups["ts"].max(),
+        }
+    ).reset_index()
+    return result
+
+
+@pytest.mark.parametrize("split", [1, 2, 4, 8])
+def test_aggregate_state_merge(split):
+    """
+    Merging the states of any split of the values gives the same result as aggregating all of them.
+    """
+    expected = AggregateState.from_values(VALUES)
+    state = AggregateState()
+    for chunk in np.array_split(np.array(VALUES, dtype=float), split):
+        state = state.merge(AggregateState.from_values(chunk))
+    assert state.count == expected.count == 7
+    assert state.null_count == expected.null_count == 2
+    assert state.min == -1.0 and state.max == 11.0
+    assert state.mean == pytest.approx(pd.Series(VALUES).mean())
+    assert state.std == pytest.approx(pd.Series(VALUES).std())
+
+
+def test_aggregate_state_string_column():
+    state = AggregateState.from_values(["a", None], numeric=False).merge(
+        AggregateState.from_values(["b", "c"], numeric=False)
+    )
+    assert (state.count, state.null_count) == (3, 1)
+    assert state.min is None and state.max is None
+
+
+def test_merge_partial_states():
+    """
+    Chunk results merged with merge_partial_states match the results of the whole frame, including std.
+    """
+    df = pd.DataFrame(
+        {
+            "dim": ["a", "b", "a", "a", "b", "a", "b", "c", "a"],
+            "value": VALUES,
+            "ts": range(len(VALUES)),
+        }
+    )
+    chunks = [
+        add_partial_state_columns(aggregate_chunk(df.iloc[i : i + 3]))
+        for i in range(0, len(df), 3)
+    ]
+    merged = merge_partial_states(pd.concat(chunks), ["dim"], ["max_ts"])
+    # The merged result can be merged again
+    merged = merge_partial_states(merged, ["dim"], ["max_ts"])
+    result = finalize_partial_states(merged).set_index("dim").sort_index()
+    expected = aggregate_chunk(df).set_index("dim").sort_index()
+    pd.testing.assert_frame_equal(
+        result[expected.columns], expected, check_dtype=False
+    )
+
+
+def test_merge_partial_states_ungrouped():
+    df = pd.DataFrame({"dim": "x", "value": VALUES, "ts": range(len(VALUES))})
+    chunks = [
+        add_partial_state_columns(aggregate_chunk(df.iloc[i : i + 2]).drop(columns="dim"))
+        for i in range(0, len(df), 2)
+    ]
+    result = finalize_partial_states(
+        merge_partial_states(pd.concat(chunks), [], ["max_ts"])
+    )
+    assert len(result) == 1
+    assert result["std|value|k"][0] == pytest.approx(pd.Series(VALUES).std())
+    assert result["max_ts"][0] == len(VALUES) - 1
+
+
+def test_encode_dimension():
+    encoded = encode_dimension(pd.Series([" b", "a", None, "", "b ", 1, np.nan]))
+    assert list(encoded.categories) == ["1", "<empty>", "a", "b"]
+    assert list(encoded) == ["b", "a", "<empty>", "<empty>", "b", "1", "<empty>"]
+
+
+def test_merge_partial_states_categorical_chunks():
+    """
+    Chunks with different dimension values are merged on unified categories
+    """
+    df = pd.DataFrame(
+        {
+            "dim": ["a", "b", "a", "a", "b", "a", "b", "c", "a"],
+            "value": VALUES,
+            "ts": range(len(VALUES)),
+        }
+    )
+    chunks = []
+    for i in range(0, len(df), 3):
+        chunk = df.iloc[i : i + 3].assign(dim=lambda x: encode_dimension(x["dim"]))
+        chunks.append(add_partial_state_columns(aggregate_chunk(chunk)))
+    concatenated = concat_partial_states(chunks, ["dim"])
+    assert list(concatenated["dim"].cat.categories) == ["a", "b", "c"]
+    merged = merge_partial_states(concatenated, ["dim"], ["max_ts"])
+    expected = aggregate_chunk(df)
+    assert merged["dim"].tolist() == ["a", "b", "c"]
+    assert merged["count|value|k"].tolist() == expected["count|value|k"].tolist()
+    assert merged[TOTAL_GROUP_COUNT_COL].tolist() == [5, 3, 1]
+
+
+@pytest.mark.parametrize("memory_limit", [10 ** 9, 0])
+def test_partial_state_fold(tmp_path, memory_limit):
+    """
+    Folding chunk results one at a time, spilled to disk or not, matches aggregating the whole frame
+    """
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "dim": rng.integers(0, 50, 1000).astype(str),
+            "value": rng.normal(size=1000),
+            "ts": range(1000),
+        }
+    )
+    fold = PartialStateFold(
+        ["dim"], ["max_ts"], memory_limit=memory_limit, partitions=4, spill_dir=tmp_path
+    )
+    for i in range(0, len(df), 100):
+        chunk = df.iloc[i : i + 100].assign(dim=lambda x: encode_dimension(x["dim"]))
+        fold.add(add_partial_state_columns(aggregate_chunk(chunk)))
+    result = finalize_partial_states(fold.result())
+    fold.close()
+    assert list(tmp_path.iterdir()) == []
+    result = result.assign(dim=result["dim"].astype(str)).set_index("dim").sort_index()
+    expected = aggregate_chunk(df).set_index("dim").sort_index()
+    pd.testing.assert_frame_equal(
+        result[expected.columns], expected, check_dtype=False
+    )
@@ -0,0 +1,112 @@
+from datetime import datetime, timezone
+
+import duckdb
+import pyarrow as pa
+import pytest
+from fastavro import parse_schema, writer
+
+from lariat_agents.agent.event_payload import event_payload_avro
+from lariat_agents.agent.event_payload.event_payload_avro import (
+    avro_type_to_arrow,
+    get_avro_record_batches,
+    is_duckdb_avro_available,
+)
+
+SCHEMA = {
+    "type": "record",
+    "name": "event",
+    "fields": [
+        {"name": "id", "type": "long"},
+        {"name": "country", "type": ["null", "string"]},
+        {"name": "value", "type": ["null", "double"]},
+        {
+            "name": "ts",
+            "type": {"type": "long", "logicalType": "timestamp-millis"},
+        },
+        {
+            "name": "attrs",
+            "type": {
+                "type": "record",
+                "name": "attrs",
+                "fields": [{"name": "k", "type": "string"}],
+            },
+        },
+    ],
+}
+RECORDS = [
+    {
+        "id": i,
+        "country": None if i % 7 == 0 else "US",
+        "value": i * 0.5,
+        "ts": datetime(2024, 1, 1, tzinfo=timezone.utc),
+        "attrs": {"k": f"v{i % 3}"},
+    }
+    for i in range(5000)
+]
+
+
+@pytest.fixture
+def avro_payload(tmp_path):
+    path = tmp_path / "payload.avro"
+    with open(path, "wb") as f:
+        writer(f, parse_schema(SCHEMA), RECORDS, sync_interval=4096)
+    return f"file://{path}"
+
+
+def test_avro_type_to_arrow():
+    assert avro_type_to_arrow(["null", "string"]) == pa.string()
+    assert avro_type_to_arrow(["int", "string"]) is None
+    assert avro_type_to_arrow(
+        {"type": "long", "logicalType": "timestamp-micros"}
+    ) == pa.timestamp("us", tz="UTC")
+    assert avro_type_to_arrow({"type": "array", "items": "int"}) == pa.list_(pa.int32())
+    assert avro_type_to_arrow(SCHEMA["fields"][4]["type"]) == pa.struct(
+        [pa.field("k", pa.string())]
+    )
+
+
+@pytest.mark.parametrize("duckdb_avro", [False, True])
+def test_get_avro_record_batches(avro_payload, monkeypatch, duckdb_avro):
+    if duckdb_avro and not is_duckdb_avro_available():
+        pytest.skip("duckdb's avro extension isn't available")
+    monkeypatch.setattr(
+        event_payload_avro, "is_duckdb_avro_available", lambda: duckdb_avro
+    )
+    batches = list(
+        get_avro_record_batches(avro_payload, {"id", "country", "attrs"}, 1000)
+    )
+    table = pa.Table.from_batches(batches)
+    assert table.column_names == ["id", "country", "attrs"]
+    assert table.num_rows == len(RECORDS)
+    assert table.column("id").to_pylist() == [record["id"] for record in RECORDS]
+    assert table.column("country").null_count == sum(
+        record["country"] is None for record in RECORDS
+    )
+    assert table.column("attrs").to_pylist()[:3] == [
+        {"k": "v0"},
+        {"k": "v1"},
+        {"k": "v2"},
+    ]
+
+
+def test_duckdb_avro_extension_is_never_installed(monkeypatch):
+    """
+    A missing extension makes the fastavro path used, it isn't downloaded while processing an event
+    """
+    statements = []
+
+    class Connection:
+        def execute(self, statement):
+            statements.append(statement)
+            raise duckdb.IOException("Extension avro not found")
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(event_payload_avro, "get_duckdb_connection", Connection)
+    is_duckdb_avro_available.cache_clear()
+    try:
+        assert not is_duckdb_avro_available()
+    finally:
+        is_duckdb_avro_available.cache_clear()
+    assert statements == ["LOAD avro"]
@@ -0,0 +1,164 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from lariat_agents.agent.event_payload.event_payload_aggregate_state import (
+    add_partial_state_columns,
+)
+from lariat_agents.agent.event_payload.event_payload_query_builder import (
+    EventPayloadQueryBuilder,
+)
+from lariat_agents.agent.event_payload.event_payload_types import (
+    ExecutionEngine,
+    SupportedPayloadFormat,
+)
+from lariat_agents.agent.event_payload.event_payload_utils import (
+    merge_payload_schemas,
+)
+from lariat_agents.agent.event_payload.tests.test_event_payload_aggregate_state import (
+    VALUES,
+    aggregate_chunk,
+)
+
+
+def get_partial_output(df):
+    return (
+        add_partial_state_columns(aggregate_chunk(df)),
+        len(df),
+        "max_ts",
+        ["max_ts"],
+        ["dim"],
+        ["dim"],
+    )
+
+
+def test_merge_partial_outputs_of_several_objects():
+    """
+    The partial results of several objects merge into the results of all their rows.
+    """
+    df = pd.DataFrame(
+        {
+            "dim": ["a", "b", "a", "a", "b", "a", "b", "c", "a"],
+            "value": VALUES,
+            "ts": range(len(VALUES)),
+        }
+    )
+    objects = [df.iloc[:2], df.iloc[2:7], df.iloc[7:]]
+    query_builder = EventPayloadQueryBuilder(query_builder_type="event_payload")
+    (
+        merged_df,
+        execution_time,
+        primary_time_column,
+        filtered_dimensions,
+        clean_schema,
+    ) = query_builder.merge_partial_outputs(
+        [get_partial_output(object_df) for object_df in objects] + [None],
+        1700000000,
+        ("bucket", "events/2024/"),
+        {"type": "object", "properties": {}},
+    )
+    expected = aggregate_chunk(df).set_index("dim")
+    merged_df = merged_df.set_index("dim|dim").sort_index()
+    assert primary_time_column == "primary_time|max_ts"
+    assert filtered_dimensions == ["dim"]
+    assert merged_df["total_record_count"].unique().tolist() == [len(df)]
+    assert merged_df["object"].unique().tolist() == ["events/2024/"]
+    assert not any(col.startswith("m2|") for col in merged_df.columns)
+    for col in ["count|value|k", "sum|value|k", "min|value|k", "max|value|k"]:
+        assert merged_df[col].tolist() == expected[col].tolist()
+    assert merged_df["std|value|k"].tolist() == pytest.approx(
+        expected["std|value|k"].tolist(), nan_ok=True
+    )
+    assert merged_df["primary_time|max_ts"].tolist() == expected["max_ts"].tolist()
+
+
+def test_merge_payload_schemas():
+    schemas = [
+        None,
+        {"type": "object", "properties": {"a": {"type": "integer"}}},
+        {
+            "type": "object",
+            "properties": {"a": {"type": "string"}, "b": {"type": "number"}},
+        },
+    ]
+    assert merge_payload_schemas(schemas) == {
+        "type": "object",
+        "properties": {"a": {"type": "integer"}, "b": {"type": "number"}},
+    }
+    assert schemas[1]["properties"] == {"a": {"type": "integer"}}
+    assert merge_payload_schemas([None, None]) is None
+
+
+def run_payload(query_builder, path, partial):
+    return query_builder.run(
+        f"file://{path}",
+        {"day": "1"},
+        None,
+        SupportedPayloadFormat.PARQUET,
+        [],
+        ["value"],
+        {"ts": {"column": "ts", "format": "unixtime", "primary": True}},
+        ["country", "device"],
+        "source_id",
+        "dataset",
+        ("bucket", "events/2024/"),
+        path.stat().st_size,
+        ExecutionEngine.PANDAS,
+        memory_budget=1,
+        partial=partial,
+    )
+
+
+def test_merge_partial_outputs_of_categorical_dimensions(tmp_path):
+    """
+    Objects whose dictionary encoded dimensions saw different values, some equal only once normalized (padded,
+    empty or missing), merge into the results of all their rows.
+    """
+    rng = np.random.default_rng(0)
+    size = 600
+    df = pd.DataFrame(
+        {
+            "country": np.concatenate(
+                [
+                    rng.choice(["US", " FR", None], size // 2),
+                    rng.choice(["FR", "", "DE"], size // 2),
+                ]
+            ),
+            "device": rng.choice(["ios", "android"], size),
+            "value": rng.normal(size=size),
+            "ts": range(1700000000, 1700000000 + size),
+        }
+    )
+    paths = []
+    for i, object_df in enumerate([df.iloc[: size // 2], df.iloc[size // 2 :]]):
+        paths.append(tmp_path / f"part-{i}.parquet")
+        object_df.to_parquet(paths[-1])
+    paths.append(tmp_path / "all.parquet")
+    df.to_parquet(paths[-1])
+    query_builder = EventPayloadQueryBuilder(query_builder_type="event_payload")
+    outputs = [run_payload(query_builder, path, True) for path in paths[:2]]
+    merged_df, *_ = query_builder.merge_partial_outputs(
+        [output[0] for output in outputs],
+        1700000000,
+        ("bucket", "events/2024/"),
+        None,
+    )
+    expected_df, *_ = run_payload(query_builder, paths[2], False)
+
+    def sort_results(results_df):
+        return (
+            results_df.drop(
+                columns=[
+                    "time|lariat_agent_execution_time",
+                    "lariat_agent_execution_time",
+                ]
+            )
+            .sort_values(["dim|country", "dim|device"])
+            .reset_index(drop=True)
+        )
+
+    merged_df = sort_results(merged_df)
+    assert merged_df["dim|country"].unique().tolist() == ["<empty>", "DE", "FR", "US"]
+    pd.testing.assert_frame_equal(
+        merged_df, sort_results(expected_df), check_dtype=False
+    )
@@ -0,0 +1,78 @@
+import bz2
+import gzip
+
+import pandas as pd
+import pytest
+import zstandard
+
+from lariat_agents.agent.event_payload import event_payload_compression
+from lariat_agents.agent.event_payload.event_payload_compression import (
+    decompress_prefix,
+    open_payload,
+    resolve_compression,
+)
+from lariat_agents.agent.event_payload.event_payload_types import CompressionType
+from lariat_agents.agent.event_payload.event_payload_utils import (
+    get_compression_from_magic_type,
+)
+
+PAYLOAD = b"".join(b'{"id": %d, "country": "US"}\n' % i for i in range(50000))
+COMPRESSORS = {
+    CompressionType.NONE: lambda data: data,
+    CompressionType.GZIP: gzip.compress,
+    CompressionType.BZIP2: bz2.compress,
+    CompressionType.ZSTD: lambda data: zstandard.ZstdCompressor().compress(data),
+}
+
+
+@pytest.mark.parametrize("compression", list(COMPRESSORS))
+def test_open_payload_without_extension(tmp_path, compression):
+    path = tmp_path / "payload"
+    path.write_bytes(COMPRESSORS[compression](PAYLOAD))
+    with open_payload(f"file://{path}", compression) as f:
+        assert f.read() == PAYLOAD
+    with open_payload(f"file://{path}", compression, text=True) as f:
+        chunks = list(pd.read_json(f, lines=True, chunksize=20000))
+    assert [len(chunk) for chunk in chunks] == [20000, 20000, 10000]
+
+
+@pytest.mark.parametrize("threads", [0, 1, 4])
+def test_gzip_members_are_read_as_one_stream(tmp_path, monkeypatch, threads):
+    monkeypatch.setattr(
+        event_payload_compression, "GZIP_DECOMPRESSION_THREADS", threads
+    )
+    path = tmp_path / "payload"
+    path.write_bytes(gzip.compress(PAYLOAD[:1000]) + gzip.compress(PAYLOAD[1000:]))
+    with open_payload(f"file://{path}", CompressionType.GZIP) as f:
+        assert f.read() == PAYLOAD
+
+
+def test_compression_is_inferred_from_the_extension():
+    assert resolve_compression("s3://bucket/key.jsonl.gz") == CompressionType.GZIP
+    assert resolve_compression("s3://bucket/key.csv.zst") == CompressionType.ZSTD
+    assert resolve_compression("s3://bucket/key.jsonl") == CompressionType.NONE
+    assert (
+        resolve_compression("s3://bucket/key.gz", CompressionType.NONE)
+        == CompressionType.NONE
+    )
+
+
+@pytest.mark.parametrize("compression", list(COMPRESSORS))
+def test_decompress_prefix(compression):
+    compressed = COMPRESSORS[compression](PAYLOAD)
+    prefix = decompress_prefix(compressed[: len(compressed) // 2], compression)
+    if prefix is not None:
+        assert PAYLOAD.startswith(prefix)
+
+
+@pytest.mark.parametrize(
+    "magic_type,compression",
+    [
+        ("application/gzip", CompressionType.GZIP),
+        ("application/x-bzip2", CompressionType.BZIP2),
+        ("application/zstd", CompressionType.ZSTD),
+        ("application/json", CompressionType.NONE),
+    ],
+)
+def test_get_compression_from_magic_type(magic_type, compression):
+    assert get_compression_from_magic_type(magic_type) == compression
@@ -0,0 +1,127 @@
+import json
+import os
+
+from lariat_agents.agent.event_payload.event_payload_daemon_executor import (
+    DirectorySpool,
+    EventPayloadDaemon,
+    get_message_records,
+)
+from lariat_agents.agent.event_payload.event_payload_routing import RoutingIndex
+
+AGENT_CONFIG = {
+    "buckets": {
+        "bucket": [
+            {"name": name, "prefix": name, "suffix_template": "{day}"}
+            for name in ["clicks", "orders", "refunds"]
+        ]
+    }
+}
+
+
+def get_record(object_key):
+    return {"s3": {"bucket": {"name": "bucket"}, "object": {"key": object_key}}}
+
+
+RECORD = get_record("clicks/day=1/a.json")
+
+
+def write_message(spool_dir, name, body):
+    with open(os.path.join(spool_dir, name), "w") as f:
+        f.write(json.dumps(body))
+
+
+def test_get_message_records():
+    assert get_message_records(json.dumps({"Records": [RECORD]})) == [RECORD]
+    sns_envelope = {
+        "Type": "Notification",
+        "Message": json.dumps({"Records": [RECORD, {"eventSource": "aws:sqs"}]}),
+    }
+    assert get_message_records(json.dumps(sns_envelope)) == [RECORD]
+    assert get_message_records(json.dumps({"Event": "s3:TestEvent"})) == []
+
+
+def test_directory_spool(tmp_path):
+    spool = DirectorySpool(str(tmp_path), visibility_timeout=60)
+    for i in range(3):
+        write_message(str(tmp_path), f"{i}.json", {"Records": [RECORD]})
+    messages = spool.receive(2, 0)
+    assert len(messages) == 2
+    assert len(spool.receive(2, 0)) == 1
+    assert spool.receive(2, 0) == []
+    spool.delete(messages)
+    assert len(os.listdir(spool.processing_dir)) == 1
+
+    # Claims older than the visibility timeout are returned to the spool
+    spool.visibility_timeout = -1
+    assert len(spool.receive(2, 0)) == 1
+
+
+class RecordingAgent:
+    def __init__(self, failing_prefix=None):
+        """
+        :param failing_prefix: events with an object under this prefix fail
+        """
+        self.routing_index = RoutingIndex(AGENT_CONFIG)
+        self.events = []
+        self.failing_prefix = failing_prefix
+
+    def process_event(self, event):
+        self.events.append(event)
+        object_keys = [record["s3"]["object"]["key"] for record in event["Records"]]
+        if self.failing_prefix and any(
+            key.startswith(self.failing_prefix) for key in object_keys
+        ):
+            raise RuntimeError("failed")
+
+
+def test_process_batch(tmp_path):
+    spool = DirectorySpool(str(tmp_path), visibility_timeout=60)
+    for i in range(3):
+        write_message(str(tmp_path), f"{i}.json", {"Records": [RECORD]})
+    agent = RecordingAgent()
+    daemon = EventPayloadDaemon(agent, spool, batch_size=10, wait_seconds=0)
+    messages = daemon.receive_batch()
+    assert daemon.process_batch(messages)
+    # The records of the batch are processed as one trigger event
+    assert agent.events == [{"Records": [RECORD] * 3}]
+    assert os.listdir(spool.processing_dir) == []
+
+
+def test_process_batch_failure(tmp_path):
+    spool = DirectorySpool(str(tmp_path), visibility_timeout=60)
+    write_message(str(tmp_path), "0.json", {"Records": [RECORD]})
+    daemon = EventPayloadDaemon(
+        RecordingAgent(failing_prefix="clicks"), spool, batch_size=10, wait_seconds=0
+    )
+    assert not daemon.process_batch(daemon.receive_batch())
+    # Left claimed until its visibility timeout expires
+    assert os.listdir(spool.processing_dir) == ["0.json"]
+
+
+def test_process_batch_groups_messages_by_dataset(tmp_path):
+    spool = DirectorySpool(str(tmp_path), visibility_timeout=60)
+    message_records = {
+        "0.json": [get_record("clicks/day=1/a.json")],
+        "1.json": [get_record("orders/day=1/a.json")],
+        "2.json": [
+            get_record("refunds/day=1/a.json"),
+            get_record("clicks/day=1/b.json"),
+        ],
+        "3.json": [get_record("orders/day=2/b.json")],
+        "4.json": [get_record("unmatched/a.json")],
+    }
+    for i, (name, records) in enumerate(message_records.items()):
+        write_message(str(tmp_path), name, {"Records": records})
+        # The spool claims messages in modification time order
+        os.utime(tmp_path / name, (i, i))
+    agent = RecordingAgent(failing_prefix="refunds")
+    daemon = EventPayloadDaemon(agent, spool, batch_size=10, wait_seconds=0)
+    assert not daemon.process_batch(daemon.receive_batch())
+    # Messages sharing a dataset are processed together, each group once
+    assert agent.events == [
+        {"Records": message_records["0.json"] + message_records["2.json"]},
+        {"Records": message_records["1.json"] + message_records["3.json"]},
+        {"Records": message_records["4.json"]},
+    ]
+    # Only the messages of the failed group are left to be processed again
+    assert sorted(os.listdir(spool.processing_dir)) == ["0.json", "2.json"]
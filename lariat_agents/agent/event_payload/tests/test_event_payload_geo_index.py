@@ -0,0 +1,126 @@
+import logging
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+from shapely.geometry import LineString, Point
+
+from lariat_agents.agent.event_payload.event_payload_geo_index import (
+    COUNTRY_CODE_COLUMNS,
+    GEO_INVALID_VALUE,
+    GEO_LAYERS,
+    GEO_MISSING_VALUE,
+    get_geo_index,
+    get_snapshot_path,
+    map_country_names_to_alpha3,
+)
+from lariat_agents.agent.event_payload.event_payload_query_builder import (
+    EventPayloadQueryBuilder,
+)
+
+
+def test_every_country_name_maps_to_alpha3():
+    """
+    Every name the country function returns maps to the country's code in the snapshot
+    """
+    layer, name_column = GEO_LAYERS["country"]
+    countries = pd.read_parquet(
+        get_snapshot_path(layer), columns=[name_column] + COUNTRY_CODE_COLUMNS
+    )
+    iso_a3, adm0_a3 = (countries[column] for column in COUNTRY_CODE_COLUMNS)
+    expected = iso_a3.where(iso_a3 != "-99", adm0_a3)
+    codes = map_country_names_to_alpha3(countries[name_column])
+    assert codes.tolist() == expected.tolist()
+    assert map_country_names_to_alpha3(
+        ["Kosovo", "russia", "Atlantis", None]
+    ).tolist() == ["KOS", "RUS", "Atlantis", None]
+
+
+@pytest.mark.parametrize("mode", list(GEO_LAYERS))
+def test_lookup_matches_sjoin_within(mode):
+    """
+    The index finds the same polygon as a spatial join with the within predicate, for points inside
+    polygons, on their borders and outside every polygon
+    """
+    layer, name_column = GEO_LAYERS[mode]
+    polygons = gpd.read_parquet(get_snapshot_path(layer))
+    exteriors = shapely.get_exterior_ring(
+        shapely.get_parts(polygons.geometry.to_numpy())
+    )
+    rng = np.random.default_rng(0)
+    points = np.concatenate(
+        [
+            shapely.point_on_surface(polygons.geometry.to_numpy()),
+            # Polygon vertices and edge midpoints, shared by neighbouring polygons
+            shapely.get_point(exteriors, 0),
+            shapely.line_interpolate_point(exteriors, 0.5, normalized=True),
+            shapely.points([(0, -30), (-150, 0), (60, -50)]),
+            shapely.points(
+                np.column_stack(
+                    [rng.uniform(-180, 180, 500), rng.uniform(-90, 90, 500)]
+                )
+            ),
+        ]
+    )
+    joined = gpd.GeoDataFrame(geometry=points, crs="EPSG:4326").sjoin(
+        polygons[[name_column, "geometry"]], how="left", predicate="within"
+    )
+    # When polygons overlap the first one in the layer is used
+    joined = joined.sort_values("index_right", kind="stable")
+    expected = (
+        joined[~joined.index.duplicated()]
+        .sort_index()[name_column]
+        .fillna(GEO_MISSING_VALUE)
+    )
+    names = get_geo_index(mode).lookup(points)
+    assert names.tolist() == expected.tolist()
+    assert (names == GEO_MISSING_VALUE).any() and (names != GEO_MISSING_VALUE).any()
+
+
+def test_wkb_dimensions(caplog):
+    """
+    The type, state and country dimensions of raw and hex WKB, missing and malformed values
+    """
+    df = pd.DataFrame(
+        {
+            "g": [
+                Point(-104.99, 39.74).wkb,
+                Point(-97.74, 30.27).wkb_hex,
+                None,
+                b"not wkb",
+                Point(0, -30).wkb,
+                LineString([(2.35, 48.85), (2.4, 48.9)]).wkb,
+            ]
+        }
+    )
+    with caplog.at_level(logging.WARNING):
+        df, dimensions = EventPayloadQueryBuilder.setup_dimensions(
+            df, {"wkb": [{"g": ["type", "state", "country"]}]}
+        )
+    assert [record.getMessage() for record in caplog.records] == [
+        "1 values of g aren't valid WKB"
+    ]
+    assert dimensions == ["g_geo_type", "g_geo_state", "g_geo_country"]
+    assert df[dimensions].values.tolist() == [
+        ["Point", "Colorado", "USA"],
+        ["Point", "Texas", "USA"],
+        [GEO_MISSING_VALUE, GEO_MISSING_VALUE, GEO_MISSING_VALUE],
+        [GEO_INVALID_VALUE, GEO_INVALID_VALUE, GEO_INVALID_VALUE],
+        ["Point", GEO_MISSING_VALUE, GEO_MISSING_VALUE],
+        ["LineString", GEO_MISSING_VALUE, "FRA"],
+    ]
+
+
+def test_wkb_dimensions_are_reprojected_from_epsg():
+    """
+    Geometries in the crs given by the epsg option are reprojected before the lookup
+    """
+    # Paris in web mercator
+    df = pd.DataFrame({"g": [Point(261845.7, 6250566.7).wkb]})
+    df, dimensions = EventPayloadQueryBuilder.setup_dimensions(
+        df, {"wkb": [{"g": ["country", {"epsg": 3857}]}]}
+    )
+    assert dimensions == ["g_geo_country"]
+    assert df["g_geo_country"].tolist() == ["FRA"]
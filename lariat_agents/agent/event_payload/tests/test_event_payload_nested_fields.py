@@ -0,0 +1,87 @@
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from lariat_agents.agent.event_payload.event_payload_nested_fields import (
+    extract_array_path,
+    extract_nested_fields,
+    get_values_path,
+    parse_path,
+    to_string_array,
+)
+
+ROWS = [
+    {"attrs": {"k": "x", "n": 1}, "items": [{"sku": "a"}, {"sku": "b"}]},
+    {"attrs": {"k": "y", "n": 2}, "items": [{"sku": "c"}]},
+    {"attrs": None, "items": None},
+    {"attrs": {"n": 3}, "items": []},
+]
+PATHS = {
+    "attrs.k": "attrs.k",
+    "attrs.n": "attrs.n",
+    "first_sku": "items[0].sku",
+    "items[1].sku": "items[1].sku",
+    "attrs.missing": "attrs.missing",
+}
+EXPECTED = {
+    "attrs.k": ["x", "y", None, None],
+    "attrs.n": [1, 2, None, 3],
+    "first_sku": ["a", "c", None, None],
+    "items[1].sku": ["b", None, None, None],
+    "attrs.missing": [None, None, None, None],
+}
+
+
+def test_parse_path():
+    assert parse_path("items[0].sku") == ["items", 0, "sku"]
+    assert parse_path("a.b.c") == ["a", "b", "c"]
+    assert parse_path("a[1][2]") == ["a", 1, 2]
+
+
+def assert_extracted(df):
+    for name, values in EXPECTED.items():
+        assert [None if pd.isna(v) else v for v in df[name]] == values, name
+
+
+@pytest.mark.parametrize("source", ["dataframe", "table"])
+def test_extract_nested_fields(source):
+    table = pa.Table.from_pylist(ROWS)
+    data = table.to_pandas() if source == "dataframe" else table
+    data = extract_nested_fields(data, PATHS)
+    if source == "table":
+        data = data.to_pandas()
+    assert_extracted(data)
+
+
+def test_extract_single_path_and_mixed_types():
+    df = pd.DataFrame(
+        {"attrs": [{"k": "x"}, {"k": 1}, "not an object", None], "other": 1}
+    )
+    df = extract_nested_fields(df, {"attrs.k": "attrs.k"}, {"attrs.k"})
+    assert df["attrs.k"].tolist() == ["x", "1", None, None]
+    df = extract_nested_fields(df, {"k": "attrs.k", "other": "attrs.k"})
+    # Paths that are already columns are aliased, existing columns are left alone
+    assert df["k"].tolist() == ["x", "1", None, None]
+    assert df["other"].tolist() == [1, 1, 1, 1]
+
+
+def test_dimension_values_are_strings():
+    table = pa.Table.from_pylist(ROWS)
+    df = extract_nested_fields(table.to_pandas(), PATHS, {"attrs.n"})
+    assert df["attrs.n"].tolist() == ["1", "2", None, "3"]
+
+
+@pytest.mark.parametrize("as_string", [False, True])
+def test_single_path_walk_matches_arrow(as_string):
+    """
+    Walking the Python objects of a single path gives the values the Arrow extraction gives
+    """
+    values = pa.Table.from_pylist(ROWS).to_pandas()
+    for path in PATHS.values():
+        steps = parse_path(path)
+        root = steps.pop(0)
+        array = extract_array_path(pa.array(values[root], from_pandas=True), steps)
+        if as_string:
+            array = to_string_array(array)
+        walked = get_values_path(values[root].to_numpy(), steps, as_string)
+        assert [None if pd.isna(v) else v for v in walked] == array.to_pylist(), path
@@ -0,0 +1,146 @@
+import threading
+import time
+
+import fsspec
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from lariat_agents.agent.event_payload.event_payload_object import (
+    PayloadObject,
+    PayloadObjectFileSystem,
+)
+
+
+@pytest.fixture
+def payload_file(tmp_path):
+    path = tmp_path / "payload.bin"
+    path.write_bytes(bytes(range(256)) * 40)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def release_payload_objects():
+    yield
+    PayloadObjectFileSystem.release()
+
+
+@pytest.mark.parametrize(
+    "start,end", [(0, 10), (100, 5000), (1000, 10240), (4095, 4097), (9000, 20000)]
+)
+def test_read_range(payload_file, start, end):
+    data = payload_file.read_bytes()
+    payload_object = PayloadObject(
+        f"file://{payload_file}", len(data), data[:64], block_size=1024
+    )
+    assert payload_object.read_range(start, end) == data[start:end]
+
+
+def test_ranges_are_fetched_once(payload_file):
+    """
+    Header bytes are never fetched and cached blocks are not fetched again
+    """
+    data = payload_file.read_bytes()
+    payload_object = PayloadObject(
+        f"file://{payload_file}", len(data), data[:2048], block_size=1024
+    )
+    payload_object.read_range(0, 2048)
+    assert payload_object.fetched_bytes == 0
+    payload_object.read_range(5000, 7000)
+    payload_object.read_range(5500, 6000)
+    assert payload_object.fetched_bytes == 3 * 1024
+    payload_object.read_range(0, len(data))
+    assert payload_object.fetched_bytes == len(data)
+
+
+def test_cache_eviction(payload_file):
+    data = payload_file.read_bytes()
+    payload_object = PayloadObject(
+        f"file://{payload_file}", len(data), block_size=1024, cache_bytes=2048
+    )
+    assert payload_object.read_range(0, len(data)) == data
+    assert len(payload_object.blocks) == 2
+    assert payload_object.read_range(0, 100) == data[:100]
+    assert payload_object.fetched_bytes == len(data) + 1024
+
+
+def test_concurrent_reads_fetch_in_parallel(payload_file):
+    """
+    Disjoint ranges read by two threads are fetched at the same time, not one after the other
+    """
+    data = payload_file.read_bytes()
+    payload_object = PayloadObject(f"file://{payload_file}", len(data), block_size=1024)
+    both_in_flight = threading.Barrier(2, timeout=5)
+    fetch = payload_object.fetch
+
+    def fetch_when_both_in_flight(start, end):
+        # Raises BrokenBarrierError if the other fetch can't start while this one is in flight
+        both_in_flight.wait()
+        return fetch(start, end)
+
+    payload_object.fetch = fetch_when_both_in_flight
+    results = {}
+    threads = [
+        threading.Thread(
+            target=lambda r=r: results.__setitem__(r, payload_object.read_range(*r))
+        )
+        for r in [(0, 3000), (6000, 9000)]
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {(0, 3000): data[:3000], (6000, 9000): data[6000:9000]}
+    assert payload_object.fetched_bytes == 7 * 1024
+
+
+def test_blocks_in_flight_are_fetched_once(payload_file):
+    data = payload_file.read_bytes()
+    payload_object = PayloadObject(f"file://{payload_file}", len(data), block_size=1024)
+    fetched = []
+    fetch = payload_object.fetch
+
+    def slow_fetch(start, end):
+        fetched.append((start, end))
+        time.sleep(0.2)
+        return fetch(start, end)
+
+    payload_object.fetch = slow_fetch
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(payload_object.read_range(100, 2000))
+        )
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    for thread in threads:
+        thread.join()
+    assert results == [data[100:2000]] * 2
+    assert fetched == [(0, 2048)]
+
+
+def test_readers_share_the_payload_object(tmp_path):
+    df = pd.DataFrame({"a": np.arange(1000), "b": np.arange(1000) * 0.5})
+    path = tmp_path / "payload.parquet"
+    df.to_parquet(path, row_group_size=100)
+    size = path.stat().st_size
+    payload_object = PayloadObject(
+        f"file://{path}", size, path.read_bytes()[:4096], block_size=1024
+    )
+    url = PayloadObjectFileSystem.register(payload_object)
+    assert url.startswith("lariatpayload://")
+
+    with fsspec.open(url) as f:
+        assert pq.read_schema(f).names == ["a", "b"]
+    pd.testing.assert_frame_equal(pd.read_parquet(url), df)
+    fetched_bytes = payload_object.fetched_bytes
+    pd.testing.assert_frame_equal(pd.read_parquet(url, columns=["b"]), df[["b"]])
+    assert payload_object.fetched_bytes == fetched_bytes <= size
+
+    PayloadObjectFileSystem.release()
+    with pytest.raises(FileNotFoundError):
+        pd.read_parquet(url)
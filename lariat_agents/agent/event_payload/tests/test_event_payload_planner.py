@@ -0,0 +1,99 @@
+import gzip
+import json
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from lariat_agents.agent.event_payload.event_payload_planner import (
+    ExecutionPlan,
+    plan_execution,
+    rechunk,
+)
+from lariat_agents.agent.event_payload.event_payload_types import (
+    CompressionType,
+    ExecutionEngine,
+    SupportedPayloadFormat,
+)
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def jsonl_payload():
+    return b"".join(
+        json.dumps({"id": i, "country": "US", "value": i * 0.5}).encode() + b"\n"
+        for i in range(20000)
+    )
+
+
+def test_small_payload_is_batched(tmp_path, jsonl_payload):
+    path = tmp_path / "payload.jsonl"
+    path.write_bytes(jsonl_payload)
+    plan = plan_execution(
+        f"file://{path}",
+        SupportedPayloadFormat.JSONL,
+        len(jsonl_payload),
+        memory_budget=512 * MB,
+    )
+    assert not plan.streaming
+    assert plan.row_bytes > 0
+
+
+def test_large_payload_is_streamed_within_budget(tmp_path, jsonl_payload):
+    path = tmp_path / "payload.jsonl"
+    path.write_bytes(jsonl_payload)
+    content_length = 200 * len(jsonl_payload)
+    plan = plan_execution(
+        f"file://{path}",
+        SupportedPayloadFormat.JSONL,
+        content_length,
+        engine=ExecutionEngine.ARROW,
+        memory_budget=64 * MB,
+    )
+    assert plan.streaming
+    assert plan.engine == ExecutionEngine.ARROW
+    assert plan.chunksize * plan.row_bytes <= plan.chunk_budget
+
+
+def test_compressed_size_is_estimated_from_the_sample(tmp_path, jsonl_payload):
+    compressed = gzip.compress(jsonl_payload)
+    path = tmp_path / "payload.jsonl.gz"
+    path.write_bytes(compressed)
+    (tmp_path / "payload.jsonl").write_bytes(jsonl_payload)
+    plain_plan = plan_execution(
+        f"file://{tmp_path / 'payload.jsonl'}",
+        SupportedPayloadFormat.JSONL,
+        len(jsonl_payload),
+    )
+    compressed_plan = plan_execution(
+        f"file://{path}",
+        SupportedPayloadFormat.JSONL,
+        len(compressed),
+        CompressionType.GZIP,
+    )
+    assert compressed_plan.decoded_bytes == pytest.approx(
+        plain_plan.decoded_bytes, rel=0.1
+    )
+
+
+def test_json_is_never_streamed(tmp_path):
+    path = tmp_path / "payload.json"
+    path.write_bytes(b"[]")
+    plan = plan_execution(
+        f"file://{path}",
+        SupportedPayloadFormat.JSON,
+        10 * 1024 * MB,
+        memory_budget=64 * MB,
+    )
+    assert not plan.streaming
+
+
+@pytest.mark.parametrize("arrow", [False, True])
+def test_rechunk_splits_chunks_larger_than_the_measured_chunk_size(arrow):
+    df = pd.DataFrame({"value": range(100000)})
+    chunks = [pa.Table.from_pandas(df) if arrow else df]
+    plan = ExecutionPlan(memory_budget=3 * 8 * 10000 * 3)
+    rechunked = list(rechunk(chunks, plan))
+    assert len(rechunked) > 1
+    assert sum(len(chunk) for chunk in rechunked) == len(df)
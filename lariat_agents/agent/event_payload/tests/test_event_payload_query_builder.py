@@ -0,0 +1,463 @@
+import json
+
+import fsspec
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from fsspec.implementations.local import LocalFileOpener, LocalFileSystem
+
+from lariat_agents.agent.event_payload import (
+    event_payload_planner,
+    event_payload_query_builder,
+)
+from lariat_agents.agent.event_payload.event_payload_query_builder import (
+    EventPayloadQueryBuilder,
+)
+from lariat_agents.agent.event_payload.event_payload_types import (
+    ExecutionEngine,
+    SupportedPayloadFormat,
+)
+from lariat_agents.constants import (
+    FRESHNESS_BUCKET_EDGES,
+    FRESHNESS_BUCKET_LABELS,
+    FRESHNESS_MISSING_LABEL,
+)
+
+TIMESTAMP_MAPPINGS = {"ts": {"column": "ts", "format": "unixtime", "primary": True}}
+
+
+def run_query_builder(path, file_type, engine=ExecutionEngine.PANDAS, **kwargs):
+    return EventPayloadQueryBuilder(query_builder_type="event_payload").run(
+        f"file://{path}",
+        {"day": "1"},
+        None,
+        file_type,
+        [],
+        ["value"],
+        TIMESTAMP_MAPPINGS,
+        ["country"],
+        "source_id",
+        "dataset",
+        ("bucket", "key"),
+        path.stat().st_size,
+        engine,
+        **kwargs,
+    )
+
+
+@pytest.mark.parametrize("engine", [ExecutionEngine.PANDAS, ExecutionEngine.ARROW])
+@pytest.mark.parametrize("memory_budget", [2**30, 1])
+def test_csv_columns_are_projected_while_reading(
+    tmp_path, monkeypatch, engine, memory_budget
+):
+    """
+    The schema of a csv payload comes from the planner's sample, so only the referenced columns are read
+    """
+    path = tmp_path / "payload.csv"
+    pd.DataFrame(
+        {
+            "country": ["US", "FR", "US"] * 100,
+            "value": range(300),
+            "unused": ["x"] * 300,
+            "ts": range(1700000000, 1700000300),
+        }
+    ).to_csv(path, index=False)
+    read_columns = []
+    select_source_columns = EventPayloadQueryBuilder.select_source_columns
+
+    def spy(chunk, source_columns):
+        read_columns.append(list(getattr(chunk, "column_names", chunk.columns)))
+        return select_source_columns(chunk, source_columns)
+
+    monkeypatch.setattr(
+        EventPayloadQueryBuilder, "select_source_columns", staticmethod(spy)
+    )
+    output_df, _, _, _, clean_schema = run_query_builder(
+        path, SupportedPayloadFormat.CSV, engine, memory_budget=memory_budget
+    )
+    assert read_columns and all(
+        sorted(columns) == ["country", "ts", "value"] for columns in read_columns
+    )
+    assert set(clean_schema["properties"]) == {
+        "country",
+        "value",
+        "unused",
+        "ts",
+        "day",
+    }
+    assert output_df["total_record_count"].unique().tolist() == [300]
+
+
+PAYLOAD_TIMESTAMP_MAPPINGS = {
+    "created": {"column": "created", "format": "%Y-%m-%d %H:%M", "primary": True},
+    "sent": {"column": "sent", "format": "%Y-%m-%d %H:%M:%S", "freshness": True},
+}
+
+
+def write_payload(path, file_type):
+    """
+    Payload with padded, empty and missing dimension values, numbers with nulls, a primary timestamp at minute
+    precision and a freshness timestamp in every bucket
+    """
+    rng = np.random.default_rng(0)
+    size = 300
+    created = pd.Timestamp("2024-03-01 10:00:00") + pd.to_timedelta(
+        rng.integers(0, 600, size), unit="min"
+    )
+    # Minutes between the primary and freshness timestamps, away from the bucket edges. Missing timestamps
+    # aren't compared: pandas converts NaT to the int64 minimum where duckdb keeps nulls
+    sent_offsets = rng.choice([-120, -30, 2.5, 7, 15, 25, 45, 90, 150, 300, 2000], size)
+    sent = (created - pd.to_timedelta(sent_offsets, unit="min")).strftime(
+        "%Y-%m-%d %H:%M:%S"
+    )
+    df = pd.DataFrame(
+        {
+            "country": rng.choice(["US", " FR", "FR", "", None, "DE"], size),
+            "device": rng.choice(["ios", "android"], size),
+            "label": rng.choice(["a", "b", None], size),
+            "value": np.where(
+                rng.random(size) < 0.1, np.nan, rng.integers(0, 100, size)
+            ),
+            "amount": rng.normal(size=size).round(3),
+            "created": created.strftime("%Y-%m-%d %H:%M"),
+            "sent": sent,
+        }
+    )
+    if file_type == SupportedPayloadFormat.JSONL:
+        rows = df.astype(object).where(df.notna(), None).to_dict("records")
+        path.write_text("".join(json.dumps(row) + "\n" for row in rows))
+    elif file_type == SupportedPayloadFormat.CSV:
+        df.to_csv(path, index=False)
+    else:
+        df.to_parquet(path)
+
+
+def run_payload(path, file_type, engine, **kwargs):
+    """
+    :return: the results sorted by dimensions without the execution time, the primary time column, the
+    dimensions and the schema
+    """
+    (
+        output_df,
+        _,
+        primary_time_col,
+        dimensions,
+        clean_schema,
+    ) = EventPayloadQueryBuilder(query_builder_type="event_payload").run(
+        f"file://{path}",
+        {"day": "1"},
+        None,
+        file_type,
+        ["label"],
+        ["value", "amount"],
+        PAYLOAD_TIMESTAMP_MAPPINGS,
+        ["country", "device"],
+        "source_id",
+        "dataset",
+        ("bucket", "key"),
+        path.stat().st_size,
+        engine,
+        **kwargs,
+    )
+    dimension_cols = [col for col in output_df.columns if col.startswith("dim|")]
+    output_df = (
+        output_df.drop(
+            columns=["time|lariat_agent_execution_time", "lariat_agent_execution_time"]
+        )
+        .sort_values(dimension_cols)
+        .reset_index(drop=True)
+    )
+    return output_df, primary_time_col, dimensions, clean_schema
+
+
+@pytest.mark.parametrize(
+    "file_type",
+    [
+        SupportedPayloadFormat.JSONL,
+        SupportedPayloadFormat.CSV,
+        SupportedPayloadFormat.PARQUET,
+    ],
+)
+def test_duckdb_engine_matches_pandas(tmp_path, file_type):
+    """
+    The duckdb engine reports the same aggregations and schema as the pandas engine
+    """
+    path = tmp_path / f"payload.{file_type.value}"
+    write_payload(path, file_type)
+    pandas_df, *pandas_metadata = run_payload(path, file_type, ExecutionEngine.PANDAS)
+    duckdb_df, *duckdb_metadata = run_payload(path, file_type, ExecutionEngine.DUCKDB)
+    assert pandas_df["dim|country"].unique().tolist() == ["<empty>", "DE", "FR", "US"]
+    assert pandas_df["dim|sent_freshness"].nunique() == 11
+    assert list(duckdb_df.columns) == list(pandas_df.columns)
+    pd.testing.assert_frame_equal(duckdb_df, pandas_df, check_dtype=False)
+    assert duckdb_metadata == pandas_metadata
+
+
+@pytest.mark.parametrize(
+    "file_type",
+    [
+        SupportedPayloadFormat.JSONL,
+        SupportedPayloadFormat.CSV,
+        SupportedPayloadFormat.PARQUET,
+    ],
+)
+@pytest.mark.parametrize("memory_budget", [2**30, 1])
+def test_arrow_engine_matches_pandas(tmp_path, file_type, memory_budget):
+    """
+    The arrow aggregations (count, sum, mean, std, ...) grouped on several dimensions, some of them missing,
+    match the pandas ones, in one batch and merged from streamed chunks
+    """
+    path = tmp_path / f"payload.{file_type.value}"
+    write_payload(path, file_type)
+    pandas_df, *pandas_metadata = run_payload(
+        path, file_type, ExecutionEngine.PANDAS, memory_budget=memory_budget
+    )
+    arrow_df, *arrow_metadata = run_payload(
+        path, file_type, ExecutionEngine.ARROW, memory_budget=memory_budget
+    )
+    assert pandas_df["dim|country"].unique().tolist() == ["<empty>", "DE", "FR", "US"]
+    assert list(arrow_df.columns) == list(pandas_df.columns)
+    pd.testing.assert_frame_equal(arrow_df, pandas_df, check_dtype=False)
+    assert arrow_metadata == pandas_metadata
+
+
+def select_freshness_labels(time_diff):
+    """
+    Freshness labels as they were selected with np.select
+    """
+    conditions_labels = [
+        (time_diff < -60, "future: >1 hour"),
+        ((time_diff >= -60) & (time_diff < 0), "future: 0-1 hour"),
+        ((time_diff >= 0) & (time_diff <= 5), "0-5min"),
+        ((time_diff > 5) & (time_diff <= 10), "5-10min"),
+        ((time_diff > 10) & (time_diff <= 20), "10-20min"),
+        ((time_diff > 20) & (time_diff <= 30), "20-30min"),
+        ((time_diff > 30) & (time_diff <= 60), "30-60min"),
+        ((time_diff > 60) & (time_diff <= 120), "1-2h"),
+        ((time_diff > 120) & (time_diff <= 180), "2-3h"),
+        ((time_diff > 180) & (time_diff <= 1440), "3-24h"),
+        (time_diff > 1440, ">24h"),
+    ]
+    conditions, labels = zip(*conditions_labels)
+    # The numpy versions it ran with stringified the default 0
+    return np.select(conditions, labels, default="0")
+
+
+def test_freshness_codes_match_np_select():
+    """
+    Bucket edges belong to the same buckets as with np.select, and missing differences get the missing label
+    """
+    edges = np.array(FRESHNESS_BUCKET_EDGES, dtype=np.float64)
+    time_diff = np.concatenate(
+        [edges, edges - 0.01, edges + 0.01, [-1e9, 1e9, -0.0, np.nan]]
+    )
+    codes = EventPayloadQueryBuilder.get_freshness_codes(
+        time_diff, FRESHNESS_BUCKET_EDGES
+    )
+    df = EventPayloadQueryBuilder.label_freshness(
+        pd.DataFrame({"sent_freshness": codes}),
+        {"sent": {"column": "sent", "format": "unixtime", "freshness": True}},
+        ["sent_freshness"],
+    )
+    assert df["sent_freshness"].tolist() == select_freshness_labels(time_diff).tolist()
+    assert df["sent_freshness"].iloc[-1] == FRESHNESS_MISSING_LABEL
+    assert set(df["sent_freshness"]) == set(FRESHNESS_BUCKET_LABELS) | {
+        FRESHNESS_MISSING_LABEL
+    }
+
+
+def parse_timestamps_per_row(values, format_str):
+    """
+    Latest and earliest unix times of every row, parsing each row's value
+    """
+    parsed = pd.to_datetime(values.astype("string").str.strip(), format=format_str)
+    df = pd.DataFrame({"ts": parsed.dt.tz_localize("UTC")})
+    return [
+        EventPayloadQueryBuilder.adjust_date_precision(
+            df, format_str, "ts", max_or_min
+        ).astype("int64")
+        // 10**9
+        for max_or_min in ["max", "min"]
+    ]
+
+
+def test_timestamps_parsed_once_match_per_row_parse():
+    """
+    Timestamps repeated across many rows, padded or missing, and templated from several columns parse to the
+    same times as parsing every row
+    """
+    rng = np.random.default_rng(0)
+    size = 2000
+    df = pd.DataFrame(
+        {
+            "created": rng.choice(
+                ["2024-03-01 10:00", " 2024-03-01 10:00 ", "2024-12-31 23:59", None],
+                size,
+            ),
+            "dt": rng.choice(["2024-03-01", "2024-02-29", None], size),
+            "hr": rng.choice(["00", "09", "23", None], size),
+        }
+    )
+    timestamp_mappings = {
+        "created": {"column": "created", "format": "%Y-%m-%d %H:%M", "primary": True},
+        "hour": {"column": "{dt} {hr}", "format": "%Y-%m-%d %H"},
+    }
+    created = df["created"].copy()
+    hour = df["dt"] + " " + df["hr"]
+    EventPayloadQueryBuilder.set_df_timestamp_vars(df, timestamp_mappings, 1700000000)
+    for key, values in [("created", created), ("hour", hour)]:
+        format_str = timestamp_mappings[key]["format"]
+        expected_max, expected_min = parse_timestamps_per_row(values, format_str)
+        assert df[f"max_{key}"].tolist() == expected_max.tolist()
+        assert df[f"min_{key}"].tolist() == expected_min.tolist()
+
+    codes, uniques = EventPayloadQueryBuilder.factorize_template(
+        [(df["dt"], " "), (df["hr"], "")]
+    )
+    assert len(uniques) == 6
+    assert (codes == -1).tolist() == hour.isna().tolist()
+    assert uniques.take(codes[codes >= 0]).tolist() == hour.dropna().tolist()
+
+
+def test_arrow_engine_streams_jsonl_in_blocks(tmp_path, monkeypatch):
+    """
+    A streamed jsonl payload is parsed by the arrow engine a block of lines at a time, never as a whole
+    """
+    path = tmp_path / "payload.jsonl"
+    write_payload(path, SupportedPayloadFormat.JSONL)
+    block_bytes = 4096
+    monkeypatch.setattr(
+        event_payload_query_builder, "STREAMING_JSON_BLOCK_BYTES", block_bytes
+    )
+    parsed_sizes = []
+    read_json = event_payload_query_builder.pa_json.read_json
+
+    def spy(source, *args, **kwargs):
+        parsed_sizes.append(len(source.getbuffer()))
+        return read_json(source, *args, **kwargs)
+
+    monkeypatch.setattr(event_payload_query_builder.pa_json, "read_json", spy)
+    arrow_df, *arrow_metadata = run_payload(
+        path, SupportedPayloadFormat.JSONL, ExecutionEngine.ARROW, memory_budget=1
+    )
+    assert len(parsed_sizes) > 1
+    assert sum(parsed_sizes) == path.stat().st_size
+    assert max(parsed_sizes) < 2 * block_bytes
+    monkeypatch.undo()
+    pandas_df, *pandas_metadata = run_payload(
+        path, SupportedPayloadFormat.JSONL, ExecutionEngine.PANDAS, memory_budget=1
+    )
+    pd.testing.assert_frame_equal(arrow_df, pandas_df, check_dtype=False)
+    assert arrow_metadata == pandas_metadata
+
+
+def test_parallel_streaming_matches_batch(tmp_path, monkeypatch):
+    """
+    Chunks computed out of order by a pool of workers merge to the batch output
+    """
+    path = tmp_path / "payload.jsonl"
+    write_payload(path, SupportedPayloadFormat.JSONL)
+    parallel_outputs = []
+    calculate_chunks_in_parallel = EventPayloadQueryBuilder.calculate_chunks_in_parallel
+
+    def spy(self, *args, **kwargs):
+        for output in calculate_chunks_in_parallel(self, *args, **kwargs):
+            parallel_outputs.append(output)
+            yield output
+
+    monkeypatch.setattr(EventPayloadQueryBuilder, "calculate_chunks_in_parallel", spy)
+    monkeypatch.setattr(event_payload_planner, "STREAMING_MIN_CHUNKSIZE", 20)
+    parallel_df, *parallel_metadata = run_payload(
+        path,
+        SupportedPayloadFormat.JSONL,
+        ExecutionEngine.PANDAS,
+        workers=3,
+        memory_budget=1,
+    )
+    # More chunks than can be in flight so chunks wait for a free worker
+    assert len(parallel_outputs) == 15
+    batch_df, *batch_metadata = run_payload(
+        path, SupportedPayloadFormat.JSONL, ExecutionEngine.PANDAS
+    )
+    pd.testing.assert_frame_equal(parallel_df, batch_df, check_dtype=False)
+    assert parallel_metadata == batch_metadata
+
+
+class RecordingFileOpener(LocalFileOpener):
+    def read(self, size=-1):
+        start = self.tell()
+        data = super().read(size)
+        self.fs.read_ranges.append((start, start + len(data)))
+        return data
+
+    def readinto(self, b):
+        start = self.tell()
+        size = super().readinto(b)
+        self.fs.read_ranges.append((start, start + size))
+        return size
+
+
+class RecordingFileSystem(LocalFileSystem):
+    """
+    Local filesystem recording the byte ranges read from its files
+    """
+
+    cachable = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.read_ranges = []
+
+    def _open(self, path, mode="rb", block_size=None, **kwargs):
+        return RecordingFileOpener(path, mode, fs=self, **kwargs)
+
+
+def test_parquet_reads_only_matching_row_groups_and_projected_columns(
+    tmp_path, monkeypatch
+):
+    """
+    Row groups whose statistics can't match the filters and the columns that aren't used are never read
+    """
+    path = tmp_path / "payload.parquet"
+    rows = 20000
+    rng = np.random.default_rng(0)
+    pd.DataFrame(
+        {
+            "id": np.arange(rows),
+            "label": rng.random(rows),
+            "value": rng.random(rows),
+            "amount": rng.random(rows),
+        }
+    ).to_parquet(path, row_group_size=5000, compression=None)
+    filesystem = RecordingFileSystem()
+    monkeypatch.setattr(
+        fsspec.core, "url_to_fs", lambda url, **kwargs: (filesystem, str(path))
+    )
+    tables = list(
+        EventPayloadQueryBuilder.get_parquet_tables(
+            f"file://{path}", {"id", "value"}, [["id", ">=", 12000]]
+        )
+    )
+    assert [table.num_rows for table in tables] == [3000, 5000]
+    assert all(table.column_names == ["id", "value"] for table in tables)
+    assert pd.concat([table.to_pandas() for table in tables])["id"].tolist() == list(
+        range(12000, rows)
+    )
+    # Reads up to the end of the file are the footer's
+    file_size = path.stat().st_size
+    read_ranges = [
+        (start, end) for start, end in filesystem.read_ranges if end != file_size
+    ]
+    metadata = pq.ParquetFile(path).metadata
+    for row_group in range(metadata.num_row_groups):
+        for column in range(metadata.num_columns):
+            column_chunk = metadata.row_group(row_group).column(column)
+            start = column_chunk.dictionary_page_offset or column_chunk.data_page_offset
+            end = start + column_chunk.total_compressed_size
+            read = any(
+                read_start < end and start < read_end
+                for read_start, read_end in read_ranges
+            )
+            expected = row_group >= 2 and column_chunk.path_in_schema in {"id", "value"}
+            assert read == expected, (row_group, column_chunk.path_in_schema)
@@ -0,0 +1,68 @@
+from lariat_agents.agent.event_payload.event_payload_routing import RoutingIndex
+
+AGENT_CONFIG = {
+    "source_id": "test",
+    "buckets": {
+        "events": [
+            {
+                "name": "clicks_eu",
+                "prefix": "clicks/eu",
+                "suffix_template": "{year}/{month}",
+                "file_type": "jsonl",
+            },
+            {
+                "name": "clicks",
+                "prefix": "clicks",
+                "suffix_template": "<region>/{year}",
+                "file_type": "jsonl",
+            },
+            {
+                "name": "orders",
+                "prefix": "orders/",
+                "suffix_template": "<day>",
+                "file_type": "parquet",
+            },
+        ],
+        "archive": [
+            {
+                "name": "clicks",
+                "prefix": "",
+                "suffix_template": "<day>",
+                "file_type": "csv",
+            },
+        ],
+    },
+}
+
+
+def test_first_matching_config_in_order_wins():
+    routing_index = RoutingIndex(AGENT_CONFIG)
+    config, partition_fields = routing_index.route(
+        "events", "clicks/eu/year=2024/month=01/part-0.json"
+    )
+    assert config["name"] == "clicks_eu"
+    assert partition_fields == {"year": "2024", "month": "01"}
+
+
+def test_falls_back_to_a_shorter_prefix_when_the_suffix_does_not_match():
+    routing_index = RoutingIndex(AGENT_CONFIG)
+    config, partition_fields = routing_index.route(
+        "events", "clicks/us/year=2024/part-0.json"
+    )
+    assert config["name"] == "clicks"
+    assert partition_fields == {"region": "us", "year": "2024"}
+
+
+def test_unmatched_objects():
+    routing_index = RoutingIndex(AGENT_CONFIG)
+    assert routing_index.route("events", "refunds/2024/part-0.json") == (None, None)
+    assert routing_index.route("unknown", "clicks/eu/part-0.json") == (None, None)
+    assert routing_index.route("events", "orders/") == (None, None)
+
+
+def test_dataset_config_by_name():
+    routing_index = RoutingIndex(AGENT_CONFIG)
+    assert routing_index.get_dataset_config("orders")["file_type"] == "parquet"
+    # Same name in several buckets: the first config wins, as when the configs were scanned in order
+    assert routing_index.get_dataset_config("clicks")["file_type"] == "jsonl"
+    assert routing_index.get_dataset_config("refunds") is None
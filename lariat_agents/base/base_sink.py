@@ -10,6 +10,9 @@ class BaseSink(ABC):
     Datadog or Grafana directly.
     """
 
+    # Extension of the result files written by the sink
+    file_extension = "csv"
+
     def __init__(self, source_cloud: str, supports_tags: bool = False):
         """
         :param source_cloud: cloud environment that the batch_base sink is operating in
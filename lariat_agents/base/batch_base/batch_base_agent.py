@@ -55,7 +55,7 @@ import time
 import lariat_python_common.sql.utils as lariat_sql_utils
 import datetime
 from lariat_agents.base.batch_base.batch_base_query_builder import BatchBaseQueryBuilder
-from lariat_agents.sink.lariat_sink import LariatSink
+from lariat_agents.sink.lariat_sink import LariatSink, get_lariat_sink_args
 from lariat_agents.sink.datadog_sink import DatadogSink
 import sqlparse
 from io import StringIO
@@ -133,7 +133,9 @@ class BatchBaseAgent(ABC):
             sink_type = list(self.yaml_config[SINK_TYPE].keys())[0]
             sink_args = self.yaml_config[SINK_TYPE][sink_type]
             if sink_type == LARIAT_SINK_TYPE:
-                self.sink = LariatSink(source_cloud=self._cloud)
+                self.sink = LariatSink(
+                    source_cloud=self._cloud, **get_lariat_sink_args(sink_args)
+                )
             elif sink_type == DATADOG_SINK_TYPE:
                 self.query_builder.sketch_mode = False
                 self.sink = DatadogSink(source_cloud=self._cloud, **sink_args)
@@ -37,7 +37,7 @@ import lariat_python_common.sql.utils as lariat_sql_utils
 from lariat_agents.base.streaming_base.streaming_base_query_builder import (
     StreamingBaseQueryBuilder,
 )
-from lariat_agents.sink.lariat_sink import LariatSink
+from lariat_agents.sink.lariat_sink import LariatSink, get_lariat_sink_args
 from lariat_agents.sink.datadog_sink import DatadogSink
 import sqlparse
 from google.cloud import storage
@@ -112,7 +112,9 @@ class StreamingBaseAgent(ABC):
             sink_type = list(self.yaml_config[SINK_TYPE].keys())[0]
             sink_args = self.yaml_config[SINK_TYPE][sink_type]
             if sink_type == LARIAT_SINK_TYPE:
-                self.sink = LariatSink(source_cloud=self._cloud)
+                self.sink = LariatSink(
+                    source_cloud=self._cloud, **get_lariat_sink_args(sink_args)
+                )
             elif sink_type == DATADOG_SINK_TYPE:
                 self.query_builder.sketch_mode = False
                 self.sink = DatadogSink(source_cloud=self._cloud, **sink_args)
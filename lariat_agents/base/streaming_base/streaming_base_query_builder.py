@@ -44,7 +44,7 @@ class StreamingBaseQueryBuilder(ABC):
         parquet file read from s3)
         :param fsspec_name:
         :param partition_fields_in_data:
-        :param clean_schema:
+        :param clean_schema: schema of the payload, or None to infer it while reading the payload
         :param file_type:
         :param string_columns:
         :param numeric_columns:
@@ -54,6 +54,6 @@ class StreamingBaseQueryBuilder(ABC):
         :param dataset_name:
         :param location_info:
         :param content_length:
-        :return:
+        :return: results, execution time, primary time column, dimensions and the payload schema
         """
         pass
@@ -0,0 +1,137 @@
+"""
+    Micro-batched writing of streaming results.
+    Result frames are buffered per output prefix (e.g. a dataset's prefix) and written as one object when the
+    buffer reaches a row count, byte size or age threshold, or when the writer is flushed at the end of an
+    invocation. Objects keep the year=/month=/day=/hour=/minute= layout, partitioned by the time the first
+    frame of the buffer was added.
+"""
+import hashlib
+import logging
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from lariat_agents.constants import (
+    STREAMING_RESULT_MAX_AGE_SECONDS,
+    STREAMING_RESULT_MAX_BYTES,
+    STREAMING_RESULT_MAX_ROWS,
+)
+
+
+def get_result_partition_path(key_prefix, ingestion_time: datetime):
+    return (
+        f"{key_prefix.strip('/')}/"
+        f"year={ingestion_time.year}/month={str(ingestion_time.month).zfill(2)}/"
+        f"day={str(ingestion_time.day).zfill(2)}/hour={str(ingestion_time.hour).zfill(2)}/"
+        f"minute={str(ingestion_time.minute).zfill(2)}/"
+    )
+
+
+class ResultBuffer:
+    def __init__(self, key_prefix):
+        self.key_prefix = key_prefix
+        self.ingestion_time = datetime.utcnow()
+        self.created_at = time.monotonic()
+        self.frames = []
+        self.source_keys = []
+        self.rows = 0
+        self.bytes = 0
+
+    def add(self, result_df: pd.DataFrame, source_keys):
+        self.frames.append(result_df)
+        self.source_keys.extend(source_keys)
+        self.rows += len(result_df)
+        self.bytes += int(result_df.memory_usage(deep=True, index=False).sum())
+
+    @property
+    def age(self):
+        return time.monotonic() - self.created_at
+
+    def get_file_path(self, file_extension="csv"):
+        hash_object = hashlib.sha1("\n".join(self.source_keys).encode())
+        return Path(
+            get_result_partition_path(self.key_prefix, self.ingestion_time),
+            f"result_{str(hash_object.hexdigest())}_{int(time.time())}.{file_extension}",
+        ).as_posix()
+
+
+class StreamingResultWriter:
+    """
+    Buffers result frames per output prefix and writes each buffer as a single object once it holds max_rows
+    rows or max_bytes bytes, or was opened more than max_age_seconds ago. Thresholds are checked when frames are
+    added (see flush_expired to check the age alone), remaining buffers are written by flush.
+    """
+
+    def __init__(
+        self,
+        write,
+        max_rows=STREAMING_RESULT_MAX_ROWS,
+        max_bytes=STREAMING_RESULT_MAX_BYTES,
+        max_age_seconds=STREAMING_RESULT_MAX_AGE_SECONDS,
+        file_extension="csv",
+    ):
+        """
+        :param write: called with the concatenated results and the file path of each flushed buffer
+        (e.g. StreamingBaseAgent.write_data)
+        :param max_rows: rows a buffer holds before it is written
+        :param max_bytes: in memory bytes a buffer holds before it is written
+        :param max_age_seconds: seconds a buffer is kept before it is written
+        :param file_extension: extension of the written objects (see BaseSink.file_extension)
+        """
+        self.write = write
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.file_extension = file_extension
+        self.buffers = {}
+
+    def add(self, key_prefix, result_df: pd.DataFrame, source_keys=()):
+        """
+        Buffer results under an output prefix
+        :param key_prefix: output prefix the results are written under, before the time partitions
+        :param result_df:
+        :param source_keys: keys of the objects the results were computed from, they name the written object
+        """
+        if result_df is None or result_df.empty:
+            return
+        buffer = self.buffers.get(key_prefix)
+        if buffer is None:
+            buffer = self.buffers[key_prefix] = ResultBuffer(key_prefix)
+        buffer.add(result_df, source_keys)
+        if self.is_full(buffer):
+            self.flush_buffer(key_prefix)
+
+    def is_full(self, buffer: ResultBuffer):
+        return (
+            buffer.rows >= self.max_rows
+            or buffer.bytes >= self.max_bytes
+            or buffer.age >= self.max_age_seconds
+        )
+
+    def flush_buffer(self, key_prefix):
+        buffer = self.buffers.pop(key_prefix)
+        file_path = buffer.get_file_path(self.file_extension)
+        logging.info(
+            f"Writing {buffer.rows} result rows of {len(buffer.frames)} frames to {file_path}"
+        )
+        self.write(pd.concat(buffer.frames, ignore_index=True), file_path)
+
+    def flush_expired(self):
+        """
+        Write the buffers older than max_age_seconds
+        """
+        for key_prefix in [
+            key_prefix
+            for key_prefix, buffer in self.buffers.items()
+            if buffer.age >= self.max_age_seconds
+        ]:
+            self.flush_buffer(key_prefix)
+
+    def flush(self):
+        """
+        Write every buffer
+        """
+        for key_prefix in list(self.buffers):
+            self.flush_buffer(key_prefix)
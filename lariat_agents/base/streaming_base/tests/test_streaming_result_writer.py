@@ -0,0 +1,65 @@
+import re
+
+import pandas as pd
+
+from lariat_agents.base.streaming_base.streaming_result_writer import (
+    StreamingResultWriter,
+)
+
+PREFIX = "streaming_events/api_key=k/source_id=s/dataset=clicks"
+
+
+def get_writer(**kwargs):
+    written = []
+    writer = StreamingResultWriter(
+        lambda result_df, file_path: written.append((result_df, file_path)),
+        **{"max_rows": 1000, "max_bytes": 1024**3, "max_age_seconds": 3600, **kwargs},
+    )
+    return writer, written
+
+
+def test_results_are_buffered_until_flushed():
+    writer, written = get_writer()
+    for i in range(3):
+        writer.add(PREFIX, pd.DataFrame({"value": [i, i]}), [f"key-{i}"])
+    writer.add(PREFIX, pd.DataFrame({"value": []}), ["empty"])
+    assert written == []
+    writer.flush()
+    assert len(written) == 1
+    result_df, file_path = written[0]
+    assert result_df["value"].tolist() == [0, 0, 1, 1, 2, 2]
+    assert re.fullmatch(
+        rf"{PREFIX}/year=\d{{4}}/month=\d\d/day=\d\d/hour=\d\d/minute=\d\d/result_[0-9a-f]{{40}}_\d+\.csv",
+        file_path,
+    )
+    writer.flush()
+    assert len(written) == 1
+
+
+def test_buffers_are_written_at_the_row_threshold():
+    writer, written = get_writer(max_rows=4)
+    for i in range(5):
+        writer.add(PREFIX, pd.DataFrame({"value": [i, i]}))
+        writer.add("other", pd.DataFrame({"value": [i]}))
+    assert [len(result_df) for result_df, _ in written] == [4, 4, 4]
+    assert [file_path.startswith(PREFIX) for _, file_path in written] == [
+        True,
+        True,
+        False,
+    ]
+    writer.flush()
+    assert sum(len(result_df) for result_df, _ in written) == 15
+
+
+def test_buffers_are_written_at_the_byte_and_age_thresholds():
+    writer, written = get_writer(max_bytes=1)
+    writer.add(PREFIX, pd.DataFrame({"value": [1]}))
+    assert len(written) == 1
+    writer, written = get_writer(max_age_seconds=0)
+    writer.add(PREFIX, pd.DataFrame({"value": [1]}))
+    assert len(written) == 1
+    writer, written = get_writer()
+    writer.add(PREFIX, pd.DataFrame({"value": [1]}))
+    writer.max_age_seconds = 0
+    writer.flush_expired()
+    assert len(written) == 1
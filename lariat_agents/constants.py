@@ -31,6 +31,10 @@ AZURE_STORAGE_CONFIG_CONNECTION_STRING = os.getenv(
 LARIAT_SINK_AWS_ACCESS_KEY_ID = os.getenv("LARIAT_SINK_AWS_ACCESS_KEY_ID")
 LARIAT_SINK_AWS_SECRET_ACCESS_KEY = os.getenv("LARIAT_SINK_AWS_SECRET_ACCESS_KEY")
 LARIAT_SINK_CREDENTIALS_REGION_NAME = "us-east-2"
+# Assumed role credentials of the lariat sink are reused for this long (the role's sessions last an hour)
+LARIAT_SINK_CREDENTIALS_TTL_SECONDS = int(
+    os.getenv("LARIAT_SINK_CREDENTIALS_TTL_SECONDS", 45 * 60)
+)
 AZURE_STORAGE_CONFIG_CONTAINER = os.getenv("AZURE_STORAGE_CONFIG_CONTAINER")
 LARIAT_OUTPUT_BUCKET = os.getenv("LARIAT_OUTPUT_BUCKET")
 LARIAT_API_KEY = os.getenv("LARIAT_API_KEY")
@@ -55,8 +59,120 @@ LARIAT_PROCESS_SCHEMA_URL = f"{LARIAT_PYTHON_API_BASE_URL}/process_streaming_sch
 PERSIST_UNIQUE_DIMENSION_VALUES = os.getenv("PERSIST_DIMENSION_VALUES", True)
 LARIAT_PAYLOAD_SOURCE = os.getenv("LARIAT_PAYLOAD_SOURCE")
 EVENT_PAYLOAD_OUTPUT_KEY_PREFIX = "streaming_events"
-EVENT_PAYLOAD_MAX_CONTENT_LENGTH_BYTES = 5 * 1024 * 1024
-STREAMING_CHUNKSIZE = os.getenv("STREAMING_CHUNKSIZE", 600000)
+# Streaming results are buffered per dataset and written once a buffer holds this many rows or bytes, is this
+# old, or the invocation ends
+STREAMING_RESULT_MAX_ROWS = int(os.getenv("STREAMING_RESULT_MAX_ROWS", 1000000))
+STREAMING_RESULT_MAX_BYTES = int(
+    os.getenv("STREAMING_RESULT_MAX_BYTES", 64 * 1024 * 1024)
+)
+STREAMING_RESULT_MAX_AGE_SECONDS = float(
+    os.getenv("STREAMING_RESULT_MAX_AGE_SECONDS", 60)
+)
+# Objects of one invocation processed concurrently: matched, sniffed and computed by threads. Computing them in
+# forked worker processes is opt-in (EVENT_PAYLOAD_COMPUTE_PROCESSES=true) and never done on lambda, which has no
+# /dev/shm for the pool's queues and semaphores
+EVENT_PAYLOAD_OBJECT_CONCURRENCY = int(os.getenv("EVENT_PAYLOAD_OBJECT_CONCURRENCY", 4))
+EVENT_PAYLOAD_COMPUTE_PROCESSES = (
+    os.getenv("EVENT_PAYLOAD_COMPUTE_PROCESSES", "false").lower() == "true"
+    and os.getenv("AWS_LAMBDA_FUNCTION_NAME") is None
+)
+# Daemon mode of the event payload agent (see event_payload_daemon_executor): trigger events are consumed from
+# an SQS compatible queue (EVENT_PAYLOAD_DAEMON_ENDPOINT_URL points at e.g. ElasticMQ) or a directory spool
+EVENT_PAYLOAD_DAEMON_QUEUE_URL = os.getenv("EVENT_PAYLOAD_DAEMON_QUEUE_URL")
+EVENT_PAYLOAD_DAEMON_ENDPOINT_URL = os.getenv("EVENT_PAYLOAD_DAEMON_ENDPOINT_URL")
+EVENT_PAYLOAD_DAEMON_SPOOL_DIR = os.getenv("EVENT_PAYLOAD_DAEMON_SPOOL_DIR")
+# Messages processed together, their objects are coalesced and computed EVENT_PAYLOAD_OBJECT_CONCURRENCY at a time
+EVENT_PAYLOAD_DAEMON_BATCH_SIZE = int(os.getenv("EVENT_PAYLOAD_DAEMON_BATCH_SIZE", 50))
+EVENT_PAYLOAD_DAEMON_WAIT_SECONDS = int(
+    os.getenv("EVENT_PAYLOAD_DAEMON_WAIT_SECONDS", 20)
+)
+# Messages of the batch being processed are kept invisible this long, extended every half of it
+EVENT_PAYLOAD_DAEMON_VISIBILITY_TIMEOUT_SECONDS = int(
+    os.getenv("EVENT_PAYLOAD_DAEMON_VISIBILITY_TIMEOUT_SECONDS", 300)
+)
+# Rows per streamed chunk. Unset, the execution planner sizes chunks against the memory budget within
+# [STREAMING_MIN_CHUNKSIZE, STREAMING_MAX_CHUNKSIZE]
+STREAMING_CHUNKSIZE = (
+    int(os.getenv("STREAMING_CHUNKSIZE")) if os.getenv("STREAMING_CHUNKSIZE") else None
+)
+STREAMING_MIN_CHUNKSIZE = int(os.getenv("STREAMING_MIN_CHUNKSIZE", 10000))
+STREAMING_MAX_CHUNKSIZE = int(os.getenv("STREAMING_MAX_CHUNKSIZE", 600000))
+# Worker processes used for streamed chunks (1 processes chunks in the agent's process)
+STREAMING_WORKERS = int(os.getenv("STREAMING_WORKERS", 1))
+# Chunks read ahead of the workers, bounds the memory used by a parallel run
+STREAMING_MAX_IN_FLIGHT_CHUNKS = int(
+    os.getenv("STREAMING_MAX_IN_FLIGHT_CHUNKS", 2 * STREAMING_WORKERS)
+)
+# Memory the running aggregate of streamed chunks can use before its groups are spilled to disk
+STREAMING_FOLD_MEMORY_BYTES = int(
+    os.getenv("STREAMING_FOLD_MEMORY_BYTES", 128 * 1024 * 1024)
+)
+STREAMING_SPILL_DIR = os.getenv("STREAMING_SPILL_DIR", "/tmp")
+STREAMING_SPILL_PARTITIONS = int(os.getenv("STREAMING_SPILL_PARTITIONS", 16))
+# Threads fetching byte ranges of uncompressed jsonl/csv objects (1 reads the object sequentially)
+STREAMING_RANGE_READERS = int(os.getenv("STREAMING_RANGE_READERS", 1))
+STREAMING_RANGE_BYTES = int(os.getenv("STREAMING_RANGE_BYTES", 64 * 1024 * 1024))
+# Threads decoding a gzip object while it is read, 0 decodes in the reading thread (e.g. on a single vCPU).
+# A gzip stream can only be decoded sequentially, so ISA-L uses one background thread for any value above 0:
+# objects are decoded in parallel with each other (EVENT_PAYLOAD_OBJECT_CONCURRENCY), not within an object
+GZIP_DECOMPRESSION_THREADS = int(os.getenv("GZIP_DECOMPRESSION_THREADS", 1))
+# Bytes of jsonl lines the arrow engine parses at a time when streaming, and the blocks pyarrow's json reader
+# splits them into (parsed in parallel)
+STREAMING_JSON_BLOCK_BYTES = int(
+    os.getenv("STREAMING_JSON_BLOCK_BYTES", 16 * 1024 * 1024)
+)
+STREAMING_JSON_PARSE_BLOCK_BYTES = int(
+    os.getenv("STREAMING_JSON_PARSE_BLOCK_BYTES", 1024 * 1024)
+)
+# Byte range cache shared by every read of a payload object during an invocation
+PAYLOAD_OBJECT_BLOCK_SIZE = int(os.getenv("PAYLOAD_OBJECT_BLOCK_SIZE", 4 * 1024 * 1024))
+PAYLOAD_OBJECT_CACHE_BYTES = int(
+    os.getenv("PAYLOAD_OBJECT_CACHE_BYTES", 256 * 1024 * 1024)
+)
+# Memory the execution planner keeps decoded payloads within. Defaults to the function's memory size
+# (lambda, cloud functions) minus headroom for the runtime and the payload object cache.
+EVENT_PAYLOAD_MEMORY_SIZE_BYTES = (
+    int(
+        os.getenv(
+            "AWS_LAMBDA_FUNCTION_MEMORY_SIZE", os.getenv("FUNCTION_MEMORY_MB", 1024)
+        )
+    )
+    * 1024
+    * 1024
+)
+EVENT_PAYLOAD_MEMORY_HEADROOM_BYTES = int(
+    os.getenv("EVENT_PAYLOAD_MEMORY_HEADROOM_BYTES", 256 * 1024 * 1024)
+)
+EVENT_PAYLOAD_MEMORY_BUDGET_BYTES = int(
+    os.getenv(
+        "EVENT_PAYLOAD_MEMORY_BUDGET_BYTES",
+        max(
+            EVENT_PAYLOAD_MEMORY_SIZE_BYTES
+            - EVENT_PAYLOAD_MEMORY_HEADROOM_BYTES
+            - PAYLOAD_OBJECT_CACHE_BYTES,
+            64 * 1024 * 1024,
+        ),
+    )
+)
+# Where duckdb installs and loads extensions from (e.g. avro), its default location is under the home directory
+DUCKDB_EXTENSION_DIRECTORY = os.getenv("DUCKDB_EXTENSION_DIRECTORY")
+# Freshness buckets (minutes between the primary timestamp and a freshness timestamp).
+# Future buckets (edges <= 0) include their lower edge, past buckets include their upper edge.
+FRESHNESS_BUCKET_EDGES = [-60, 0, 5, 10, 20, 30, 60, 120, 180, 1440]
+FRESHNESS_BUCKET_LABELS = [
+    "future: >1 hour",
+    "future: 0-1 hour",
+    "0-5min",
+    "5-10min",
+    "10-20min",
+    "20-30min",
+    "30-60min",
+    "1-2h",
+    "2-3h",
+    "3-24h",
+    ">24h",
+]
+FRESHNESS_MISSING_LABEL = "0"
 
 ORG_ID = "org_id"
 AGENT_INTER_QUERY_GAP = 1.0  # time to wait before launching another query in seconds
@@ -98,6 +214,16 @@ RESULT_DF_RESERVED_FIELDS = [
     RESULT_OUTPUT_LOOKBACK_RANGE_START_TS,
 ]
 RESULTS_DF_INDICATOR_COL_PREFIX = "_indicator_"
+RESULTS_DF_DIMENSION_COL_PREFIX = "dim|"
+RESULTS_DF_TIME_COL_PREFIXES = ("time|", "primary_time|")
+
+# Result File Formats (the lariat sink's output_format)
+RESULT_OUTPUT_FORMAT_CSV = "csv"
+RESULT_OUTPUT_FORMAT_PARQUET = "parquet"
+RESULT_OUTPUT_FORMAT_COMPRESSIONS = {
+    RESULT_OUTPUT_FORMAT_CSV: None,
+    RESULT_OUTPUT_FORMAT_PARQUET: "zstd",
+}
 
 # Sink Type Descriptors
 LARIAT_SINK_TYPE = "lariat"
@@ -9,14 +9,93 @@ from lariat_agents.constants import (
     GCP_CROSS_ACCOUNT_ROLE_BASE_ARN,
     USER_CLOUD_ACCOUNT_ID,
     LARIAT_SINK_CREDENTIALS_REGION_NAME,
+    LARIAT_SINK_CREDENTIALS_TTL_SECONDS,
     RESULT_OUTPUT_RESULT_MAX_TS,
     RESULT_OUTPUT_RESULT_MIN_TS,
+    RESULT_DF_RESERVED_FIELDS,
+    RESULTS_DF_INDICATOR_COL_PREFIX,
+    RESULTS_DF_DIMENSION_COL_PREFIX,
+    RESULTS_DF_TIME_COL_PREFIXES,
+    RESULT_OUTPUT_FORMAT_CSV,
+    RESULT_OUTPUT_FORMAT_PARQUET,
+    RESULT_OUTPUT_FORMAT_COMPRESSIONS,
 )
 from lariat_agents.base.base_sink import BaseSink
 import boto3
+import fsspec
+import pyarrow as pa
+import pyarrow.parquet as pq
 from typing import Dict
 from lariat_python_common.aws import utils as aws_utils
 import logging
+import time
+
+COMPRESSION_EXTENSIONS = {"gzip": "gz", "bz2": "bz2", "zstd": "zst", "xz": "xz"}
+# Keys of the lariat sink's config passed to LariatSink
+LARIAT_SINK_CONFIG_KEYS = ("output_format", "compression")
+
+
+def coerce_timestamp_column(values: pd.Series) -> pd.Series:
+    """
+    Timestamp result columns hold epoch seconds or datetimes. Epoch seconds (numbers, or text of numbers) become
+    nullable int64, datetimes (or datetime text) UTC datetimes. Anything else is left as it is.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return pd.to_datetime(values, utc=True)
+    numeric_values = pd.to_numeric(values, errors="coerce")
+    if numeric_values.notna().sum() == values.notna().sum():
+        return numeric_values.round().astype("Int64")
+    datetime_values = pd.to_datetime(values, errors="coerce", utc=True)
+    if datetime_values.notna().sum() == values.notna().sum():
+        return datetime_values
+    return values
+
+
+def get_result_table(result_df: pd.DataFrame) -> pa.Table:
+    """
+    Arrow table of a result frame with explicit types for the dimension (string), indicator (float64) and
+    timestamp (int64 epoch seconds or UTC timestamps) columns. Other columns keep their inferred types.
+    """
+    result_df = result_df.copy()
+    fields = []
+    for col in result_df.columns:
+        if col.startswith(RESULTS_DF_DIMENSION_COL_PREFIX):
+            result_df[col] = result_df[col].astype("string")
+            fields.append(pa.field(col, pa.string()))
+        elif col.startswith(RESULTS_DF_INDICATOR_COL_PREFIX):
+            result_df[col] = pd.to_numeric(result_df[col], errors="coerce")
+            fields.append(pa.field(col, pa.float64()))
+        elif (
+            col.startswith(RESULTS_DF_TIME_COL_PREFIXES)
+            or col in RESULT_DF_RESERVED_FIELDS
+        ):
+            result_df[col] = coerce_timestamp_column(result_df[col])
+            if pd.api.types.is_datetime64_any_dtype(result_df[col]):
+                fields.append(pa.field(col, pa.timestamp("us", tz="UTC")))
+            elif pd.api.types.is_integer_dtype(result_df[col]):
+                fields.append(pa.field(col, pa.int64()))
+            else:
+                fields.append(pa.field(col, pa.string()))
+                result_df[col] = result_df[col].astype("string")
+        else:
+            fields.append(
+                pa.Schema.from_pandas(result_df[[col]], preserve_index=False).field(col)
+            )
+    return pa.Table.from_pandas(
+        result_df, schema=pa.schema(fields), preserve_index=False
+    )
+
+
+def get_lariat_sink_args(sink_args: Dict) -> Dict:
+    """
+    LariatSink arguments of the lariat sink's config, other keys are logged and ignored
+    :param sink_args: the sink's config, None when it is empty
+    """
+    sink_args = sink_args or {}
+    unknown_keys = [key for key in sink_args if key not in LARIAT_SINK_CONFIG_KEYS]
+    if unknown_keys:
+        logging.warning(f"Ignoring unknown lariat sink config keys: {unknown_keys}")
+    return {key: sink_args[key] for key in LARIAT_SINK_CONFIG_KEYS if key in sink_args}
 
 
 class LariatSink(BaseSink):
@@ -28,13 +107,72 @@ class LariatSink(BaseSink):
     def __init__(
         self,
         source_cloud: str,
+        output_format: str = RESULT_OUTPUT_FORMAT_CSV,
+        compression: str = None,
     ):
+        """
+        :param source_cloud:
+        :param output_format: format of the result files, csv (the default) or parquet
+        :param compression: compression of the result files, by default zstd for parquet and none for csv (which
+        also supports gzip, bz2, zstd...)
+        """
         self.s3_client = None
         self.azure_container_client = None
         if source_cloud == CLOUD_TYPE_AWS:
             self.s3_client = boto3.client("s3")
+        if output_format not in RESULT_OUTPUT_FORMAT_COMPRESSIONS:
+            raise ValueError(f"Unsupported lariat sink output format: {output_format}")
+        self.output_format = output_format
+        self.compression = (
+            compression or RESULT_OUTPUT_FORMAT_COMPRESSIONS[output_format]
+        )
+        self.credentials = None
+        self.credentials_expire_at = 0
         super().__init__(source_cloud)
 
+    def get_credentials(self, role_arn_prefix):
+        """
+        Assumed role credentials of the sink, reused for LARIAT_SINK_CREDENTIALS_TTL_SECONDS so that long-running
+        agents don't assume the role for every write
+        :return: tuple of (aws_access_key_id, aws_secret_key, aws_session_token)
+        """
+        if self.credentials is None or time.monotonic() >= self.credentials_expire_at:
+            self.credentials = aws_utils.get_and_decrypt_keypair(
+                aws_access_key_id=LARIAT_SINK_AWS_ACCESS_KEY_ID,
+                aws_secret_access_key=LARIAT_SINK_AWS_SECRET_ACCESS_KEY,
+                customer_account_id=USER_CLOUD_ACCOUNT_ID,
+                role_arn_prefix=role_arn_prefix,
+                region_name=LARIAT_SINK_CREDENTIALS_REGION_NAME,
+            )
+            self.credentials_expire_at = (
+                time.monotonic() + LARIAT_SINK_CREDENTIALS_TTL_SECONDS
+            )
+        return self.credentials
+
+    @property
+    def file_extension(self):
+        if self.output_format == RESULT_OUTPUT_FORMAT_PARQUET:
+            return RESULT_OUTPUT_FORMAT_PARQUET
+        if self.compression:
+            return f"{RESULT_OUTPUT_FORMAT_CSV}.{COMPRESSION_EXTENSIONS.get(self.compression, self.compression)}"
+        return RESULT_OUTPUT_FORMAT_CSV
+
+    def write_result_file(
+        self, result_df: pd.DataFrame, path: str, storage_options: Dict
+    ):
+        if self.output_format == RESULT_OUTPUT_FORMAT_PARQUET:
+            with fsspec.open(path, "wb", **storage_options) as f:
+                pq.write_table(
+                    get_result_table(result_df), f, compression=self.compression
+                )
+        else:
+            result_df.to_csv(
+                path,
+                index=False,
+                compression=self.compression,
+                storage_options=storage_options,
+            )
+
     def write(
         self,
         result_df: pd.DataFrame = None,
@@ -47,6 +185,8 @@ class LariatSink(BaseSink):
         OR copying data from the source_top_level and file_path to the file_path in LARIAT_OUTPUT_BUCKET.
         If a source_top_level and file_path are passed in, the result_df is ignored.
 
+        Results are written in the sink's output format, the file path is used as it is.
+
         This sink doesn't support tags.
         """
         if self.source_cloud == CLOUD_TYPE_GCP:
@@ -58,13 +198,7 @@ class LariatSink(BaseSink):
                 access_key_id,
                 secret_access_key,
                 session_token,
-            ) = aws_utils.get_and_decrypt_keypair(
-                aws_access_key_id=LARIAT_SINK_AWS_ACCESS_KEY_ID,
-                aws_secret_access_key=LARIAT_SINK_AWS_SECRET_ACCESS_KEY,
-                customer_account_id=USER_CLOUD_ACCOUNT_ID,
-                role_arn_prefix=role_arn_prefix,
-                region_name=LARIAT_SINK_CREDENTIALS_REGION_NAME,
-            )
+            ) = self.get_credentials(role_arn_prefix)
             if source_top_level and file_path:
                 if self.source_cloud == CLOUD_TYPE_AWS:
                     athena_source_location = {
@@ -96,10 +230,10 @@ class LariatSink(BaseSink):
                             "No data available for indicators: No Indicators Written"
                         )
                         return
-                    result_df.to_csv(
+                    self.write_result_file(
+                        result_df,
                         f"s3://{LARIAT_OUTPUT_BUCKET}/{file_path}",
-                        index=False,
-                        storage_options={
+                        {
                             "key": access_key_id,
                             "secret": secret_access_key,
                             "token": session_token,
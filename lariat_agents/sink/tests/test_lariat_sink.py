@@ -0,0 +1,79 @@
+import gzip
+import logging
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from lariat_agents.constants import CLOUD_TYPE_NONE
+from lariat_agents.sink.lariat_sink import (
+    LariatSink,
+    get_lariat_sink_args,
+    get_result_table,
+)
+
+RESULT_DF = pd.DataFrame(
+    {
+        "dim|country": pd.Categorical(["US", "FR"]),
+        "dim|code": [1, None],
+        "primary_time|ts": [1700000000.0, None],
+        "time|max_ts": ["1700000000", "1700000060"],
+        "_result_max_ts": pd.to_datetime(["2024-01-01", "2024-01-02"]),
+        "_result_min_ts": ["2024-01-01 00:00:00", None],
+        "_indicator_value": ["1.5", 2],
+        "count|value|k": [3, 4],
+    }
+)
+
+
+def test_get_result_table_types():
+    schema = get_result_table(RESULT_DF).schema
+    assert schema.field("dim|country").type == pa.string()
+    assert schema.field("dim|code").type == pa.string()
+    assert schema.field("primary_time|ts").type == pa.int64()
+    assert schema.field("time|max_ts").type == pa.int64()
+    assert schema.field("_result_max_ts").type == pa.timestamp("us", tz="UTC")
+    assert schema.field("_result_min_ts").type == pa.timestamp("us", tz="UTC")
+    assert schema.field("_indicator_value").type == pa.float64()
+    assert schema.field("count|value|k").type == pa.int64()
+
+
+@pytest.mark.parametrize(
+    "output_format,compression,file_extension",
+    [
+        ("csv", None, "csv"),
+        ("csv", "gzip", "csv.gz"),
+        ("parquet", None, "parquet"),
+    ],
+)
+def test_write_result_file(tmp_path, output_format, compression, file_extension):
+    sink = LariatSink(CLOUD_TYPE_NONE, output_format, compression)
+    assert sink.file_extension == file_extension
+    path = tmp_path / f"result_1.{file_extension}"
+    sink.write_result_file(RESULT_DF, str(path), {})
+    if output_format == "parquet":
+        table = pq.read_table(path)
+        assert (
+            pq.ParquetFile(path).metadata.row_group(0).column(0).compression == "ZSTD"
+        )
+        assert table.column("time|max_ts").to_pylist() == [1700000000, 1700000060]
+    elif compression == "gzip":
+        assert gzip.decompress(path.read_bytes()).startswith(b"dim|country,")
+    else:
+        assert path.read_bytes().startswith(b"dim|country,")
+
+
+def test_unsupported_output_format():
+    with pytest.raises(ValueError):
+        LariatSink(CLOUD_TYPE_NONE, "xlsx")
+
+
+def test_get_lariat_sink_args(caplog):
+    with caplog.at_level(logging.WARNING):
+        sink_args = get_lariat_sink_args(
+            {"output_format": "parquet", "bucket": "results", "compression": "zstd"}
+        )
+    assert sink_args == {"output_format": "parquet", "compression": "zstd"}
+    assert "['bucket']" in caplog.text
+    assert get_lariat_sink_args(None) == {}
@@ -0,0 +1,72 @@
+import gzip
+import json
+
+import pandas as pd
+import pytest
+
+from lariat_python_common.io.utils import (
+    get_byte_ranges,
+    get_df_iterator_from_byte_ranges,
+)
+
+RECORDS = [
+    {"id": i, "name": f"name_{i}", "value": i * 1.5 if i % 7 else None}
+    for i in range(100)
+]
+
+
+def test_get_byte_ranges():
+    assert get_byte_ranges(10, 4) == [(0, 4), (4, 4), (8, 2)]
+    assert get_byte_ranges(8, 4) == [(0, 4), (4, 4)]
+    assert get_byte_ranges(0, 4) == []
+
+
+@pytest.mark.parametrize("range_bytes", [1, 50, 999, 10**6])
+@pytest.mark.parametrize("concurrency", [1, 3])
+def test_get_df_iterator_from_byte_ranges_jsonl(tmp_path, range_bytes, concurrency):
+    """
+    Every line is read exactly once, in order, whatever the range size.
+    """
+    path = tmp_path / "payload.jsonl"
+    path.write_text("\n".join(json.dumps(record) for record in RECORDS) + "\n")
+    dfs = list(
+        get_df_iterator_from_byte_ranges(
+            str(path),
+            lambda f: pd.read_json(f, lines=True),
+            range_bytes,
+            concurrency,
+        )
+    )
+    result = pd.concat(dfs, ignore_index=True)
+    assert result["id"].tolist() == list(range(len(RECORDS)))
+    assert result["value"].isna().sum() == pd.DataFrame(RECORDS)["value"].isna().sum()
+
+
+@pytest.mark.parametrize("range_bytes", [1, 64, 10**6])
+def test_get_df_iterator_from_byte_ranges_csv(tmp_path, range_bytes):
+    """
+    The header is repeated for every range and the last line doesn't need a trailing newline.
+    """
+    path = tmp_path / "payload.csv"
+    pd.DataFrame(RECORDS).to_csv(path, index=False)
+    path.write_text(path.read_text().rstrip("\n"))
+    dfs = list(
+        get_df_iterator_from_byte_ranges(
+            str(path), pd.read_csv, range_bytes, 4, repeat_header=True
+        )
+    )
+    result = pd.concat(dfs, ignore_index=True)
+    assert list(result.columns) == ["id", "name", "value"]
+    pd.testing.assert_frame_equal(result, pd.read_csv(path))
+
+
+def test_get_df_iterator_from_byte_ranges_compressed(tmp_path):
+    path = tmp_path / "payload.jsonl.gz"
+    with gzip.open(path, "wt") as f:
+        f.write(json.dumps(RECORDS[0]))
+    assert (
+        get_df_iterator_from_byte_ranges(
+            str(path), lambda f: pd.read_json(f, lines=True), 100, 2
+        )
+        is None
+    )
@@ -2,7 +2,11 @@ import boto3
 from azure.storage.blob import (
     BlobServiceClient,
 )
-from io import StringIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+import fsspec
+from fsspec.utils import infer_compression
 from lariat_python_common.types.types import CloudTypeModes
 
 CLOUD_TYPE_AWS = CloudTypeModes.AWS.value
@@ -60,3 +64,69 @@ def write_stringio_to_cloud(string_io_buffer, path_elements, cloud):
     elif cloud == CLOUD_TYPE_NONE:
         with open(path_elements) as file_object:
             return file_object
+
+
+def get_byte_ranges(size, range_bytes):
+    """
+    Split an object of size bytes into (offset, length) ranges of at most range_bytes
+    """
+    return [
+        (offset, min(range_bytes, size - offset)) for offset in range(0, size, range_bytes)
+    ]
+
+
+def read_newline_delimited_range(fs, path, offset, length, header=b""):
+    """
+    Read the lines that start within [offset, offset + length) of a newline delimited object.
+    Ranges after the first one are prefixed with header (e.g. the csv header line).
+    """
+    block = fs.read_block(path, offset, length, delimiter=b"\n")
+    if offset and header and block:
+        return header + block
+    return block
+
+
+def get_df_iterator_from_byte_ranges(
+    path, parse_range, range_bytes, concurrency, repeat_header=False
+):
+    """
+    Read a newline delimited object (jsonl, csv) as newline aligned byte ranges that are fetched and parsed
+    concurrently. At most 2 * concurrency ranges are held in memory, dataframes are yielded in object order.
+    Compressed objects can't be split and return None so the caller can fall back to a sequential reader.
+    Quoted values containing newlines (csv) aren't supported as ranges are split on every newline.
+    :param path: fsspec path
+    :param parse_range: callable turning a BytesIO of complete lines into a dataframe
+    :param range_bytes: approximate size of each range
+    :param concurrency: number of ranges fetched and parsed at the same time
+    :param repeat_header: prefix every range with the object's first line
+    :return:
+    """
+    fs, fs_path = fsspec.core.url_to_fs(path)
+    if infer_compression(fs_path):
+        return None
+
+    def parse(offset, length, header):
+        block = read_newline_delimited_range(fs, fs_path, offset, length, header)
+        if not block.strip():
+            return None
+        return parse_range(BytesIO(block))
+
+    def df_iterator():
+        ranges = get_byte_ranges(fs.size(fs_path), range_bytes)
+        header = b""
+        if repeat_header and ranges:
+            header = fs.read_block(fs_path, 0, 1, delimiter=b"\n")
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            in_flight = deque()
+            for offset, length in ranges:
+                if len(in_flight) >= 2 * concurrency:
+                    df = in_flight.popleft().result()
+                    if df is not None and not df.empty:
+                        yield df
+                in_flight.append(executor.submit(parse, offset, length, header))
+            while in_flight:
+                df = in_flight.popleft().result()
+                if df is not None and not df.empty:
+                    yield df
+
+    return df_iterator()
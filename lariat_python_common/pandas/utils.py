@@ -1,8 +1,5 @@
 import duckdb
 import logging
-import fsspec
-from fastavro import reader
-import pandas as pd
 
 
 def run_sql_query(
@@ -20,16 +17,3 @@ def run_sql_query(
         logging.error(e)
     return res
 
-
-# Generator function to read Avro file in chunks
-def get_df_iterator_from_avro(path, chunksize=None):
-    with fsspec.open(path, mode="rb") as f:
-        avro_reader = reader(f)
-        batch = []
-        for record in avro_reader:
-            batch.append(record)
-            if chunksize and len(batch) >= chunksize:
-                yield pd.DataFrame(batch)
-                batch = []
-        if batch:
-            yield pd.DataFrame(batch)
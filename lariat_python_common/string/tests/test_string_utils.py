@@ -40,3 +40,36 @@ def test_tokenize(
         )
         == expected
     )
+
+
+@pytest.mark.parametrize(
+    "suffix,partition_pattern,expected",
+    [
+        (
+            "year=2024/month=01/file.json",
+            "{year}/{month}",
+            {"year": "2024", "month": "01"},
+        ),
+        ("2024/01/file.json", "<year>/<month>", {"year": "2024", "month": "01"}),
+        ("a=1/b=2/file.json", "{*}/{b}", {"a": "1", "b": "2"}),
+        ("month=01/file.json", "{year}", {}),
+    ],
+)
+def test_compiled_lariat_file_partition_pattern(suffix, partition_pattern, expected):
+    compiled_pattern = lariat_string_utils.compile_lariat_file_partition_pattern(
+        partition_pattern
+    )
+    # The compiled pattern is reused across suffixes
+    for _ in range(2):
+        assert (
+            lariat_string_utils.match_compiled_lariat_file_partition_pattern(
+                suffix, compiled_pattern
+            )
+            == expected
+        )
+    assert (
+        lariat_string_utils.match_lariat_file_partition_pattern(
+            suffix, partition_pattern
+        )
+        == expected
+    )
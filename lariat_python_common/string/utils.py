@@ -2,7 +2,6 @@
     Lariat Python Utilities for String Manipulation/Handling
 """
 import re
-from collections import deque
 
 
 DEFAULT_WILDCARD_CHAR = "*"
@@ -47,52 +46,77 @@ def tokenize(string, separator=",", open_delimiter="(", close_delimiter=")"):
     return separated_list
 
 
-def match_lariat_file_partition_pattern(
-    suffix, partition_pattern, partition_key="=", wildcard_char=DEFAULT_WILDCARD_CHAR
+def compile_lariat_file_partition_pattern(
+    partition_pattern, partition_key="=", wildcard_char=DEFAULT_WILDCARD_CHAR
 ):
-    matched_partition_and_key = {}
-
+    """
+    Compile a lariat file partition pattern (e.g. "{year}/{month}/<name>") once, so that it can be matched against
+    many suffixes with match_compiled_lariat_file_partition_pattern
+    :param partition_pattern: partition pattern
+    :param partition_key: separator between partition names and values
+    :param wildcard_char: variable matching any partition name
+    :return: compiled regex and the partition rule of each section of the pattern
+    """
     # Extract variable names within curly braces, and angular brackets if suffix matches
     matches = re.findall(r"{([^}]+)}|([^{}\/<>]+)|<([^<>]+)>", partition_pattern)
     pattern_parts = []
-    varname_deque = (
-        deque()
-    )  # This keeps track of the partition rules per sectional definition
+    varnames = []  # This keeps track of the partition rules per sectional definition
     for var, text, key in matches:
         if var:
             if var != wildcard_char:
                 pattern_parts.append(f"{var}{partition_key}(.+?)")
-                varname_deque.append(var)
+                varnames.append(var)
             else:
                 pattern_parts.append(f"(.+?){partition_key}(.+?)")
-                varname_deque.append("*")
+                varnames.append("*")
         elif text:
             pattern_parts.append(text)
             if partition_key in text:
-                varname_deque.append(text.split(partition_key)[0])
+                varnames.append(text.split(partition_key)[0])
             else:
-                varname_deque.append(None)
+                varnames.append(None)
         elif key:
             pattern_parts.append(f"(.+?)")
-            varname_deque.append(key)
+            varnames.append(key)
 
     pattern_to_be_matched = "/".join(pattern_parts) + "/"
-    pattern_match = re.match(pattern_to_be_matched, suffix)
-    if pattern_match:
-        suffix_list = suffix.split("/")
-        matched_partition_and_key = {}
-        for elem in suffix_list:
-            if len(varname_deque) > 0:
-                varname = varname_deque.popleft()
-                if varname:
-                    if partition_key in elem:
-                        key, val = elem.split(partition_key)
-                        matched_partition_and_key[key] = val
-                    else:
-                        matched_partition_and_key[varname] = elem
+    return re.compile(pattern_to_be_matched), tuple(varnames)
+
+
+def match_compiled_lariat_file_partition_pattern(
+    suffix, compiled_pattern, partition_key="="
+):
+    """
+    :param suffix: object key suffix
+    :param compiled_pattern: see compile_lariat_file_partition_pattern
+    :param partition_key: separator between partition names and values
+    :return: partition name -> value, empty when the suffix doesn't match
+    """
+    pattern, varnames = compiled_pattern
+    matched_partition_and_key = {}
+    if pattern.match(suffix):
+        for elem, varname in zip(suffix.split("/"), varnames):
+            if varname:
+                if partition_key in elem:
+                    key, val = elem.split(partition_key)
+                    matched_partition_and_key[key] = val
+                else:
+                    matched_partition_and_key[varname] = elem
     return matched_partition_and_key
 
 
+def match_lariat_file_partition_pattern(
+    suffix, partition_pattern, partition_key="=", wildcard_char=DEFAULT_WILDCARD_CHAR
+):
+    return match_compiled_lariat_file_partition_pattern(
+        suffix,
+        compile_lariat_file_partition_pattern(
+            partition_pattern, partition_key, wildcard_char
+        ),
+        partition_key,
+    )
+
+
 def get_next_word(input_string, prefix):
     pattern = prefix + r" (\w+)"
     match = re.search(pattern, input_string)